@@ -0,0 +1,216 @@
+"""Teste de carga com espectadores simulados percorrendo as rotas reais do app
+
+Uso: python -m src.benchmarks.carga [--espectadores 1000] [--concorrencia 50] [--consultas 5]
+                                    [--admins 2] [--url http://localhost:5001]
+                                    [--saida resultado.json] [--comparar anterior.json]
+
+Cada espectador faz salvar-nick -> iniciar-lurk -> consultas de status-lurk
+(com heartbeat) -> finalizar-lurk; os administradores consultam ranking,
+usuários online e agenda enquanto houver espectadores ativos.
+
+Sem --url o app roda no próprio processo pelo test client do Flask, com um
+banco descartável (DATABASE_URL); com --url a carga vai por HTTP a um servidor
+já em execução, que usa o próprio banco.
+"""
+import argparse
+import http.cookiejar
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+CONSULTAS_ADMIN = (
+    ('obter-ranking', 'GET', '/api/ranking/obter-ranking?pagina=1&por_pagina=50'),
+    ('usuarios-online', 'GET', '/api/usuarios-online?limite=100&campos=nick_canal,pontos'),
+    ('obter-agenda', 'GET', '/api/agenda/obter-agenda'),
+)
+
+class ClienteTeste:
+    """Requisições pelo test client do Flask (um cookie jar por cliente)"""
+
+    def __init__(self, app):
+        self._cliente = app.test_client()
+
+    def requisitar(self, metodo, caminho, dados=None):
+        resposta = self._cliente.open(caminho, method=metodo, json=dados)
+        return resposta.status_code, resposta.get_data(as_text=True)
+
+class ClienteHTTP:
+    """Requisições HTTP com urllib, mantendo o cookie de sessão"""
+
+    def __init__(self, url_base, timeout=30):
+        self._url_base = url_base.rstrip('/')
+        self._timeout = timeout
+        self._abridor = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def requisitar(self, metodo, caminho, dados=None):
+        corpo = json.dumps(dados).encode() if dados is not None else None
+        pedido = urllib.request.Request(self._url_base + caminho, data=corpo, method=metodo)
+        if corpo is not None:
+            pedido.add_header('Content-Type', 'application/json')
+        try:
+            with self._abridor.open(pedido, timeout=self._timeout) as resposta:
+                return resposta.status, resposta.read().decode()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read().decode()
+
+class Coletor:
+    """Latências e falhas por operação, compartilhado pelas threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencias = defaultdict(list)
+        self.erros = defaultdict(int)
+        self.erros_trava = 0
+
+    def medir(self, cliente, operacao, metodo, caminho, dados=None):
+        inicio = time.perf_counter()
+        try:
+            status, corpo = cliente.requisitar(metodo, caminho, dados)
+        except Exception as e:
+            status, corpo = None, str(e)
+        duracao = time.perf_counter() - inicio
+        # As rotas devolvem os erros do banco como JSON 500 com a mensagem original
+        travado = 'database is locked' in corpo
+        with self._lock:
+            self.latencias[operacao].append(duracao)
+            if status is None or status >= 400:
+                self.erros[operacao] += 1
+            if travado:
+                self.erros_trava += 1
+        return status, corpo
+
+def percentil(valores_ordenados, p):
+    """Percentil pelo método do posto mais próximo"""
+    if not valores_ordenados:
+        return None
+    return valores_ordenados[max(0, math.ceil(p / 100 * len(valores_ordenados)) - 1)]
+
+def espectador(cliente, coletor, nick, consultas, pausa):
+    coletor.medir(cliente, 'salvar-nick', 'POST', '/api/salvar-nick', {'nick_canal': nick})
+    coletor.medir(cliente, 'iniciar-lurk', 'POST', '/api/iniciar-lurk', {'tipo_janela': 'popup'})
+    for _ in range(consultas):
+        if pausa:
+            time.sleep(pausa)
+        coletor.medir(cliente, 'heartbeat', 'POST', '/api/heartbeat', {})
+        coletor.medir(cliente, 'status-lurk', 'GET', '/api/status-lurk')
+    coletor.medir(cliente, 'finalizar-lurk', 'POST', '/api/finalizar-lurk', {})
+
+def administrador(cliente, coletor, login, senha, parar):
+    status, _ = coletor.medir(cliente, 'admin-login', 'POST', '/api/admin/login', {'login': login, 'senha': senha})
+    if status != 200:
+        return
+    while not parar.is_set():
+        for operacao, metodo, caminho in CONSULTAS_ADMIN:
+            coletor.medir(cliente, operacao, metodo, caminho)
+
+def executar(novo_cliente, espectadores, concorrencia, consultas, admins, pausa, login, senha):
+    coletor = Coletor()
+    prefixo = uuid.uuid4().hex[:6]
+    parar = threading.Event()
+    threads_admin = [
+        threading.Thread(target=administrador, args=(novo_cliente(), coletor, login, senha, parar), daemon=True)
+        for _ in range(admins)
+    ]
+    for thread in threads_admin:
+        thread.start()
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        for i in range(espectadores):
+            executor.submit(espectador, novo_cliente(), coletor, f'carga-{prefixo}-{i}', consultas, pausa)
+    duracao = time.perf_counter() - inicio
+    parar.set()
+    for thread in threads_admin:
+        thread.join()
+
+    operacoes = {}
+    for operacao, latencias in sorted(coletor.latencias.items()):
+        latencias.sort()
+        operacoes[operacao] = {
+            'requisicoes': len(latencias),
+            'erros': coletor.erros[operacao],
+            'p50_ms': round(percentil(latencias, 50) * 1000, 2),
+            'p95_ms': round(percentil(latencias, 95) * 1000, 2),
+            'p99_ms': round(percentil(latencias, 99) * 1000, 2)
+        }
+    total = sum(item['requisicoes'] for item in operacoes.values())
+    return {
+        'duracao_s': round(duracao, 3),
+        'requisicoes': total,
+        'requisicoes_s': round(total / duracao, 1),
+        'erros': sum(coletor.erros.values()),
+        'erros_trava': coletor.erros_trava,
+        'operacoes': operacoes
+    }
+
+def imprimir(resultado):
+    print(f"{'operação':<16} {'req':>7} {'erros':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for operacao, item in resultado['operacoes'].items():
+        print(f"{operacao:<16} {item['requisicoes']:>7} {item['erros']:>6} "
+              f"{item['p50_ms']:>8.2f} {item['p95_ms']:>8.2f} {item['p99_ms']:>8.2f}")
+    print(f"\n{resultado['requisicoes']} requisições em {resultado['duracao_s']} s "
+          f"({resultado['requisicoes_s']} req/s), {resultado['erros']} erros, "
+          f"{resultado['erros_trava']} com 'database is locked'")
+
+def _variacao(atual, anterior):
+    if not anterior:
+        return '    -'
+    return f'{(atual - anterior) / anterior * 100:+6.1f}%'
+
+def comparar(resultado, anterior):
+    """Variação de vazão e do p95 de cada operação em relação a uma execução salva"""
+    print(f"\nComparação com a execução anterior (vazão {_variacao(resultado['requisicoes_s'], anterior['requisicoes_s'])})")
+    print(f"{'operação':<16} {'p95 antes':>10} {'p95 agora':>10} {'variação':>9}")
+    for operacao, item in resultado['operacoes'].items():
+        antes = anterior['operacoes'].get(operacao)
+        if antes is None:
+            continue
+        print(f"{operacao:<16} {antes['p95_ms']:>10.2f} {item['p95_ms']:>10.2f} {_variacao(item['p95_ms'], antes['p95_ms']):>9}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--espectadores', type=int, default=1000)
+    parser.add_argument('--concorrencia', type=int, default=50)
+    parser.add_argument('--consultas', type=int, default=5, help='status-lurk por espectador')
+    parser.add_argument('--pausa', type=float, default=0, help='segundos entre as consultas de um espectador')
+    parser.add_argument('--admins', type=int, default=2)
+    parser.add_argument('--url', help='servidor já em execução; sem ele usa o test client')
+    parser.add_argument('--login', default='ADM')
+    parser.add_argument('--senha', default='123')
+    parser.add_argument('--saida', help='grava o resultado em JSON')
+    parser.add_argument('--comparar', help='JSON de uma execução anterior')
+    args = parser.parse_args()
+
+    if args.url:
+        def novo_cliente():
+            return ClienteHTTP(args.url)
+    else:
+        # O banco descartável precisa estar definido antes de o app ser importado
+        diretorio = tempfile.mkdtemp(prefix='weblurk-carga-')
+        os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(diretorio, 'carga.db')}")
+        from src.main import app
+
+        def novo_cliente():
+            return ClienteTeste(app)
+
+    resultado = executar(
+        novo_cliente, args.espectadores, args.concorrencia, args.consultas,
+        args.admins, args.pausa, args.login, args.senha
+    )
+    imprimir(resultado)
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as arquivo:
+            comparar(resultado, json.load(arquivo)['resultado'])
+    if args.saida:
+        configuracao = {chave: valor for chave, valor in vars(args).items() if chave not in ('saida', 'comparar', 'senha')}
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            json.dump({'configuracao': configuracao, 'resultado': resultado}, arquivo, indent=2, ensure_ascii=False)
@@ -0,0 +1,93 @@
+"""Compara a concorrência de escrita/leitura do SQLite entre os perfis de engine
+
+Uso: python -m src.benchmarks.concorrencia_sqlite [--segundos 5] [--escritores 8] [--leitores 16]
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from src.models.database import db
+from src.models.perfil_sqlite import PERFIS, opcoes_engine, aplicar_perfil
+
+USUARIOS = 2000
+
+def preparar_banco(caminho, perfil):
+    engine = create_engine(f'sqlite:///{caminho}', **opcoes_engine(perfil))
+    aplicar_perfil(engine, perfil)
+    db.metadata.create_all(engine)
+    with engine.begin() as conexao:
+        conexao.execute(
+            text('INSERT INTO usuarios (nick_canal, pontos, online) VALUES (:nick, 0, 1)'),
+            [{'nick': f'viewer{i}'} for i in range(USUARIOS)]
+        )
+    return engine
+
+def medir(perfil, segundos, escritores, leitores):
+    with tempfile.TemporaryDirectory() as diretorio:
+        engine = preparar_banco(os.path.join(diretorio, 'bench.db'), perfil)
+        parar = threading.Event()
+        contagem = {'escritas': 0, 'leituras': 0, 'travado': 0}
+        trava_contagem = threading.Lock()
+
+        def somar(chave):
+            with trava_contagem:
+                contagem[chave] += 1
+
+        def escritor():
+            while not parar.is_set():
+                try:
+                    with engine.begin() as conexao:
+                        conexao.execute(
+                            text('UPDATE usuarios SET pontos = pontos + 1 WHERE id = :id'),
+                            {'id': random.randint(1, USUARIOS)}
+                        )
+                    somar('escritas')
+                except OperationalError as e:
+                    if 'locked' not in str(e):
+                        raise
+                    somar('travado')
+
+        def leitor():
+            while not parar.is_set():
+                try:
+                    with engine.connect() as conexao:
+                        conexao.execute(text('SELECT nick_canal, pontos FROM usuarios ORDER BY pontos DESC LIMIT 50')).all()
+                    somar('leituras')
+                except OperationalError as e:
+                    if 'locked' not in str(e):
+                        raise
+                    somar('travado')
+
+        threads = [threading.Thread(target=escritor) for _ in range(escritores)]
+        threads += [threading.Thread(target=leitor) for _ in range(leitores)]
+        for thread in threads:
+            thread.start()
+        time.sleep(segundos)
+        parar.set()
+        for thread in threads:
+            thread.join()
+        engine.dispose()
+
+    return {
+        'perfil': perfil,
+        'escritas_s': contagem['escritas'] / segundos,
+        'leituras_s': contagem['leituras'] / segundos,
+        'erros_trava': contagem['travado']
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--segundos', type=float, default=5)
+    parser.add_argument('--escritores', type=int, default=8)
+    parser.add_argument('--leitores', type=int, default=16)
+    parser.add_argument('--perfis', nargs='+', default=list(PERFIS))
+    args = parser.parse_args()
+
+    print(f"{'perfil':<12} {'escritas/s':>11} {'leituras/s':>11} {'erros trava':>12}")
+    for perfil in args.perfis:
+        r = medir(perfil, args.segundos, args.escritores, args.leitores)
+        print(f"{r['perfil']:<12} {r['escritas_s']:>11.0f} {r['leituras_s']:>11.0f} {r['erros_trava']:>12}")
@@ -0,0 +1,214 @@
+"""Gera um banco SQLite sintético em escala de produção para benchmarks e checagem de planos
+
+Uso: python -m src.benchmarks.gerar_dados caminho.db [--usuarios 200000] [--sessoes 2000000]
+                                          [--online 2000] [--dias 90] [--agenda-por-dia 40]
+                                          [--semente 42] [--substituir] [--explicar]
+
+A mesma semente gera sempre o mesmo banco. As sessões seguem uma cauda longa
+por usuário (poucos espectadores muito assíduos), concentram-se à noite e têm
+duração log-normal; os pontos dos usuários são a soma dos pontos das sessões.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import create_engine
+from src.models.database import db
+from src.models.migracoes import aplicar_migracoes, verificar_planos
+from src.services.pontuacao import INTERVALO_PONTUACAO
+
+# Linhas por executemany
+LOTE_INSERCAO = 100000
+
+# Peso de cada hora do dia no início das sessões (pico no horário nobre)
+PESO_HORAS = np.array([3, 2, 1, 1, 1, 1, 1, 2, 3, 4, 5, 6, 6, 6, 6, 7, 8, 10, 12, 14, 15, 14, 10, 6], dtype=float)
+
+# Expoente da lei de potência que distribui as sessões entre os usuários
+EXPOENTE_ASSIDUIDADE = 1.1
+# Teto de sessões esperadas por usuário por dia (nem o mais assíduo abre centenas)
+MAXIMO_SESSOES_DIA = 3
+
+# Duração das sessões: log-normal com mediana de 40 minutos, limitada a 8 horas
+MEDIANA_DURACAO_S = 40 * 60
+DISPERSAO_DURACAO = 1.0
+DURACAO_MAXIMA_S = 8 * 3600
+
+CANAIS_AGENDA = 300
+
+SQL_USUARIO = (
+    'INSERT INTO usuarios (id, nick_canal, pontos, online, tipo_janela, data_criacao, ultima_atividade) '
+    'VALUES (?, ?, ?, ?, ?, ?, ?)'
+)
+SQL_SESSAO = (
+    'INSERT INTO sessoes_lurk (usuario_id, tipo_janela, ativa, inicio_sessao, fim_sessao, pontos_gerados) '
+    'VALUES (?, ?, ?, ?, ?, ?)'
+)
+SQL_AGENDA = (
+    'INSERT INTO agenda (hora, data, link_plataforma, nome_canal, data_importacao) '
+    'VALUES (?, ?, ?, ?, ?)'
+)
+
+# Carga em massa num banco descartável: sem journal nem fsync
+PRAGMAS_CARGA = ('PRAGMA journal_mode = OFF', 'PRAGMA synchronous = OFF', 'PRAGMA cache_size = -262144')
+
+def _texto_datas(instantes):
+    """datetime64[us] no formato em que o SQLAlchemy grava DateTime no SQLite"""
+    return np.char.replace(np.datetime_as_string(instantes, unit='us'), 'T', ' ').tolist()
+
+def _inserir(conexao, sql, colunas):
+    linhas = list(zip(*colunas))
+    for inicio in range(0, len(linhas), LOTE_INSERCAO):
+        conexao.exec_driver_sql(sql, linhas[inicio:inicio + LOTE_INSERCAO])
+
+def gerar_sessoes(rng, usuarios, sessoes, online, dias, agora):
+    """Colunas das sessões em ordem cronológica (ids crescentes com o tempo, como em produção)"""
+    # Usuários sorteados com peso 1/posição^expoente, em ordem aleatória de id
+    pesos = 1.0 / np.arange(1, usuarios + 1) ** EXPOENTE_ASSIDUIDADE
+    rng.shuffle(pesos)
+    probabilidades = np.minimum(pesos / pesos.sum(), MAXIMO_SESSOES_DIA * dias / sessoes)
+    usuario_ids = rng.choice(usuarios, size=sessoes, p=probabilidades / probabilidades.sum()) + 1
+
+    dia = rng.integers(0, dias, size=sessoes)
+    hora = rng.choice(24, size=sessoes, p=PESO_HORAS / PESO_HORAS.sum())
+    segundo = rng.integers(0, 3600, size=sessoes)
+    inicio_janela = np.datetime64(agora - timedelta(days=dias), 'D')
+    inicio = (inicio_janela + dia.astype('timedelta64[D]')).astype('datetime64[us]') \
+        + (hora * 3600 + segundo).astype('timedelta64[s]')
+
+    duracao = np.minimum(
+        rng.lognormal(np.log(MEDIANA_DURACAO_S), DISPERSAO_DURACAO, size=sessoes), DURACAO_MAXIMA_S
+    ).astype(np.int64)
+    fim = inicio + duracao.astype('timedelta64[s]')
+    # Nada termina no futuro: sessões do último dia são encurtadas até agora
+    limite = np.datetime64(agora - timedelta(hours=3), 'us')
+    fim = np.minimum(fim, limite)
+    inicio = np.minimum(inicio, fim)
+
+    ordem = np.argsort(inicio, kind='stable')
+    usuario_ids, inicio, fim = usuario_ids[ordem], inicio[ordem], fim[ordem]
+    pontos = ((fim - inicio) // np.timedelta64(INTERVALO_PONTUACAO, 's')).astype(np.int64)
+    ativa = np.zeros(sessoes, dtype=np.int64)
+
+    # Os últimos espectadores em lurk agora: uma sessão ativa cada, iniciada nas últimas 2 horas
+    ids_online = rng.choice(usuarios, size=min(online, usuarios), replace=False) + 1
+    inicio_online = np.sort(
+        np.datetime64(agora, 'us') - rng.integers(60, 7200, size=len(ids_online)).astype('timedelta64[s]')
+    )
+    usuario_ids = np.concatenate([usuario_ids, ids_online])
+    inicio = np.concatenate([inicio, inicio_online])
+    fim = np.concatenate([fim, np.full(len(ids_online), np.datetime64('NaT'), dtype='datetime64[us]')])
+    pontos = np.concatenate([pontos, np.zeros(len(ids_online), dtype=np.int64)])
+    ativa = np.concatenate([ativa, np.ones(len(ids_online), dtype=np.int64)])
+
+    return usuario_ids, inicio, fim, pontos, ativa, ids_online
+
+def gerar_banco(caminho, usuarios, sessoes, online, dias, agenda_por_dia, semente):
+    rng = np.random.default_rng(semente)
+    # Instante de referência fixo por semente, para que o mesmo banco seja gerado em qualquer dia
+    agora = datetime(2025, 6, 30, 22, 0)
+    engine = create_engine(f'sqlite:///{caminho}')
+    db.metadata.create_all(engine)
+    aplicar_migracoes(engine)
+    tempos = {}
+
+    with engine.begin() as conexao:
+        for pragma in PRAGMAS_CARGA:
+            conexao.exec_driver_sql(pragma)
+
+        t = time.perf_counter()
+        usuario_ids, inicio, fim, pontos, ativa, ids_online = gerar_sessoes(rng, usuarios, sessoes, online, dias, agora)
+        janelas = np.where(rng.random(len(usuario_ids)) < 0.7, 'popup', 'tab').tolist()
+        fim_texto = [None if nulo else f for f, nulo in zip(_texto_datas(fim), np.isnat(fim).tolist())]
+        _inserir(conexao, SQL_SESSAO, (
+            usuario_ids.tolist(), janelas, ativa.tolist(), _texto_datas(inicio), fim_texto, pontos.tolist()
+        ))
+        tempos['sessoes_lurk'] = time.perf_counter() - t
+
+        # Usuários coerentes com as sessões: pontos somados, criação na primeira e atividade na última
+        t = time.perf_counter()
+        pontos_usuario = np.bincount(usuario_ids, weights=pontos, minlength=usuarios + 1).astype(np.int64)
+        criacao = np.full(usuarios + 1, np.datetime64(agora, 'us'))
+        np.minimum.at(criacao, usuario_ids, inicio)
+        ultima = np.full(usuarios + 1, np.datetime64('NaT'), dtype='datetime64[us]')
+        ultima[usuario_ids] = np.where(np.isnat(fim), np.datetime64(agora, 'us'), fim)
+        # Quem nunca abriu uma sessão foi criado em algum momento da janela
+        sem_sessao = np.isnat(ultima)
+        criacao[sem_sessao] = np.datetime64(agora - timedelta(days=dias), 'us') \
+            + rng.integers(0, dias * 86400, size=int(sem_sessao.sum())).astype('timedelta64[s]')
+        ultima[sem_sessao] = criacao[sem_sessao]
+        esta_online = np.zeros(usuarios + 1, dtype=np.int64)
+        esta_online[ids_online] = 1
+
+        ids = np.arange(1, usuarios + 1)
+        _inserir(conexao, SQL_USUARIO, (
+            ids.tolist(),
+            [f'viewer{i}' for i in ids.tolist()],
+            pontos_usuario[1:].tolist(),
+            esta_online[1:].tolist(),
+            np.where(rng.random(usuarios) < 0.7, 'popup', 'tab').tolist(),
+            _texto_datas(criacao[1:]),
+            _texto_datas(ultima[1:])
+        ))
+        tempos['usuarios'] = time.perf_counter() - t
+
+        # Agenda: da janela de histórico até 30 dias à frente, em horas cheias ou meias
+        t = time.perf_counter()
+        total_dias = dias + 30
+        itens = total_dias * agenda_por_dia
+        dia = np.repeat(np.arange(total_dias), agenda_por_dia)
+        data = np.datetime64(agora - timedelta(days=dias), 'D') + dia.astype('timedelta64[D]')
+        hora = rng.integers(8, 24, size=itens)
+        minuto = rng.choice([0, 30], size=itens)
+        canais = rng.integers(0, CANAIS_AGENDA, size=itens)
+        importacao = datetime(2025, 6, 1).strftime('%Y-%m-%d %H:%M:%S.%f')
+        _inserir(conexao, SQL_AGENDA, (
+            [f'{h:02d}:{m:02d}:00.000000' for h, m in zip(hora.tolist(), minuto.tolist())],
+            np.datetime_as_string(data, unit='D').tolist(),
+            [f'https://twitch.tv/canal{c}' for c in canais.tolist()],
+            [f'canal{c}' for c in canais.tolist()],
+            [importacao] * itens
+        ))
+        tempos['agenda'] = time.perf_counter() - t
+
+        # Estatísticas atualizadas para o planejador, como após as migrações
+        conexao.exec_driver_sql('ANALYZE')
+
+    return engine, {
+        'usuarios': usuarios,
+        'sessoes_lurk': len(usuario_ids),
+        'usuarios_online': len(ids_online),
+        'agenda': itens
+    }, tempos
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('caminho')
+    parser.add_argument('--usuarios', type=int, default=200000)
+    parser.add_argument('--sessoes', type=int, default=2000000)
+    parser.add_argument('--online', type=int, default=2000)
+    parser.add_argument('--dias', type=int, default=90)
+    parser.add_argument('--agenda-por-dia', type=int, default=40)
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--substituir', action='store_true', help='apaga o arquivo se ele já existir')
+    parser.add_argument('--explicar', action='store_true', help='roda EXPLAIN QUERY PLAN nas consultas frequentes')
+    args = parser.parse_args()
+
+    if os.path.exists(args.caminho):
+        if not args.substituir:
+            sys.exit(f'{args.caminho} já existe; use --substituir para recriá-lo')
+        os.remove(args.caminho)
+
+    inicio = time.perf_counter()
+    engine, contagens, tempos = gerar_banco(
+        args.caminho, args.usuarios, args.sessoes, args.online, args.dias, args.agenda_por_dia, args.semente
+    )
+    for tabela, quantidade in contagens.items():
+        detalhe = f' em {tempos[tabela]:.1f} s' if tabela in tempos else ''
+        print(f'{tabela:<16} {quantidade:>10}{detalhe}')
+    print(f'Total: {time.perf_counter() - inicio:.1f} s, {os.path.getsize(args.caminho) / 1024 / 1024:.0f} MB')
+
+    if args.explicar:
+        for nome, (usa_indice, plano) in verificar_planos(engine).items():
+            print(f"{'OK   ' if usa_indice else 'FALHA'} {nome}: {' | '.join(plano)}")
@@ -0,0 +1,103 @@
+"""Compara o pico de memória (RSS) da exportação XLSX do ranking: pandas em memória x write-only
+
+Uso: python -m src.benchmarks.memoria_exportacao [--linhas 10000 100000]
+
+Cada medição roda num subprocesso próprio, para que o pico de RSS de uma não contamine a outra.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from sqlalchemy import create_engine, insert, select, desc
+from sqlalchemy.orm import Session
+from src.models.database import db, Usuario
+
+def _rss_mb():
+    # ru_maxrss vem em KB no Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def preparar_banco(caminho, linhas):
+    engine = create_engine(f'sqlite:///{caminho}')
+    db.metadata.create_all(engine)
+    with Session(engine) as sessao:
+        for inicio in range(0, linhas, 10000):
+            sessao.execute(insert(Usuario), [
+                {'nick_canal': f'viewer{i}', 'pontos': (i * 7919) % 5000}
+                for i in range(inicio, min(inicio + 10000, linhas))
+            ])
+        sessao.commit()
+    engine.dispose()
+
+def exportar_pandas(sessao):
+    """Caminho antigo: objetos ORM, lista de dicionários, DataFrame e planilha inteira em memória"""
+    import io
+    import pandas as pd
+    usuarios = sessao.scalars(select(Usuario).order_by(desc(Usuario.pontos))).all()
+    dados = [
+        {'Posição': p, 'Espectadores': u.nick_canal, 'Pontos': u.pontos, 'Média': round((u.pontos / 1000) * 100, 2)}
+        for p, u in enumerate(usuarios, 1)
+    ]
+    saida = io.BytesIO()
+    with pd.ExcelWriter(saida, engine='openpyxl') as writer:
+        pd.DataFrame(dados).to_excel(writer, sheet_name='Ranking', index=False)
+    return len(saida.getvalue())
+
+def exportar_streaming(sessao):
+    """Caminho novo: consulta em lotes direto para o XLSX write-only em arquivo spooled"""
+    from src.services.exportacao import LOTE_EXPORTACAO, gerar_xlsx
+    from src.services.ranking import calcular_media
+    consulta = (
+        select(Usuario.nick_canal, Usuario.pontos)
+        .order_by(desc(Usuario.pontos), Usuario.id)
+        .execution_options(yield_per=LOTE_EXPORTACAO)
+    )
+    linhas = (
+        (p, nick, pontos, float(calcular_media(pontos)))
+        for p, (nick, pontos) in enumerate(sessao.execute(consulta), 1)
+    )
+    arquivo = gerar_xlsx('Ranking', ['Posição', 'Espectadores', 'Pontos', 'Média'], linhas)
+    tamanho = arquivo.seek(0, os.SEEK_END)
+    arquivo.close()
+    return tamanho
+
+MODOS = {'pandas': exportar_pandas, 'streaming': exportar_streaming}
+
+def medir_no_subprocesso(modo, caminho):
+    """Executado no subprocesso: imprime o RSS antes/depois da exportação em JSON"""
+    import pandas  # noqa: F401  - mesma base de bibliotecas carregadas nos dois modos
+    import openpyxl  # noqa: F401
+    engine = create_engine(f'sqlite:///{caminho}')
+    with Session(engine) as sessao:
+        antes = _rss_mb()
+        tamanho = MODOS[modo](sessao)
+        depois = _rss_mb()
+    print(json.dumps({'modo': modo, 'rss_base_mb': antes, 'rss_pico_mb': depois, 'bytes': tamanho}))
+
+def medir(modo, caminho):
+    saida = subprocess.run(
+        [sys.executable, '-m', 'src.benchmarks.memoria_exportacao', '--medir', modo, caminho],
+        check=True, capture_output=True, text=True
+    )
+    return json.loads(saida.stdout.strip().splitlines()[-1])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--linhas', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--medir', nargs=2, metavar=('MODO', 'BANCO'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.medir:
+        medir_no_subprocesso(*args.medir)
+        sys.exit(0)
+
+    print(f"{'linhas':>8} {'modo':<10} {'pico RSS (MB)':>14} {'acréscimo (MB)':>15}")
+    for linhas in args.linhas:
+        with tempfile.TemporaryDirectory() as diretorio:
+            caminho = os.path.join(diretorio, 'bench.db')
+            preparar_banco(caminho, linhas)
+            for modo in MODOS:
+                r = medir(modo, caminho)
+                print(f"{linhas:>8} {modo:<10} {r['rss_pico_mb']:>14.1f} {r['rss_pico_mb'] - r['rss_base_mb']:>15.1f}")
@@ -0,0 +1,83 @@
+"""Verifica o orçamento de tempo de inicialização de um worker (importação + create_app)
+
+Uso: python -m src.benchmarks.tempo_importacao [--orcamento-ms 1000] [--maiores 10]
+
+A medição roda num interpretador novo com -X importtime, sobre um banco
+descartável e sem as tarefas periódicas. Sai com código 1 se o tempo passar do
+orçamento ou se algum módulo pesado (pandas, numpy, openpyxl) for carregado na
+inicialização, para servir de checagem automática.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# Usados só na importação/exportação da agenda e do ranking; não podem entrar na inicialização
+MODULOS_PESADOS = ('pandas', 'numpy', 'openpyxl')
+
+ORCAMENTO_MS = 1000
+
+CODIGO_MEDICAO = f"""
+import json, sys, time
+inicio = time.perf_counter()
+from src.main import create_app
+importado = time.perf_counter()
+create_app()
+criado = time.perf_counter()
+print(json.dumps({{
+    'importacao_ms': (importado - inicio) * 1000,
+    'criacao_ms': (criado - importado) * 1000,
+    'pesados': [m for m in {MODULOS_PESADOS!r} if m in sys.modules]
+}}))
+"""
+
+def _maiores_importacoes(saida_importtime, quantidade):
+    """Módulos de primeiro nível com maior tempo acumulado, a partir da saída de -X importtime"""
+    modulos = []
+    for linha in saida_importtime.splitlines():
+        if not linha.startswith('import time:') or 'cumulative' in linha:
+            continue
+        _, acumulado, nome = linha[len('import time:'):].split('|')
+        # Só os módulos importados diretamente (sem recuo): o acumulado já inclui os filhos
+        if not nome.startswith('  '):
+            modulos.append((int(acumulado) / 1000, nome.strip()))
+    return sorted(modulos, reverse=True)[:quantidade]
+
+def medir():
+    with tempfile.TemporaryDirectory() as diretorio:
+        ambiente = {
+            **os.environ,
+            'DATABASE_URL': f"sqlite:///{os.path.join(diretorio, 'inicio.db')}",
+            'INICIAR_TAREFAS': '0'
+        }
+        processo = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', CODIGO_MEDICAO],
+            capture_output=True, text=True, env=ambiente, check=True
+        )
+    resultado = json.loads(processo.stdout.strip().splitlines()[-1])
+    resultado['total_ms'] = resultado['importacao_ms'] + resultado['criacao_ms']
+    resultado['importtime'] = processo.stderr
+    return resultado
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orcamento-ms', type=float, default=ORCAMENTO_MS)
+    parser.add_argument('--maiores', type=int, default=10, help='módulos mais lentos a listar')
+    args = parser.parse_args()
+
+    r = medir()
+    print(f"importação {r['importacao_ms']:.0f} ms + create_app {r['criacao_ms']:.0f} ms = {r['total_ms']:.0f} ms "
+          f"(orçamento {args.orcamento_ms:.0f} ms)")
+    for acumulado_ms, nome in _maiores_importacoes(r['importtime'], args.maiores):
+        print(f'  {acumulado_ms:>8.1f} ms  {nome}')
+
+    falhas = []
+    if r['total_ms'] > args.orcamento_ms:
+        falhas.append('tempo acima do orçamento')
+    if r['pesados']:
+        falhas.append(f"módulos pesados carregados na inicialização: {', '.join(r['pesados'])}")
+    for falha in falhas:
+        print(f'FALHA {falha}')
+    sys.exit(1 if falhas else 0)
@@ -4,61 +4,186 @@ import sys
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from flask import Flask, send_from_directory
-from flask_cors import CORS
-from src.models.database import db
-from src.routes.weblurk import weblurk_bp
-from src.routes.admin import admin_bp
-from src.routes.ranking import ranking_bp
-from src.routes.agenda import agenda_bp
-
-app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
-app.config['SECRET_KEY'] = 'weblurk_secret_key_2025'
-app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), 'uploads')
-
-# Habilitar CORS para todas as rotas
-CORS(app)
-
-# Registrar blueprints
-app.register_blueprint(weblurk_bp, url_prefix='/api')
-app.register_blueprint(admin_bp, url_prefix='/api/admin')
-app.register_blueprint(ranking_bp, url_prefix='/api/ranking')
-app.register_blueprint(agenda_bp, url_prefix='/api/agenda')
-
-# Configuração do banco de dados
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db.init_app(app)
-
-# Criar pasta de uploads se não existir
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
-with app.app_context():
-    db.create_all()
-    # Criar administrador padrão
-    from src.models.database import Administrador
-    admin_default = Administrador.query.filter_by(login='ADM').first()
-    if not admin_default:
-        admin_default = Administrador(login='ADM', senha='123', criador=True)
-        db.session.add(admin_default)
-        db.session.commit()
-
-@app.route('/', defaults={'path': ''})
-@app.route('/<path:path>')
-def serve(path):
-    static_folder_path = app.static_folder
-    if static_folder_path is None:
-            return "Static folder not configured", 404
-
-    if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
-        return send_from_directory(static_folder_path, path)
-    else:
-        index_path = os.path.join(static_folder_path, 'index.html')
-        if os.path.exists(index_path):
-            return send_from_directory(static_folder_path, 'index.html')
+
+def _configuracao_ambiente():
+    """Configuração lida das variáveis de ambiente"""
+    from src.models.perfil_sqlite import PERFIL_PADRAO
+
+    return {
+        'SECRET_KEY': 'weblurk_secret_key_2025',
+        # Tamanho máximo de uma requisição (upload da agenda); acima disso o Werkzeug recusa com 413 durante a leitura
+        'MAX_CONTENT_LENGTH': int(os.environ.get('LIMITE_UPLOAD_MB', 10)) * 1024 * 1024,
+        # Pontuação: um ponto a cada INTERVALO_PONTUACAO segundos, concedido a cada INTERVALO_TICK_PONTUACAO
+        'INTERVALO_PONTUACAO': int(os.environ.get('INTERVALO_PONTUACAO', 360)),
+        'INTERVALO_TICK_PONTUACAO': int(os.environ.get('INTERVALO_TICK_PONTUACAO', 60)),
+        # 'agendador' (thread única) ou 'sob_demanda' (sem trabalho em segundo plano)
+        'MODO_PONTUACAO': os.environ.get('MODO_PONTUACAO', 'agendador'),
+        # Intervalo da gravação em lote dos heartbeats e da recarga dos usuários online
+        'INTERVALO_PRESENCA': int(os.environ.get('INTERVALO_PRESENCA', 15)),
+        # Sessões sem heartbeat há mais de TIMEOUT_SESSAO segundos são encerradas automaticamente
+        'TIMEOUT_SESSAO': int(os.environ.get('TIMEOUT_SESSAO', 600)),
+        'INTERVALO_LIMPEZA_SESSOES': int(os.environ.get('INTERVALO_LIMPEZA_SESSOES', 60)),
+        # Compactação das sessões encerradas no resumo diário; as sessões brutas ficam RETENCAO_SESSOES_DIAS dias
+        'INTERVALO_RESUMO_SESSOES': int(os.environ.get('INTERVALO_RESUMO_SESSOES', 3600)),
+        'RETENCAO_SESSOES_DIAS': int(os.environ.get('RETENCAO_SESSOES_DIAS', 90)),
+        # Com gevent/eventlet (wsgi.multithread falso) o stream SSE precisa deste aviso;
+        # em workers síncronos ele é recusado e as páginas usam a atualização periódica
+        'SERVIDOR_ASSINCRONO': os.environ.get('SERVIDOR_ASSINCRONO', '0') == '1',
+        # Streams SSE abertos por worker (painel e espectadores); com threads cada um ocupa uma,
+        # com servidor assíncrono o valor pode ser bem maior
+        'MAXIMO_STREAMS_EVENTOS': int(os.environ.get('MAXIMO_STREAMS_EVENTOS', 20)),
+        # Threads que processam as importações da agenda em segundo plano
+        'WORKERS_IMPORTACAO': int(os.environ.get('WORKERS_IMPORTACAO', 1)),
+        # Se definido, /metrics exige o cabeçalho Authorization: Bearer <TOKEN_METRICAS>
+        'TOKEN_METRICAS': os.environ.get('TOKEN_METRICAS'),
+        # Com vários workers: diretório local comum onde cada worker grava as suas métricas, para
+        # /metrics somar todos; deve ser esvaziado a cada reinício do servidor
+        'DIRETORIO_METRICAS': os.environ.get('DIRETORIO_METRICAS'),
+        # Perfil de SQL por requisição (cabeçalhos Server-Timing e detecção de N+1); só para diagnóstico
+        'PERFIL_SQL': os.environ.get('PERFIL_SQL', '0') == '1',
+        # Sem as tarefas periódicas (testes, scripts): a pontuação, a presença, a limpeza e o resumo não rodam sozinhas
+        'INICIAR_TAREFAS': os.environ.get('INICIAR_TAREFAS', '1') == '1',
+        # DATABASE_URL permite apontar para outro arquivo (ex.: banco descartável dos benchmarks)
+        'SQLALCHEMY_DATABASE_URI': os.environ.get(
+            'DATABASE_URL', f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
+        ),
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        # Perfil de ajuste do SQLite (WAL, busy_timeout, pool): padrao, concorrente ou seguro
+        'PERFIL_SQLITE': os.environ.get('PERFIL_SQLITE', PERFIL_PADRAO),
+    }
+
+def _preparar_banco(app):
+    from sqlalchemy.exc import IntegrityError
+    from src.models.database import db, Administrador
+    from src.models.migracoes import aplicar_migracoes
+    from src.models.perfil_sqlite import aplicar_perfil
+    from src.services.metricas import registrar_metricas
+    from src.services.perfil_sql import registrar_perfil_sql
+
+    with app.app_context():
+        aplicar_perfil(db.engine, app.config['PERFIL_SQLITE'])
+        # Latência, status e SQL por endpoint, expostos em /metrics no formato do Prometheus
+        registrar_metricas(app, db.engine)
+        if app.config['PERFIL_SQL']:
+            app.extensions['perfil_sql'] = registrar_perfil_sql(app, db.engine)
+        db.create_all()
+        # Atualizar bancos existentes (índices, restrições) sem recriá-los
+        aplicar_migracoes(db.engine)
+        # Criar administrador padrão
+        admin_default = Administrador.query.filter_by(login='ADM').first()
+        if not admin_default:
+            admin_default = Administrador(login='ADM', senha='123', criador=True)
+            db.session.add(admin_default)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Outro worker criou o administrador padrão ao mesmo tempo
+                db.session.rollback()
+
+def _iniciar_tarefas(app):
+    from src.services.pontuacao import AgendadorPontuacao, MODO_AGENDADOR
+    from src.services.presenca import TarefaPresenca
+    from src.services.limpeza_sessoes import TarefaLimpezaSessoes
+    from src.services.resumo_sessoes import TarefaResumoSessoes
+
+    # Agendador único de pontuação (substitui uma thread por usuário);
+    # em vários workers, apenas o líder eleito pela tabela travas_lider pontua
+    if app.config['MODO_PONTUACAO'] == MODO_AGENDADOR:
+        agendador_pontuacao = AgendadorPontuacao(app, app.config['INTERVALO_TICK_PONTUACAO'])
+        app.extensions['pontuacao'] = agendador_pontuacao
+        agendador_pontuacao.iniciar()
+
+    # Presença em memória: heartbeats gravados em lote e conjunto online recarregado
+    tarefa_presenca = TarefaPresenca(app, app.config['INTERVALO_PRESENCA'])
+    app.extensions['presenca'] = tarefa_presenca
+    tarefa_presenca.iniciar()
+
+    # Limpeza de sessões abandonadas (janela fechada sem /finalizar-lurk)
+    tarefa_limpeza = TarefaLimpezaSessoes(app, app.config['INTERVALO_LIMPEZA_SESSOES'], app.config['TIMEOUT_SESSAO'])
+    app.extensions['limpeza_sessoes'] = tarefa_limpeza
+    tarefa_limpeza.iniciar()
+
+    # Resumo diário das sessões encerradas e retenção das sessões brutas
+    tarefa_resumo = TarefaResumoSessoes(
+        app, app.config['INTERVALO_RESUMO_SESSOES'], app.config['RETENCAO_SESSOES_DIAS']
+    )
+    app.extensions['resumo_sessoes'] = tarefa_resumo
+    tarefa_resumo.iniciar()
+
+def create_app(config=None):
+    """Cria o app; config sobrepõe a configuração lida do ambiente
+
+    Os blueprints e serviços são importados aqui, e o pandas só na primeira
+    importação da agenda: importar este módulo não cria app nem carrega nada pesado.
+    """
+    from flask_cors import CORS
+    from src.models.database import db
+    from src.models.perfil_sqlite import opcoes_engine
+    from src.routes.weblurk import weblurk_bp
+    from src.routes.admin import admin_bp
+    from src.routes.ranking import ranking_bp
+    from src.routes.agenda import agenda_bp
+    from src.services.presenca import presenca
+    from src.services.tarefas_importacao import ExecutorImportacao
+    from src.services.eventos import eventos
+    from src.services.metricas import metricas
+
+    app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
+    app.config.update(_configuracao_ambiente())
+    app.config.update(config or {})
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', opcoes_engine(app.config['PERFIL_SQLITE']))
+
+    # Habilitar CORS para todas as rotas
+    CORS(app)
+
+    # Registrar blueprints
+    app.register_blueprint(weblurk_bp, url_prefix='/api')
+    app.register_blueprint(admin_bp, url_prefix='/api/admin')
+    app.register_blueprint(ranking_bp, url_prefix='/api/ranking')
+    app.register_blueprint(agenda_bp, url_prefix='/api/agenda')
+
+    db.init_app(app)
+    _preparar_banco(app)
+
+    if app.config['INICIAR_TAREFAS']:
+        _iniciar_tarefas(app)
+
+    # Importações da agenda fora da requisição: o upload só enfileira e devolve o id da tarefa
+    app.extensions['importacao'] = ExecutorImportacao(app, app.config['WORKERS_IMPORTACAO'])
+
+    metricas.medidor('weblurk_usuarios_online', 'Usuários em lurk', presenca.total_online)
+    metricas.medidor('weblurk_assinantes_eventos', 'Conexões SSE abertas neste worker', lambda: eventos.total_assinantes)
+
+    @app.route('/', defaults={'path': ''})
+    @app.route('/<path:path>')
+    def serve(path):
+        static_folder_path = app.static_folder
+        if static_folder_path is None:
+                return "Static folder not configured", 404
+
+        if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
+            return send_from_directory(static_folder_path, path)
         else:
-            return "index.html not found", 404
+            index_path = os.path.join(static_folder_path, 'index.html')
+            if os.path.exists(index_path):
+                return send_from_directory(static_folder_path, 'index.html')
+            else:
+                return "index.html not found", 404
+
+    return app
+
+_app = None
+
+def __getattr__(nome):
+    # `from src.main import app` (e src.main:app no servidor WSGI) cria o app na primeira referência
+    global _app
+    if nome == 'app':
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f'module {__name__!r} has no attribute {nome!r}')
 
 
-if__name__=='__main__':
- port=int(os.environ.get('PORT',5001))
- app.run(host='0.0.0.0',port=port,debug=False)
+if __name__ == '__main__':
+    port = int(os.environ.get('PORT', 5001))
+    create_app().run(host='0.0.0.0', port=port, debug=False)
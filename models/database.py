@@ -5,6 +5,11 @@ db = SQLAlchemy()
 
 class Usuario(db.Model):
     __tablename__ = 'usuarios'
+    __table_args__ = (
+        db.Index('ix_usuarios_nick_canal', 'nick_canal', unique=True),
+        # Índice parcial: só os usuários online, por atividade (lista online e limpeza de sessões)
+        db.Index('ix_usuarios_online_atividade', 'ultima_atividade', sqlite_where=db.text('online = 1')),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     nick_canal = db.Column(db.String(100), nullable=False)
@@ -28,6 +33,9 @@ class Usuario(db.Model):
             'ultima_atividade': self.ultima_atividade.isoformat() if self.ultima_atividade else None
         }
 
+# Ordem do ranking (maior pontuação primeiro, empates por id) servida direto do índice
+db.Index('ix_usuarios_ranking', Usuario.pontos.desc(), Usuario.id)
+
 class Administrador(db.Model):
     __tablename__ = 'administradores'
     
@@ -47,6 +55,9 @@ class Administrador(db.Model):
 
 class Agenda(db.Model):
     __tablename__ = 'agenda'
+    __table_args__ = (
+        db.Index('ix_agenda_data_hora', 'data', 'hora'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     hora = db.Column(db.Time, nullable=False)
@@ -67,6 +78,16 @@ class Agenda(db.Model):
 
 class SessaoLurk(db.Model):
     __tablename__ = 'sessoes_lurk'
+    __table_args__ = (
+        db.Index('ix_sessoes_lurk_usuario_ativa', 'usuario_id', 'ativa'),
+        # Índice parcial: só as sessões ativas, varridas a cada ciclo de pontuação
+        db.Index('ix_sessoes_lurk_ativas', 'usuario_id', sqlite_where=db.text('ativa = 1')),
+        # Sessões encerradas que ainda não entraram no resumo diário, e as já resumidas para a retenção
+        db.Index('ix_sessoes_lurk_pendentes_resumo', 'id', sqlite_where=db.text('resumida = 0 AND ativa = 0')),
+        db.Index('ix_sessoes_lurk_resumidas_fim', 'fim_sessao', sqlite_where=db.text('resumida = 1')),
+        # Ids nunca reaproveitados, mesmo depois de excluir as sessões mais recentes
+        {'sqlite_autoincrement': True},
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
@@ -75,6 +96,7 @@ class SessaoLurk(db.Model):
     inicio_sessao = db.Column(db.DateTime, default=datetime.utcnow)
     fim_sessao = db.Column(db.DateTime, nullable=True)
     pontos_gerados = db.Column(db.Integer, default=0)
+    resumida = db.Column(db.Boolean, nullable=False, default=False, server_default=db.text('0'))  # já somada em resumo_diario_lurk
     
     def to_dict(self):
         return {
@@ -87,3 +109,104 @@ class SessaoLurk(db.Model):
             'pontos_gerados': self.pontos_gerados
         }
 
+# Sessões encerradas compactadas por usuário e dia (o dia em que a sessão começou)
+class ResumoDiarioLurk(db.Model):
+    __tablename__ = 'resumo_diario_lurk'
+    
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), primary_key=True)
+    dia = db.Column(db.Date, primary_key=True)
+    sessoes = db.Column(db.Integer, nullable=False, default=0)
+    minutos = db.Column(db.Float, nullable=False, default=0)
+    pontos = db.Column(db.Integer, nullable=False, default=0)
+    
+    def to_dict(self):
+        return {
+            'usuario_id': self.usuario_id,
+            'dia': self.dia.strftime('%Y-%m-%d') if self.dia else None,
+            'sessoes': self.sessoes,
+            'minutos': round(self.minutos or 0, 1),
+            'pontos': self.pontos
+        }
+
+
+class TravaLider(db.Model):
+    __tablename__ = 'travas_lider'
+    
+    nome = db.Column(db.String(50), primary_key=True)
+    dono = db.Column(db.String(100), nullable=True)  # processo que detém a liderança
+    expira_em = db.Column(db.DateTime, nullable=True)
+    ultimo_ciclo = db.Column(db.Integer, default=0)  # instante (epoch) do último ciclo executado, evita execução dupla
+    
+    def to_dict(self):
+        return {
+            'nome': self.nome,
+            'dono': self.dono,
+            'expira_em': self.expira_em.isoformat() if self.expira_em else None,
+            'ultimo_ciclo': self.ultimo_ciclo
+        }
+
+class VersaoCache(db.Model):
+    __tablename__ = 'versoes_cache'
+    
+    nome = db.Column(db.String(50), primary_key=True)
+    versao = db.Column(db.String(32), nullable=False)  # trocada a cada alteração do conteúdo em cache
+    atualizada_em = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Eventos de mudança lidos pelos streams SSE de todos os workers; só os últimos são mantidos
+class Evento(db.Model):
+    __tablename__ = 'eventos'
+    # Ids nunca reaproveitados: são o cursor (Last-Event-ID) dos clientes
+    __table_args__ = ({'sqlite_autoincrement': True},)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(20), nullable=False)
+    dados = db.Column(db.Text, nullable=False)  # JSON
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+
+class TarefaImportacao(db.Model):
+    __tablename__ = 'tarefas_importacao'
+    
+    id = db.Column(db.String(32), primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='pendente')  # pendente, processando, concluida, falhou
+    etapa = db.Column(db.String(20), nullable=True)  # leitura, gravacao
+    modo = db.Column(db.String(20), nullable=False)
+    nome_arquivo = db.Column(db.String(255), nullable=True)
+    admin_id = db.Column(db.Integer, nullable=True)  # sem FK: o histórico sobrevive à exclusão do administrador
+    bytes_total = db.Column(db.Integer, default=0)
+    bytes_lidos = db.Column(db.Integer, default=0)
+    linhas_lidas = db.Column(db.Integer, default=0)
+    registros_validos = db.Column(db.Integer, nullable=True)
+    registros_rejeitados = db.Column(db.Integer, nullable=True)
+    rejeitados_por_motivo = db.Column(db.JSON, nullable=True)
+    alteracoes = db.Column(db.JSON, nullable=True)
+    mensagem = db.Column(db.Text, nullable=True)
+    criada_em = db.Column(db.DateTime, default=datetime.utcnow)
+    iniciada_em = db.Column(db.DateTime, nullable=True)
+    concluida_em = db.Column(db.DateTime, nullable=True)
+    duracao_ms = db.Column(db.Float, nullable=True)
+    
+    def to_dict(self):
+        if self.status == 'concluida':
+            percentual = 100
+        elif self.bytes_total:
+            percentual = round(100 * (self.bytes_lidos or 0) / self.bytes_total, 1)
+        else:
+            percentual = 0
+        return {
+            'id': self.id,
+            'status': self.status,
+            'etapa': self.etapa,
+            'modo': self.modo,
+            'nome_arquivo': self.nome_arquivo,
+            'percentual': percentual,
+            'linhas_lidas': self.linhas_lidas,
+            'registros_validos': self.registros_validos,
+            'registros_rejeitados': self.registros_rejeitados,
+            'rejeitados_por_motivo': self.rejeitados_por_motivo,
+            'alteracoes': self.alteracoes,
+            'mensagem': self.mensagem,
+            'criada_em': self.criada_em.isoformat() if self.criada_em else None,
+            'iniciada_em': self.iniciada_em.isoformat() if self.iniciada_em else None,
+            'concluida_em': self.concluida_em.isoformat() if self.concluida_em else None,
+            'duracao_ms': self.duracao_ms
+        }
@@ -0,0 +1,169 @@
+"""Migrações do banco SQLite, versionadas por PRAGMA user_version
+
+Uso: python -m src.models.migracoes [caminho/app.db] [--explicar]
+"""
+import os
+import sys
+from datetime import date
+from sqlalchemy import create_engine, select, desc, text
+from src.models.database import db, Usuario, SessaoLurk, Agenda
+
+# Mantém só a sessão ativa mais nova de cada usuário; as demais terminam no último sinal dele.
+# Sessões ativas em paralelo seriam pontuadas juntas a cada ciclo.
+ENCERRAR_SESSOES_ATIVAS_EXTRAS = """UPDATE sessoes_lurk SET
+           ativa = 0,
+           fim_sessao = MAX(
+               COALESCE((SELECT u.ultima_atividade FROM usuarios u WHERE u.id = sessoes_lurk.usuario_id), inicio_sessao),
+               inicio_sessao
+           )
+       WHERE ativa = 1
+         AND id < (SELECT MAX(s2.id) FROM sessoes_lurk s2 WHERE s2.usuario_id = sessoes_lurk.usuario_id AND s2.ativa = 1)"""
+
+# (versão, descrição, comandos). Os comandos são idempotentes: se o processo cair
+# no meio de uma migração, ela é reaplicada inteira na próxima inicialização.
+MIGRACOES = [
+    (1, 'Unificar nicks duplicados e criar índices das consultas frequentes', [
+        # Somar os pontos das duplicatas no registro mais antigo de cada nick
+        """UPDATE usuarios SET pontos = (
+               SELECT SUM(COALESCE(u2.pontos, 0)) FROM usuarios u2 WHERE u2.nick_canal = usuarios.nick_canal
+           )
+           WHERE id IN (SELECT MIN(id) FROM usuarios GROUP BY nick_canal HAVING COUNT(*) > 1)""",
+        # O registro mantido fica online se alguma duplicata estava (as sessões ativas vêm junto)
+        """UPDATE usuarios SET
+               online = (SELECT MAX(COALESCE(u2.online, 0)) FROM usuarios u2 WHERE u2.nick_canal = usuarios.nick_canal),
+               ultima_atividade = (SELECT MAX(u2.ultima_atividade) FROM usuarios u2 WHERE u2.nick_canal = usuarios.nick_canal)
+           WHERE id IN (SELECT MIN(id) FROM usuarios GROUP BY nick_canal HAVING COUNT(*) > 1)""",
+        # Mover as sessões das duplicatas para o registro mantido
+        """UPDATE sessoes_lurk SET usuario_id = (
+               SELECT MIN(u2.id) FROM usuarios u2
+               WHERE u2.nick_canal = (SELECT u3.nick_canal FROM usuarios u3 WHERE u3.id = sessoes_lurk.usuario_id)
+           )
+           WHERE usuario_id NOT IN (SELECT MIN(id) FROM usuarios GROUP BY nick_canal)""",
+        # As duplicatas podiam estar em lurk ao mesmo tempo: o usuário unificado fica com uma sessão ativa
+        ENCERRAR_SESSOES_ATIVAS_EXTRAS,
+        "DELETE FROM usuarios WHERE id NOT IN (SELECT MIN(id) FROM usuarios GROUP BY nick_canal)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_usuarios_nick_canal ON usuarios (nick_canal)",
+        "CREATE INDEX IF NOT EXISTS ix_usuarios_pontos ON usuarios (pontos)",
+        "CREATE INDEX IF NOT EXISTS ix_usuarios_online_atividade ON usuarios (ultima_atividade) WHERE online = 1",
+        "CREATE INDEX IF NOT EXISTS ix_sessoes_lurk_usuario_ativa ON sessoes_lurk (usuario_id, ativa)",
+        "CREATE INDEX IF NOT EXISTS ix_sessoes_lurk_ativas ON sessoes_lurk (usuario_id) WHERE ativa = 1",
+        "CREATE INDEX IF NOT EXISTS ix_agenda_data_hora ON agenda (data, hora)",
+        "ANALYZE",
+    ]),
+    (2, 'Índice do ranking com desempate por id', [
+        "DROP INDEX IF EXISTS ix_usuarios_pontos",
+        "CREATE INDEX IF NOT EXISTS ix_usuarios_ranking ON usuarios (pontos DESC, id)",
+        # Estatísticas antigas não conhecem o índice novo e desviam o planejador
+        "ANALYZE",
+    ]),
+    (3, 'Sessões com AUTOINCREMENT e marca de sessão resumida', [
+        # O SQLite só aplica AUTOINCREMENT na criação da tabela: recriar e copiar
+        "DROP TABLE IF EXISTS sessoes_lurk_nova",
+        """CREATE TABLE sessoes_lurk_nova (
+               id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+               usuario_id INTEGER NOT NULL,
+               tipo_janela VARCHAR(10) NOT NULL,
+               ativa BOOLEAN,
+               inicio_sessao DATETIME,
+               fim_sessao DATETIME,
+               pontos_gerados INTEGER,
+               resumida BOOLEAN DEFAULT 0 NOT NULL,
+               FOREIGN KEY(usuario_id) REFERENCES usuarios (id)
+           )""",
+        # Sessões encerradas até o antigo checkpoint do resumo (travas_lider) já estão somadas
+        """INSERT INTO sessoes_lurk_nova
+               (id, usuario_id, tipo_janela, ativa, inicio_sessao, fim_sessao, pontos_gerados, resumida)
+           SELECT id, usuario_id, tipo_janela, ativa, inicio_sessao, fim_sessao, pontos_gerados,
+                  COALESCE(ativa, 1) = 0
+                  AND id <= COALESCE((SELECT ultimo_ciclo FROM travas_lider WHERE nome = 'resumo-sessoes'), 0)
+           FROM sessoes_lurk""",
+        "DROP TABLE sessoes_lurk",
+        "ALTER TABLE sessoes_lurk_nova RENAME TO sessoes_lurk",
+        "CREATE INDEX IF NOT EXISTS ix_sessoes_lurk_usuario_ativa ON sessoes_lurk (usuario_id, ativa)",
+        "CREATE INDEX IF NOT EXISTS ix_sessoes_lurk_ativas ON sessoes_lurk (usuario_id) WHERE ativa = 1",
+        "CREATE INDEX IF NOT EXISTS ix_sessoes_lurk_pendentes_resumo ON sessoes_lurk (id) WHERE resumida = 0 AND ativa = 0",
+        "CREATE INDEX IF NOT EXISTS ix_sessoes_lurk_resumidas_fim ON sessoes_lurk (fim_sessao) WHERE resumida = 1",
+        "UPDATE travas_lider SET ultimo_ciclo = 0 WHERE nome = 'resumo-sessoes'",
+        "ANALYZE",
+    ]),
+    (4, 'Encerrar sessões ativas extras deixadas pela unificação de nicks', [
+        ENCERRAR_SESSOES_ATIVAS_EXTRAS,
+    ]),
+]
+
+def versao_atual(conexao):
+    return conexao.exec_driver_sql('PRAGMA user_version').scalar()
+
+def aplicar_migracoes(engine):
+    """Aplica as migrações pendentes; retorna a lista de versões aplicadas
+
+    Roda sob a trava de escrita do banco: workers iniciando juntos aplicam as
+    migrações uma vez só, o segundo já encontra a versão nova.
+    """
+    with engine.connect() as conexao:
+        if versao_atual(conexao) >= MIGRACOES[-1][0]:
+            return []
+
+    aplicadas = []
+    with engine.begin() as conexao:
+        # O pysqlite só abre a transação antes de DML: a versão precisa ser relida já com a trava
+        conexao.exec_driver_sql('BEGIN IMMEDIATE')
+        versao = versao_atual(conexao)
+        for numero, descricao, comandos in MIGRACOES:
+            if numero <= versao:
+                continue
+            for comando in comandos:
+                conexao.exec_driver_sql(comando)
+            conexao.exec_driver_sql(f'PRAGMA user_version = {int(numero)}')
+            aplicadas.append(numero)
+    return aplicadas
+
+def consultas_frequentes():
+    """As consultas dos caminhos quentes, como as rotas e serviços as emitem"""
+    return {
+        'usuario_por_nick': select(Usuario).where(Usuario.nick_canal == 'nick'),
+        'usuarios_online': select(Usuario.id, Usuario.pontos).where(Usuario.online == True),
+        'usuarios_inativos': select(Usuario.id).where(Usuario.online == True, Usuario.ultima_atividade < '2000-01-01'),
+        'sessao_ativa_usuario': select(SessaoLurk).where(SessaoLurk.usuario_id == 1, SessaoLurk.ativa == True),
+        'sessoes_ativas': select(SessaoLurk.usuario_id).where(SessaoLurk.ativa == True),
+        'sessoes_pendentes_resumo': text(
+            'SELECT id FROM sessoes_lurk INDEXED BY ix_sessoes_lurk_pendentes_resumo '
+            'WHERE ativa = 0 AND resumida = 0 ORDER BY id LIMIT 1000'
+        ),
+        'sessoes_retencao': select(SessaoLurk.id).where(SessaoLurk.resumida == True, SessaoLurk.fim_sessao < '2000-01-01'),
+        'agenda_do_dia': select(Agenda).where(Agenda.data == date(2000, 1, 1)).order_by(Agenda.hora),
+        'ranking': select(Usuario.nick_canal, Usuario.pontos).order_by(desc(Usuario.pontos), Usuario.id),
+    }
+
+def verificar_planos(engine):
+    """Roda EXPLAIN QUERY PLAN nas consultas frequentes; retorna {nome: (usa_indice, plano)}"""
+    resultado = {}
+    with engine.connect() as conexao:
+        for nome, consulta in consultas_frequentes().items():
+            sql = str(consulta.compile(engine, compile_kwargs={'literal_binds': True}))
+            plano = [linha[-1] for linha in conexao.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}')]
+            # Varredura completa de tabela ou ordenação em árvore temporária indicam índice faltando
+            usa_indice = not any(
+                (detalhe.startswith('SCAN') and 'INDEX' not in detalhe) or 'TEMP B-TREE' in detalhe
+                for detalhe in plano
+            )
+            resultado[nome] = (usa_indice, plano)
+    return resultado
+
+if __name__ == '__main__':
+    argumentos = [a for a in sys.argv[1:] if not a.startswith('--')]
+    caminho = argumentos[0] if argumentos else os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'app.db')
+    engine = create_engine(f'sqlite:///{caminho}')
+
+    # Como na inicialização do app: tabelas novas antes das migrações que as leem
+    db.metadata.create_all(engine)
+    aplicadas = aplicar_migracoes(engine)
+    with engine.connect() as conexao:
+        print(f'Migrações aplicadas: {aplicadas or "nenhuma"} (versão {versao_atual(conexao)})')
+
+    if '--explicar' in sys.argv:
+        falhas = 0
+        for nome, (usa_indice, plano) in verificar_planos(engine).items():
+            falhas += not usa_indice
+            print(f"{'OK   ' if usa_indice else 'FALHA'} {nome}: {' | '.join(plano)}")
+        sys.exit(1 if falhas else 0)
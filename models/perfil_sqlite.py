@@ -0,0 +1,67 @@
+"""Perfis de ajuste do SQLite aplicados a cada nova conexão
+
+Selecione com a variável de ambiente PERFIL_SQLITE (padrão: concorrente).
+"""
+from sqlalchemy import event
+
+PERFIS = {
+    # Comportamento original do SQLite: journal de rollback, sem busy_timeout
+    'padrao': {
+        'pragmas': {},
+        'timeout': 5,
+        'pool': {}
+    },
+    # Leitores não bloqueiam o escritor (WAL) e escritores esperam a trava em vez de falhar
+    'concorrente': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'busy_timeout': 15000,
+            'synchronous': 'NORMAL',
+            'mmap_size': 268435456,
+            'cache_size': -65536,
+            'temp_store': 'MEMORY'
+        },
+        'timeout': 15,
+        'pool': {'pool_size': 10, 'max_overflow': 20, 'pool_timeout': 30}
+    },
+    # Igual ao concorrente, mas com fsync em todo commit
+    'seguro': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'busy_timeout': 15000,
+            'synchronous': 'FULL',
+            'cache_size': -16384
+        },
+        'timeout': 15,
+        'pool': {'pool_size': 5, 'max_overflow': 10, 'pool_timeout': 30}
+    }
+}
+
+PERFIL_PADRAO = 'concorrente'
+
+def obter_perfil(nome):
+    if nome not in PERFIS:
+        raise ValueError(f'Perfil SQLite desconhecido: {nome}. Use um de: {", ".join(PERFIS)}')
+    return PERFIS[nome]
+
+def opcoes_engine(nome):
+    """Opções de create_engine (SQLALCHEMY_ENGINE_OPTIONS) do perfil"""
+    perfil = obter_perfil(nome)
+    return {
+        # Conexões do pool circulam entre as threads das requisições e das tarefas
+        'connect_args': {'timeout': perfil['timeout'], 'check_same_thread': False},
+        **perfil['pool']
+    }
+
+def aplicar_perfil(engine, nome):
+    """Registra os PRAGMAs do perfil para toda conexão aberta pelo engine"""
+    pragmas = obter_perfil(nome)['pragmas']
+
+    @event.listens_for(engine, 'connect')
+    def _configurar_conexao(conexao_dbapi, registro):
+        cursor = conexao_dbapi.cursor()
+        for pragma, valor in pragmas.items():
+            cursor.execute(f'PRAGMA {pragma} = {valor}')
+        cursor.close()
+
+    return pragmas
@@ -1,5 +1,7 @@
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify, session, current_app
 from src.models.database import db, Administrador
+from src.services.limpeza_sessoes import encerrar_sessoes_inativas, desconectar_usuarios
+from src.services.presenca import presenca
 from datetime import datetime
 
 admin_bp = Blueprint('admin', __name__)
@@ -131,7 +133,6 @@ def excluir_admin(admin_id_excluir):
         if not admin_id:
             return jsonify({'success': False, 'message': 'Acesso negado'}), 401
         
-        admin_atual = Administrador.query.get(admin_id)
         admin_para_excluir = Administrador.query.get(admin_id_excluir)
         
         if not admin_para_excluir:
@@ -185,3 +186,87 @@ def alterar_senha():
     except Exception as e:
         return jsonify({'success': False, 'message': f'Erro ao alterar senha: {str(e)}'}), 500
 
+
+@admin_bp.route('/status-pontuacao', methods=['GET'])
+def status_pontuacao():
+    """Retorna duração e linhas afetadas do último ciclo do agendador de pontuação"""
+    try:
+        admin_id = session.get('admin_id')
+        if not admin_id:
+            return jsonify({'success': False, 'message': 'Acesso negado'}), 401
+        
+        agendador = current_app.extensions.get('pontuacao')
+        
+        return jsonify({
+            'success': True,
+            'modo': current_app.config.get('MODO_PONTUACAO'),
+            'agendador': agendador.to_dict() if agendador else None
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Erro ao obter status da pontuação: {str(e)}'}), 500
+
+@admin_bp.route('/desconectar-usuarios', methods=['POST'])
+def desconectar_usuarios_online():
+    """Encerra em lote o lurk dos nicks informados ou de quem está inativo há 'inativos_ha' segundos"""
+    try:
+        admin_id = session.get('admin_id')
+        if not admin_id:
+            return jsonify({'success': False, 'message': 'Acesso negado'}), 401
+        
+        data = request.get_json(silent=True) or {}
+        nicks = data.get('nicks')
+        inativos_ha = data.get('inativos_ha')
+        
+        if nicks is not None:
+            if not isinstance(nicks, list) or not nicks:
+                return jsonify({'success': False, 'message': 'Informe a lista de nicks'}), 400
+            resultado = desconectar_usuarios([str(nick).strip() for nick in nicks])
+            db.session.commit()
+        elif inativos_ha is not None:
+            if not isinstance(inativos_ha, int) or isinstance(inativos_ha, bool) or inativos_ha < 0:
+                return jsonify({'success': False, 'message': 'inativos_ha deve ser um número de segundos'}), 400
+            # Heartbeats ainda em memória precisam chegar ao banco antes do corte
+            presenca.gravar_batimentos()
+            resultado = encerrar_sessoes_inativas(inativos_ha)
+        else:
+            return jsonify({'success': False, 'message': 'Informe nicks ou inativos_ha'}), 400
+        
+        # Atualiza a lista online deste worker; os painéis recebem as saídas pelos eventos
+        if resultado['usuarios_desconectados']:
+            presenca.recarregar_online()
+        
+        return jsonify({
+            'success': True,
+            'message': f"{resultado['usuarios_desconectados']} usuário(s) desconectado(s)!",
+            **resultado
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'Erro ao desconectar usuários: {str(e)}'}), 500
+
+@admin_bp.route('/perfil-sql', methods=['GET'])
+def perfil_sql():
+    """Relatórios recentes do perfil de SQL por requisição (ativo com PERFIL_SQL=1)"""
+    try:
+        admin_id = session.get('admin_id')
+        if not admin_id:
+            return jsonify({'success': False, 'message': 'Acesso negado'}), 401
+        
+        perfil = current_app.extensions.get('perfil_sql')
+        if not perfil:
+            return jsonify({'success': True, 'ativo': False, 'resumo': {}, 'relatorios': []})
+        
+        apenas_suspeitos = request.args.get('apenas_suspeitos', '0') == '1'
+        
+        return jsonify({
+            'success': True,
+            'ativo': True,
+            'limite_n_mais_1': perfil.limite_n_mais_1,
+            'resumo': perfil.resumo(),
+            'relatorios': perfil.relatorios(apenas_suspeitos)
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Erro ao obter perfil de SQL: {str(e)}'}), 500
@@ -1,9 +1,11 @@
-from flask import Blueprint, request, jsonify, session, current_app
-from src.models.database import db, Agenda
+from flask import Blueprint, request, jsonify, session, current_app, url_for
+from src.models.database import db, Agenda, TarefaImportacao
+from src.services.cache_agenda import cache_agenda, etag_agenda, registrar_alteracao_agenda, resposta_condicional
+from src.services.exportacao import LOTE_EXPORTACAO, gerar_xlsx, resposta_xlsx
+from src.services.tarefas_importacao import MODO_SUBSTITUIR, MODOS_IMPORTACAO
+from sqlalchemy import select
 from datetime import datetime, date
-import pandas as pd
-import os
-from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
 
 agenda_bp = Blueprint('agenda', __name__)
 
@@ -14,7 +16,7 @@ def allowed_file(filename):
 
 @agenda_bp.route('/upload', methods=['POST'])
 def upload_agenda():
-    """Upload e processamento da agenda Excel/CSV"""
+    """Upload da agenda Excel/CSV; o processamento roda numa tarefa em segundo plano"""
     try:
         admin_id = session.get('admin_id')
         if not admin_id:
@@ -30,142 +32,69 @@ def upload_agenda():
         if not allowed_file(file.filename):
             return jsonify({'success': False, 'message': 'Formato de arquivo não suportado. Use .xlsx ou .csv'}), 400
         
-        # Salvar arquivo temporariamente
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        
-        try:
-            # Ler arquivo baseado na extensão
-            if filename.lower().endswith('.xlsx'):
-                df = pd.read_excel(filepath)
-            else:  # CSV
-                df = pd.read_csv(filepath)
-            
-            # Verificar se o arquivo tem as colunas necessárias
-            if len(df.columns) < 4:
-                return jsonify({'success': False, 'message': 'Arquivo deve ter pelo menos 4 colunas (Hora, Data, Link, Canal)'}), 400
-            
-            # Renomear colunas para padronização
-            df.columns = ['hora', 'data', 'link_plataforma', 'nome_canal']
-            
-            # Limpar agenda existente
-            Agenda.query.delete()
-            
-            # Processar cada linha
-            registros_inseridos = 0
-            for index, row in df.iterrows():
-                try:
-                    # Processar hora
-                    if pd.isna(row['hora']):
-                        continue
-                    
-                    hora_str = str(row['hora']).strip()
-                    if ':' in hora_str:
-                        hora_obj = datetime.strptime(hora_str, '%H:%M').time()
-                    else:
-                        # Tentar formato de hora sem dois pontos
-                        if len(hora_str) <= 2:
-                            hora_obj = datetime.strptime(f"{hora_str}:00", '%H:%M').time()
-                        else:
-                            continue
-                    
-                    # Processar data
-                    if pd.isna(row['data']):
-                        continue
-                    
-                    data_str = str(row['data']).strip()
-                    try:
-                        # Tentar diferentes formatos de data
-                        if '-' in data_str:
-                            data_obj = datetime.strptime(data_str, '%d-%m-%Y').date()
-                        elif '/' in data_str:
-                            data_obj = datetime.strptime(data_str, '%d/%m/%Y').date()
-                        else:
-                            continue
-                    except:
-                        continue
-                    
-                    # Processar link e canal
-                    link_plataforma = str(row['link_plataforma']).strip() if not pd.isna(row['link_plataforma']) else ''
-                    nome_canal = str(row['nome_canal']).strip() if not pd.isna(row['nome_canal']) else ''
-                    
-                    if not link_plataforma or not nome_canal:
-                        continue
-                    
-                    # Criar registro na agenda
-                    agenda_item = Agenda(
-                        hora=hora_obj,
-                        data=data_obj,
-                        link_plataforma=link_plataforma,
-                        nome_canal=nome_canal
-                    )
-                    
-                    db.session.add(agenda_item)
-                    registros_inseridos += 1
-                    
-                except Exception as e:
-                    print(f"Erro ao processar linha {index}: {e}")
-                    continue
-            
-            db.session.commit()
-            
-            # Remover arquivo temporário
-            os.remove(filepath)
-            
-            return jsonify({
-                'success': True,
-                'message': f'Agenda importada com sucesso! {registros_inseridos} registros inseridos.',
-                'registros_inseridos': registros_inseridos
-            })
-            
-        except Exception as e:
-            # Remover arquivo temporário em caso de erro
-            if os.path.exists(filepath):
-                os.remove(filepath)
-            return jsonify({'success': False, 'message': f'Erro ao processar arquivo: {str(e)}'}), 500
+        modo = request.form.get('modo', MODO_SUBSTITUIR)
+        if modo not in MODOS_IMPORTACAO:
+            return jsonify({'success': False, 'message': f"Modo de importação inválido. Use: {', '.join(MODOS_IMPORTACAO)}"}), 400
+        
+        # Leitura e gravação rodam em segundo plano; o status sai em /importacoes/<tarefa_id>
+        extensao = file.filename.rsplit('.', 1)[1].lower()
+        tarefa = current_app.extensions['importacao'].enviar(file, extensao, modo, admin_id)
         
+        return jsonify({
+            'success': True,
+            'message': 'Importação iniciada. Acompanhe o andamento pelo status da tarefa.',
+            'tarefa': tarefa.to_dict(),
+            'status_url': url_for('agenda.status_importacao', tarefa_id=tarefa.id)
+        }), 202
+        
+    except RequestEntityTooLarge:
+        limite_mb = current_app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+        return jsonify({'success': False, 'message': f'Arquivo maior que o limite de {limite_mb} MB'}), 413
     except Exception as e:
         return jsonify({'success': False, 'message': f'Erro no upload: {str(e)}'}), 500
 
-@agenda_bp.route('/exportar-excel', methods=['GET'])
-def exportar_excel():
-    """Exporta a agenda atual para Excel"""
+@agenda_bp.route('/importacoes/<tarefa_id>', methods=['GET'])
+def status_importacao(tarefa_id):
+    """Andamento de uma importação da agenda: etapa, percentual, linhas aceitas/rejeitadas e duração"""
     try:
         admin_id = session.get('admin_id')
         if not admin_id:
             return jsonify({'success': False, 'message': 'Acesso negado'}), 401
         
-        # Buscar todos os itens da agenda
-        agenda_items = Agenda.query.order_by(Agenda.data, Agenda.hora).all()
-        
-        dados_agenda = []
-        for item in agenda_items:
-            dados_agenda.append({
-                'Hora': item.hora.strftime('%H:%M'),
-                'Data': item.data.strftime('%d-%m-%Y'),
-                'Link Plataforma': item.link_plataforma,
-                'Nome Canal': item.nome_canal
-            })
+        tarefa = db.session.get(TarefaImportacao, tarefa_id)
+        if not tarefa:
+            return jsonify({'success': False, 'message': 'Tarefa de importação não encontrada'}), 404
         
-        # Criar DataFrame
-        df = pd.DataFrame(dados_agenda)
+        return jsonify({
+            'success': True,
+            'tarefa': tarefa.to_dict()
+        })
         
-        # Criar arquivo Excel em memória
-        from io import BytesIO
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Agenda', index=False)
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Erro ao obter status da importação: {str(e)}'}), 500
+
+@agenda_bp.route('/exportar-excel', methods=['GET'])
+def exportar_excel():
+    """Exporta a agenda atual para Excel"""
+    try:
+        admin_id = session.get('admin_id')
+        if not admin_id:
+            return jsonify({'success': False, 'message': 'Acesso negado'}), 401
         
-        output.seek(0)
+        # Buscar os itens da agenda em lotes, só com as colunas exportadas
+        consulta = (
+            select(Agenda.hora, Agenda.data, Agenda.link_plataforma, Agenda.nome_canal)
+            .order_by(Agenda.data, Agenda.hora)
+            .execution_options(yield_per=LOTE_EXPORTACAO)
+        )
+        linhas = (
+            (hora.strftime('%H:%M'), data.strftime('%d-%m-%Y'), link_plataforma, nome_canal)
+            for hora, data, link_plataforma, nome_canal in db.session.execute(consulta)
+        )
         
-        # Criar resposta
-        from flask import make_response
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        response.headers['Content-Disposition'] = 'attachment; filename=agenda_weblurk.xlsx'
+        arquivo = gerar_xlsx('Agenda', ['Hora', 'Data', 'Link Plataforma', 'Nome Canal'], linhas)
         
-        return response
+        return resposta_xlsx(arquivo, 'agenda_weblurk.xlsx')
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'Erro ao exportar Excel: {str(e)}'}), 500
@@ -180,6 +109,7 @@ def limpar_agenda():
         
         # Deletar todos os registros da agenda
         Agenda.query.delete()
+        registrar_alteracao_agenda()
         db.session.commit()
         
         return jsonify({
@@ -199,25 +129,25 @@ def obter_agenda():
             return jsonify({'success': False, 'message': 'Acesso negado'}), 401
         
         data_param = request.args.get('data')
+        data_obj = None
         
         if data_param:
             # Buscar agenda de uma data específica
             try:
                 data_obj = datetime.strptime(data_param, '%Y-%m-%d').date()
-                agenda_items = Agenda.query.filter_by(data=data_obj).order_by(Agenda.hora).all()
-            except:
+            except ValueError:
                 return jsonify({'success': False, 'message': 'Formato de data inválido. Use YYYY-MM-DD'}), 400
-        else:
-            # Buscar toda a agenda
-            agenda_items = Agenda.query.order_by(Agenda.data, Agenda.hora).all()
         
-        agenda_list = [item.to_dict() for item in agenda_items]
+        def gerar_corpo():
+            agenda_list = cache_agenda.itens(data_obj)
+            return {
+                'success': True,
+                'agenda': agenda_list,
+                'total_items': len(agenda_list)
+            }
         
-        return jsonify({
-            'success': True,
-            'agenda': agenda_list,
-            'total_items': len(agenda_list)
-        })
+        # Agenda servida do cache; 304 se o administrador já tem a versão atual
+        return resposta_condicional(etag_agenda(data_obj), gerar_corpo)
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'Erro ao obter agenda: {str(e)}'}), 500
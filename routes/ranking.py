@@ -1,115 +1,127 @@
 from flask import Blueprint, request, jsonify, session
 from src.models.database import db, Usuario
-from sqlalchemy import desc
-import pandas as pd
+from src.services.pontuacao import sincronizar_pontos
+from src.services.ranking import obter_pagina, obter_posicao, calcular_media
+from src.services.exportacao import LOTE_EXPORTACAO, gerar_xlsx, resposta_xlsx
+from src.services.operacoes_ranking import zerar_pontos, editar_pontos, excluir_usuarios
+from sqlalchemy import desc, select
+import csv
 import io
-from flask import make_response
+from flask import Response, stream_with_context
 
 ranking_bp = Blueprint('ranking', __name__)
 
+# Tamanho de cada bloco enviado na exportação CSV
+TAMANHO_BLOCO_CSV = 64 * 1024
+
 @ranking_bp.route('/obter-ranking', methods=['GET'])
 def obter_ranking():
-    """Obtém o ranking dos usuários por pontuação"""
+    """Obtém o ranking dos usuários por pontuação (completo ou paginado)"""
     try:
         admin_id = session.get('admin_id')
         if not admin_id:
             return jsonify({'success': False, 'message': 'Acesso negado'}), 401
         
-        # Buscar usuários ordenados por pontuação (maior para menor)
-        usuarios = Usuario.query.order_by(desc(Usuario.pontos)).all()
+        sincronizar_pontos()
         
-        ranking_list = []
-        for posicao, usuario in enumerate(usuarios, 1):
-            # Calcular média baseada em 1000 pontos
-            media = (usuario.pontos / 1000) * 100 if usuario.pontos > 0 else 0
-            
-            ranking_list.append({
-                'posicao': posicao,
-                'espectador': usuario.nick_canal,
-                'pontos': usuario.pontos,
-                'media': round(media, 2)
-            })
+        # Sem parâmetros o ranking vem completo; com pagina/por_pagina, só a página pedida
+        por_pagina = request.args.get('por_pagina', type=int)
+        pagina = max(request.args.get('pagina', 1, type=int), 1)
+        if por_pagina is not None and por_pagina <= 0:
+            return jsonify({'success': False, 'message': 'por_pagina deve ser maior que zero'}), 400
+        
+        inicio = (pagina - 1) * por_pagina if por_pagina else 0
+        ranking_list, total = obter_pagina(inicio, por_pagina)
         
         return jsonify({
             'success': True,
             'ranking': ranking_list,
-            'total_usuarios': len(ranking_list)
+            'total_usuarios': total,
+            'pagina': pagina if por_pagina else 1,
+            'por_pagina': por_pagina
         })
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'Erro ao obter ranking: {str(e)}'}), 500
 
-@ranking_bp.route('/exportar-xlsx', methods=['GET'])
-def exportar_xlsx():
-    """Exporta o ranking para arquivo Excel (.xlsx)"""
+@ranking_bp.route('/posicao/<path:nick_canal>', methods=['GET'])
+def posicao_usuario(nick_canal):
+    """Obtém a posição de um espectador no ranking"""
     try:
         admin_id = session.get('admin_id')
         if not admin_id:
             return jsonify({'success': False, 'message': 'Acesso negado'}), 401
         
-        # Buscar dados do ranking
-        usuarios = Usuario.query.order_by(desc(Usuario.pontos)).all()
+        sincronizar_pontos()
         
-        dados_ranking = []
-        for posicao, usuario in enumerate(usuarios, 1):
-            media = (usuario.pontos / 1000) * 100 if usuario.pontos > 0 else 0
-            dados_ranking.append({
-                'Posição': posicao,
-                'Espectadores': usuario.nick_canal,
-                'Pontos': usuario.pontos,
-                'Média': round(media, 2)
-            })
+        item = obter_posicao(nick_canal.strip())
+        if not item:
+            return jsonify({'success': False, 'message': 'Espectador não encontrado'}), 404
         
-        # Criar DataFrame
-        df = pd.DataFrame(dados_ranking)
+        return jsonify({'success': True, **item})
         
-        # Criar arquivo Excel em memória
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Ranking', index=False)
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Erro ao obter posição: {str(e)}'}), 500
+
+@ranking_bp.route('/exportar-xlsx', methods=['GET'])
+def exportar_xlsx():
+    """Exporta o ranking para arquivo Excel (.xlsx)"""
+    try:
+        admin_id = session.get('admin_id')
+        if not admin_id:
+            return jsonify({'success': False, 'message': 'Acesso negado'}), 401
         
-        output.seek(0)
+        sincronizar_pontos()
         
-        # Criar resposta
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        response.headers['Content-Disposition'] = 'attachment; filename=ranking_weblurk.xlsx'
+        consulta = (
+            select(Usuario.nick_canal, Usuario.pontos)
+            .order_by(desc(Usuario.pontos), Usuario.id)
+            .execution_options(yield_per=LOTE_EXPORTACAO)
+        )
+        linhas = (
+            (posicao, nick_canal, pontos, float(calcular_media(pontos)))
+            for posicao, (nick_canal, pontos) in enumerate(db.session.execute(consulta), 1)
+        )
         
-        return response
+        arquivo = gerar_xlsx('Ranking', ['Posição', 'Espectadores', 'Pontos', 'Média'], linhas)
+        
+        return resposta_xlsx(arquivo, 'ranking_weblurk.xlsx')
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'Erro ao exportar Excel: {str(e)}'}), 500
 
 @ranking_bp.route('/exportar-csv', methods=['GET'])
 def exportar_csv():
-    """Exporta o ranking para arquivo CSV"""
+    """Exporta o ranking para arquivo CSV, gerado linha a linha durante o envio"""
     try:
         admin_id = session.get('admin_id')
         if not admin_id:
             return jsonify({'success': False, 'message': 'Acesso negado'}), 401
         
-        # Buscar dados do ranking
-        usuarios = Usuario.query.order_by(desc(Usuario.pontos)).all()
+        sincronizar_pontos()
         
-        dados_ranking = []
-        for posicao, usuario in enumerate(usuarios, 1):
-            media = (usuario.pontos / 1000) * 100 if usuario.pontos > 0 else 0
-            dados_ranking.append({
-                'Posição': posicao,
-                'Espectadores': usuario.nick_canal,
-                'Pontos': usuario.pontos,
-                'Média': round(media, 2)
-            })
+        # Só as colunas necessárias, lidas do cursor em lotes na ordem do índice do ranking
+        consulta = (
+            select(Usuario.nick_canal, Usuario.pontos)
+            .order_by(desc(Usuario.pontos), Usuario.id)
+            .execution_options(yield_per=LOTE_EXPORTACAO)
+        )
         
-        # Criar DataFrame
-        df = pd.DataFrame(dados_ranking)
-        
-        # Criar arquivo CSV em memória
-        output = io.StringIO()
-        df.to_csv(output, index=False, encoding='utf-8')
+        def gerar_csv():
+            buffer = io.StringIO()
+            escritor = csv.writer(buffer, lineterminator='\n')
+            escritor.writerow(['Posição', 'Espectadores', 'Pontos', 'Média'])
+            
+            for posicao, (nick_canal, pontos) in enumerate(db.session.execute(consulta), 1):
+                escritor.writerow([posicao, nick_canal, pontos, float(calcular_media(pontos))])
+                if buffer.tell() >= TAMANHO_BLOCO_CSV:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            
+            yield buffer.getvalue()
         
-        # Criar resposta
-        response = make_response(output.getvalue())
+        response = Response(stream_with_context(gerar_csv()), mimetype='text/csv')
         response.headers['Content-Type'] = 'text/csv; charset=utf-8'
         response.headers['Content-Disposition'] = 'attachment; filename=ranking_weblurk.csv'
         
@@ -126,18 +138,104 @@ def limpar_ranking():
         if not admin_id:
             return jsonify({'success': False, 'message': 'Acesso negado'}), 401
         
-        # Resetar pontos de todos os usuários
-        usuarios = Usuario.query.all()
-        for usuario in usuarios:
-            usuario.pontos = 0
-        
+        # Um único UPDATE, sem carregar os usuários
+        usuarios_afetados = zerar_pontos()
         db.session.commit()
         
         return jsonify({
             'success': True,
-            'message': 'Ranking limpo com sucesso!'
+            'message': 'Ranking limpo com sucesso!',
+            'usuarios_afetados': usuarios_afetados
         })
         
     except Exception as e:
+        db.session.rollback()
         return jsonify({'success': False, 'message': f'Erro ao limpar ranking: {str(e)}'}), 500
 
+def _pontos_validos(pontos):
+    return isinstance(pontos, int) and not isinstance(pontos, bool) and pontos >= 0
+
+@ranking_bp.route('/editar-pontos', methods=['PUT'])
+def editar_pontos_usuarios():
+    """Define os pontos de um espectador ou, com 'alteracoes', de vários de uma vez"""
+    try:
+        admin_id = session.get('admin_id')
+        if not admin_id:
+            return jsonify({'success': False, 'message': 'Acesso negado'}), 401
+        
+        data = request.get_json(silent=True) or {}
+        em_lote = 'alteracoes' in data
+        alteracoes = data.get('alteracoes') if em_lote else [data]
+        if not isinstance(alteracoes, list) or not alteracoes:
+            return jsonify({'success': False, 'message': 'Informe as alterações de pontos'}), 400
+        
+        pontos_por_nick = {}
+        for alteracao in alteracoes:
+            nick_canal = str(alteracao.get('nick_canal') or '').strip() if isinstance(alteracao, dict) else ''
+            pontos = alteracao.get('pontos') if isinstance(alteracao, dict) else None
+            if not nick_canal:
+                return jsonify({'success': False, 'message': 'Nick do canal é obrigatório'}), 400
+            if not _pontos_validos(pontos):
+                return jsonify({'success': False, 'message': f'Pontos inválidos para {nick_canal}'}), 400
+            pontos_por_nick[nick_canal] = pontos
+        
+        atualizados, nao_encontrados = editar_pontos(pontos_por_nick)
+        if not em_lote and not atualizados:
+            return jsonify({'success': False, 'message': 'Espectador não encontrado'}), 404
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': f'Pontos atualizados para {atualizados} espectador(es)!',
+            'usuarios_atualizados': atualizados,
+            'nao_encontrados': nao_encontrados
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'Erro ao editar pontos: {str(e)}'}), 500
+
+@ranking_bp.route('/excluir-usuario/<path:nick_canal>', methods=['DELETE'])
+def excluir_usuario(nick_canal):
+    """Exclui um espectador e as suas sessões de lurk"""
+    try:
+        admin_id = session.get('admin_id')
+        if not admin_id:
+            return jsonify({'success': False, 'message': 'Acesso negado'}), 401
+        
+        resultado = excluir_usuarios([nick_canal.strip()])
+        if not resultado['usuarios_excluidos']:
+            return jsonify({'success': False, 'message': 'Espectador não encontrado'}), 404
+        db.session.commit()
+        
+        return jsonify({'success': True, 'message': 'Espectador excluído com sucesso!', **resultado})
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'Erro ao excluir espectador: {str(e)}'}), 500
+
+@ranking_bp.route('/excluir-usuarios', methods=['POST'])
+def excluir_varios_usuarios():
+    """Exclui vários espectadores de uma vez, com DELETEs em lote"""
+    try:
+        admin_id = session.get('admin_id')
+        if not admin_id:
+            return jsonify({'success': False, 'message': 'Acesso negado'}), 401
+        
+        data = request.get_json(silent=True) or {}
+        nicks = data.get('nicks')
+        if not isinstance(nicks, list) or not nicks:
+            return jsonify({'success': False, 'message': 'Informe a lista de nicks'}), 400
+        
+        resultado = excluir_usuarios([str(nick).strip() for nick in nicks])
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': f"{resultado['usuarios_excluidos']} espectador(es) excluído(s)!",
+            **resultado
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'Erro ao excluir espectadores: {str(e)}'}), 500
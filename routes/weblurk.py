@@ -1,34 +1,41 @@
-from flask import Blueprint, request, jsonify, session
-from src.models.database import db, Usuario, SessaoLurk, Agenda
+from flask import Blueprint, Response, current_app, request, jsonify, session
+from src.models.database import db, Usuario, SessaoLurk
+from src.services.pontuacao import materializar_pontos
+from src.services.eventos import eventos, filtro_espectador, LimiteAssinantes, MAXIMO_ASSINANTES
+from src.services.cache_agenda import cache_agenda, etag_agenda, resposta_condicional
+from src.services.linha_tempo_agenda import linha_tempo_agenda
+from src.services.presenca import presenca, notificar_presenca, CAMPOS_USUARIO
+from src.services.ranking import ranking, registrar_alteracao_ranking
+from src.services.transacao import apos_commit
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timedelta
-import threading
+import json
 import time
 
 weblurk_bp = Blueprint('weblurk', __name__)
 
-# Dicionário para controlar threads de pontuação
-pontuacao_threads = {}
-
-def gerar_pontos_usuario(usuario_id):
-    """Thread para gerar pontos a cada 6 minutos"""
-    while usuario_id in pontuacao_threads and pontuacao_threads[usuario_id]:
-        time.sleep(360)  # 6 minutos = 360 segundos
-        
-        if usuario_id in pontuacao_threads and pontuacao_threads[usuario_id]:
-            usuario = Usuario.query.get(usuario_id)
-            if usuario and usuario.online:
-                usuario.pontos += 1
-                usuario.ultima_atividade = datetime.utcnow()
-                
-                # Atualizar sessão ativa
-                sessao_ativa = SessaoLurk.query.filter_by(
-                    usuario_id=usuario_id, 
-                    ativa=True
-                ).first()
-                if sessao_ativa:
-                    sessao_ativa.pontos_gerados += 1
-                
-                db.session.commit()
+# Tempo máximo, em segundos, que o navegador reaproveita a resposta de /agenda-agora
+MAXIMO_CACHE_AGENDA_AGORA = 60
+
+# Página padrão e máxima de /usuarios-online
+LIMITE_USUARIOS_ONLINE = 100
+LIMITE_MAXIMO_USUARIOS_ONLINE = 1000
+
+# Stream de eventos: comentário de keepalive a cada INTERVALO_KEEPALIVE segundos (detecta
+# conexões mortas) e encerramento após DURACAO_MAXIMA_STREAM, com reconexão automática do navegador
+INTERVALO_KEEPALIVE = 15
+DURACAO_MAXIMA_STREAM = 300
+RECONEXAO_MS = 3000
+
+# Streams de cada worker que os espectadores não podem ocupar, para o painel sempre conectar
+STREAMS_RESERVADOS_PAINEL = 5
+
+def _mensagem_sse(evento_id, tipo, dados):
+    return f"id: {evento_id}\nevent: {tipo}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+def _servidor_suporta_stream():
+    # Num worker síncrono (uma requisição por vez) o stream prenderia o worker inteiro
+    return request.environ.get('wsgi.multithread') or current_app.config.get('SERVIDOR_ASSINCRONO')
 
 @weblurk_bp.route('/salvar-nick', methods=['POST'])
 def salvar_nick():
@@ -47,7 +54,16 @@ def salvar_nick():
             # Criar novo usuário
             usuario = Usuario(nick_canal=nick_canal)
             db.session.add(usuario)
-            db.session.commit()
+            try:
+                db.session.flush()
+                # O novo usuário entra no ranking deste worker no commit; os demais recarregam pela versão
+                apos_commit(ranking.atualizar, [(usuario.id, usuario.nick_canal, usuario.pontos)])
+                registrar_alteracao_ranking()
+                db.session.commit()
+            except IntegrityError:
+                # Nick criado por outra requisição ao mesmo tempo (índice único)
+                db.session.rollback()
+                usuario = Usuario.query.filter_by(nick_canal=nick_canal).first()
             
         # Salvar na sessão
         session['usuario_id'] = usuario.id
@@ -77,7 +93,10 @@ def iniciar_lurk():
         if not usuario:
             return jsonify({'success': False, 'message': 'Usuário não encontrado'}), 404
         
-        # Finalizar sessão anterior se existir
+        # Gravar os pontos pendentes e finalizar sessão anterior se existir
+        agora = datetime.utcnow()
+        materializar_pontos(agora, usuario_id=usuario_id)
+        
         sessao_anterior = SessaoLurk.query.filter_by(
             usuario_id=usuario_id, 
             ativa=True
@@ -85,11 +104,7 @@ def iniciar_lurk():
         
         if sessao_anterior:
             sessao_anterior.ativa = False
-            sessao_anterior.fim_sessao = datetime.utcnow()
-        
-        # Parar thread anterior se existir
-        if usuario_id in pontuacao_threads:
-            pontuacao_threads[usuario_id] = False
+            sessao_anterior.fim_sessao = agora
         
         # Criar nova sessão
         nova_sessao = SessaoLurk(
@@ -103,14 +118,11 @@ def iniciar_lurk():
         usuario.online = True
         usuario.tipo_janela = tipo_janela
         usuario.ultima_atividade = datetime.utcnow()
+        notificar_presenca(usuario, True)
         
+        # A pontuação é concedida pelo agendador único (services/pontuacao.py)
         db.session.commit()
-        
-        # Iniciar thread de pontuação
-        pontuacao_threads[usuario_id] = True
-        thread = threading.Thread(target=gerar_pontos_usuario, args=(usuario_id,))
-        thread.daemon = True
-        thread.start()
+        presenca.registrar(usuario, nova_sessao)
         
         return jsonify({
             'success': True,
@@ -135,7 +147,10 @@ def finalizar_lurk():
         if not usuario:
             return jsonify({'success': False, 'message': 'Usuário não encontrado'}), 404
         
-        # Finalizar sessão ativa
+        # Gravar os pontos pendentes e finalizar sessão ativa
+        agora = datetime.utcnow()
+        materializar_pontos(agora, usuario_id=usuario_id)
+        
         sessao_ativa = SessaoLurk.query.filter_by(
             usuario_id=usuario_id, 
             ativa=True
@@ -143,18 +158,15 @@ def finalizar_lurk():
         
         if sessao_ativa:
             sessao_ativa.ativa = False
-            sessao_ativa.fim_sessao = datetime.utcnow()
-        
-        # Parar thread de pontuação
-        if usuario_id in pontuacao_threads:
-            pontuacao_threads[usuario_id] = False
-            del pontuacao_threads[usuario_id]
+            sessao_ativa.fim_sessao = agora
         
         # Atualizar usuário
         usuario.online = False
-        usuario.ultima_atividade = datetime.utcnow()
+        usuario.ultima_atividade = agora
+        notificar_presenca(usuario, False)
         
         db.session.commit()
+        presenca.registrar(usuario)
         
         return jsonify({
             'success': True,
@@ -164,6 +176,20 @@ def finalizar_lurk():
     except Exception as e:
         return jsonify({'success': False, 'message': f'Erro ao finalizar lurk: {str(e)}'}), 500
 
+@weblurk_bp.route('/heartbeat', methods=['POST'])
+def heartbeat():
+    """Registra que o usuário continua em lurk (apenas em memória, gravado em lote)"""
+    try:
+        usuario_id = session.get('usuario_id')
+        
+        if not usuario_id:
+            return jsonify({'success': False, 'message': 'Usuário não encontrado na sessão'}), 400
+        
+        return jsonify({'success': True, 'lurk_ativo': presenca.batimento(usuario_id)})
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Erro ao registrar heartbeat: {str(e)}'}), 500
+
 @weblurk_bp.route('/status-lurk', methods=['GET'])
 def status_lurk():
     """Retorna o status atual do lurk do usuário"""
@@ -173,6 +199,11 @@ def status_lurk():
         if not usuario_id:
             return jsonify({'lurk_ativo': False, 'usuario': None})
         
+        # Caminho rápido: status em memória, sem consultar o banco
+        status = presenca.status(usuario_id)
+        if status is not None:
+            return jsonify(status)
+        
         usuario = Usuario.query.get(usuario_id)
         if not usuario:
             return jsonify({'lurk_ativo': False, 'usuario': None})
@@ -182,45 +213,129 @@ def status_lurk():
             ativa=True
         ).first()
         
-        return jsonify({
-            'lurk_ativo': usuario.online and sessao_ativa is not None,
-            'usuario': usuario.to_dict(),
-            'sessao': sessao_ativa.to_dict() if sessao_ativa else None
-        })
+        # Só carrega a entrada em memória: nada mudou, não há evento a publicar
+        presenca.registrar(usuario, sessao_ativa)
+        
+        return jsonify(presenca.status(usuario_id))
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'Erro ao verificar status: {str(e)}'}), 500
 
+@weblurk_bp.route('/eventos', methods=['GET'])
+def stream_eventos():
+    """Stream SSE de mudanças: tudo para o painel; para o espectador, o próprio lurk e a agenda"""
+    try:
+        limite = current_app.config.get('MAXIMO_STREAMS_EVENTOS', MAXIMO_ASSINANTES)
+        filtro = None
+        if not session.get('admin_id'):
+            filtro = filtro_espectador(session.get('usuario_id'))
+            limite -= STREAMS_RESERVADOS_PAINEL
+        
+        if not _servidor_suporta_stream():
+            return jsonify({
+                'success': False,
+                'message': 'Stream de eventos exige servidor com threads ou assíncrono; use a atualização periódica'
+            }), 503
+        
+        try:
+            assinatura = eventos.assinar(request.headers.get('Last-Event-ID'), filtro, limite)
+        except LimiteAssinantes:
+            return jsonify({'success': False, 'message': 'Streams de eventos demais abertos; use a atualização periódica'}), 503
+        
+        def gerar():
+            try:
+                yield f'retry: {RECONEXAO_MS}\n\n'
+                fim = time.monotonic() + DURACAO_MAXIMA_STREAM
+                while time.monotonic() < fim:
+                    lote = assinatura.proximos(INTERVALO_KEEPALIVE)
+                    if not lote:
+                        yield ': keepalive\n\n'
+                        continue
+                    for evento_id, tipo, dados in lote:
+                        yield _mensagem_sse(evento_id, tipo, dados)
+            finally:
+                eventos.cancelar(assinatura)
+        
+        # Os eventos chegam pelo leitor do worker: o stream não consulta o banco
+        resposta = Response(gerar(), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+        # Conexão fechada antes do primeiro envio: o gerador nem começou e o finally não roda
+        resposta.call_on_close(lambda: eventos.cancelar(assinatura))
+        return resposta
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Erro ao abrir stream de eventos: {str(e)}'}), 500
+
 @weblurk_bp.route('/agenda-atual', methods=['GET'])
 def agenda_atual():
     """Retorna a agenda do dia atual"""
     try:
         data_hoje = datetime.now().date()
         
-        agenda_hoje = Agenda.query.filter_by(data=data_hoje).order_by(Agenda.hora).all()
+        # Agenda do dia servida do cache; 304 se o navegador já tem a versão atual
+        return resposta_condicional(etag_agenda(data_hoje), lambda: {
+            'success': True,
+            'data': data_hoje.strftime('%Y-%m-%d'),
+            'agenda': cache_agenda.itens(data_hoje)
+        })
         
-        agenda_list = [item.to_dict() for item in agenda_hoje]
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Erro ao buscar agenda: {str(e)}'}), 500
+
+@weblurk_bp.route('/agenda-agora', methods=['GET'])
+def agenda_agora():
+    """Retorna só o canal ao vivo agora e o próximo da agenda"""
+    try:
+        agora = datetime.now()
+        ao_vivo, proximo, proxima_mudanca = linha_tempo_agenda.agora(agora)
         
-        return jsonify({
+        resposta = jsonify({
             'success': True,
-            'data': data_hoje.strftime('%Y-%m-%d'),
-            'agenda': agenda_list
+            'agora': agora.isoformat(),
+            'ao_vivo': ao_vivo,
+            'proximo': proximo,
+            'proxima_mudanca': proxima_mudanca.isoformat() if proxima_mudanca else None
         })
+        # O navegador pode reaproveitar a resposta até a próxima troca de canal (no máximo 1 minuto)
+        segundos = int((proxima_mudanca - agora).total_seconds()) if proxima_mudanca else MAXIMO_CACHE_AGENDA_AGORA
+        resposta.headers['Cache-Control'] = f'max-age={max(0, min(segundos, MAXIMO_CACHE_AGENDA_AGORA))}'
+        return resposta
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'Erro ao buscar agenda: {str(e)}'}), 500
 
 @weblurk_bp.route('/usuarios-online', methods=['GET'])
 def usuarios_online():
-    """Retorna lista de usuários online"""
+    """Retorna usuários online paginados por id (limite, apos_id), com campos opcionais ou só o total"""
     try:
-        usuarios = Usuario.query.filter_by(online=True).all()
-        usuarios_list = [usuario.to_dict() for usuario in usuarios]
+        if request.args.get('apenas_total', '').lower() in ('1', 'true'):
+            return jsonify({'success': True, 'total': presenca.total_online()})
+        
+        try:
+            limite = min(int(request.args.get('limite', LIMITE_USUARIOS_ONLINE)), LIMITE_MAXIMO_USUARIOS_ONLINE)
+            apos_id = int(request.args.get('apos_id', 0))
+        except ValueError:
+            return jsonify({'success': False, 'message': 'limite e apos_id devem ser números inteiros'}), 400
+        if limite < 1:
+            return jsonify({'success': False, 'message': 'limite deve ser maior que zero'}), 400
+        
+        campos = None
+        if request.args.get('campos'):
+            campos = [campo.strip() for campo in request.args['campos'].split(',') if campo.strip()]
+            invalidos = [campo for campo in campos if campo not in CAMPOS_USUARIO]
+            if invalidos:
+                return jsonify({'success': False, 'message': f"Campos inválidos: {', '.join(invalidos)}"}), 400
+        
+        # Página servida da memória de presença; apos_id continua de onde a página anterior parou
+        usuarios_list, total, proximo_apos_id = presenca.pagina_online(apos_id, limite, campos)
         
         return jsonify({
             'success': True,
             'usuarios_online': usuarios_list,
-            'total': len(usuarios_list)
+            'total': total,
+            'proximo_apos_id': proximo_apos_id
         })
         
     except Exception as e:
@@ -0,0 +1,117 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from flask import current_app, jsonify, request
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+from src.models.database import db, Agenda, VersaoCache
+from src.services.eventos import eventos, EVENTO_AGENDA
+from src.services.transacao import apos_commit
+
+NOME_VERSAO = 'agenda'
+
+# Com vários workers, a versão gravada por outro processo é percebida em até este intervalo (segundos)
+INTERVALO_VERIFICACAO = 2
+
+# Dias mantidos em cache; o menos usado sai primeiro
+MAXIMO_DIAS_EM_CACHE = 31
+
+# A agenda completa só é guardada em memória até este tamanho; acima disso vale só o ETag
+MAXIMO_ITENS_AGENDA_COMPLETA = 20000
+
+def _nova_versao():
+    return uuid.uuid4().hex[:16]
+
+def registrar_alteracao_agenda():
+    """Troca a versão da agenda na transação corrente; o cache deste processo acompanha no commit"""
+    versao = _nova_versao()
+    valores = {'versao': versao, 'atualizada_em': datetime.utcnow()}
+    db.session.execute(
+        insert(VersaoCache)
+        .values(nome=NOME_VERSAO, **valores)
+        .on_conflict_do_update(index_elements=['nome'], set_=valores)
+    )
+    apos_commit(cache_agenda.definir_versao, versao)
+    eventos.publicar_na_transacao(EVENTO_AGENDA, {'versao': versao})
+    return versao
+
+class CacheAgenda:
+    """Itens da agenda por dia, serializados uma vez e válidos enquanto a versão não mudar
+
+    A versão fica na tabela versoes_cache e é trocada na mesma transação de
+    cada alteração da agenda, então todos os workers enxergam a invalidação.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versao = None
+        self._verificada_em = 0.0
+        self._itens = OrderedDict()  # data (None = agenda completa) -> itens serializados
+
+    def versao(self):
+        """Versão atual da agenda, relida do banco no máximo a cada INTERVALO_VERIFICACAO"""
+        agora = time.monotonic()
+        with self._lock:
+            if self._versao is not None and agora - self._verificada_em < INTERVALO_VERIFICACAO:
+                return self._versao
+
+        consulta = select(VersaoCache.versao).where(VersaoCache.nome == NOME_VERSAO)
+        versao = db.session.execute(consulta).scalar()
+        if versao is None:
+            # Banco novo: cria a versão; se outro worker criou antes, vale a dele
+            db.session.execute(
+                insert(VersaoCache).values(nome=NOME_VERSAO, versao=_nova_versao()).on_conflict_do_nothing()
+            )
+            versao = db.session.execute(consulta).scalar()
+        db.session.commit()
+
+        self.definir_versao(versao, agora)
+        return versao
+
+    def definir_versao(self, versao, verificada_em=None):
+        with self._lock:
+            if versao != self._versao:
+                self._itens.clear()
+                self._versao = versao
+            self._verificada_em = time.monotonic() if verificada_em is None else verificada_em
+
+    def itens(self, data=None):
+        """Itens da agenda de um dia, ou da agenda completa com data=None"""
+        versao = self.versao()
+        with self._lock:
+            if data in self._itens:
+                self._itens.move_to_end(data)
+                return self._itens[data]
+
+        consulta = Agenda.query
+        if data is not None:
+            consulta = consulta.filter_by(data=data).order_by(Agenda.hora)
+        else:
+            consulta = consulta.order_by(Agenda.data, Agenda.hora)
+        itens = [item.to_dict() for item in consulta.all()]
+
+        with self._lock:
+            # Se a versão mudou durante a consulta, o resultado não entra no cache
+            if self._versao == versao and (data is not None or len(itens) <= MAXIMO_ITENS_AGENDA_COMPLETA):
+                self._itens[data] = itens
+                while len(self._itens) > MAXIMO_DIAS_EM_CACHE:
+                    self._itens.popitem(last=False)
+        return itens
+
+cache_agenda = CacheAgenda()
+
+def etag_agenda(data=None):
+    return f"agenda-{cache_agenda.versao()}-{data.isoformat() if data else 'completa'}"
+
+def resposta_condicional(etag, gerar_corpo):
+    """304 se o cliente já tem esta versão; senão o JSON de gerar_corpo(), ambos com o ETag"""
+    if request.if_none_match.contains(etag):
+        resposta = current_app.response_class(status=304)
+    else:
+        resposta = jsonify(gerar_corpo())
+    resposta.set_etag(etag)
+    # O navegador guarda a resposta, mas revalida a cada uso
+    resposta.headers['Cache-Control'] = 'no-cache'
+    return resposta
@@ -0,0 +1,249 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import select, insert, delete, func
+from src.models.database import db, Evento
+from src.services.transacao import apos_commit
+
+logger = logging.getLogger(__name__)
+
+EVENTO_PRESENCA = 'presenca'  # usuário entrou ou saiu do lurk
+EVENTO_PONTOS = 'pontos'  # pontos de usuários alterados
+EVENTO_RANKING = 'ranking'  # ranking alterado em massa (limpeza, edição, exclusão)
+EVENTO_AGENDA = 'agenda'  # nova versão da agenda
+EVENTO_SINCRONIZAR = 'sincronizar'  # eventos perdidos: o cliente deve recarregar tudo
+
+# Eventos mantidos na tabela para reenvio a clientes que reconectam com Last-Event-ID
+TAMANHO_HISTORICO = 1000
+
+# A cada tantas publicações os eventos além do histórico são apagados
+LIMPEZA_A_CADA = 100
+
+# Intervalo, em segundos, entre as leituras da tabela pelo leitor do worker, só enquanto
+# houver streams abertos; eventos publicados neste worker são lidos logo após o commit
+INTERVALO_LEITURA = 1
+
+# Eventos por leitura
+LOTE_LEITURA = 100
+
+# Streams abertos por worker, se a configuração não disser outro valor
+MAXIMO_ASSINANTES = 20
+
+class LimiteAssinantes(Exception):
+    """Streams demais abertos neste worker"""
+
+def filtro_espectador(usuario_id):
+    """Eventos da página de um espectador: a presença dele, a exclusão dele, a agenda e as sincronizações"""
+    def filtro(tipo, dados):
+        if tipo == EVENTO_PRESENCA:
+            return dados['usuario']['id'] == usuario_id
+        if tipo == EVENTO_RANKING:
+            return usuario_id in dados.get('ids', ())
+        return tipo in (EVENTO_AGENDA, EVENTO_SINCRONIZAR)
+    return filtro
+
+class Assinatura:
+    """Fila de eventos de um stream, alimentada pelo leitor do worker"""
+
+    def __init__(self, filtro=None):
+        self.cursor = 0  # id do último evento entregue
+        self._filtro = filtro
+        self._condicao = threading.Condition()
+        self._fila = deque()
+        # Enquanto o histórico do Last-Event-ID é lido, o que chega do leitor espera aqui
+        self._adiados = []
+        self._sincronizando = True
+
+    def receber(self, lote):
+        with self._condicao:
+            if self._sincronizando:
+                self._adiados.extend(lote)
+            else:
+                self._entregar(lote)
+
+    def iniciar(self, cursor, historico, perdeu):
+        """Entrega o histórico e o que chegou durante a leitura dele, nesta ordem"""
+        with self._condicao:
+            self.cursor = cursor
+            if perdeu:
+                self._fila.append(('', EVENTO_SINCRONIZAR, {}))
+            self._entregar(historico)
+            self._entregar(self._adiados)
+            self._adiados = []
+            self._sincronizando = False
+
+    def _entregar(self, lote):
+        # Chamado com o lock adquirido; histórico e leitor se sobrepõem, o cursor descarta repetidos
+        for evento_id, tipo, dados in lote:
+            if evento_id == '':
+                self._fila.append((evento_id, tipo, dados))
+                continue
+            if evento_id <= self.cursor:
+                continue
+            self.cursor = evento_id
+            if self._filtro is None or self._filtro(tipo, dados):
+                self._fila.append((evento_id, tipo, dados))
+        if self._fila:
+            self._condicao.notify_all()
+
+    def proximos(self, timeout):
+        """Eventos (id, tipo, dados) ainda não lidos; espera até timeout segundos por algum
+
+        Um EVENTO_SINCRONIZAR sem id avisa que eventos saíram do histórico antes de serem lidos.
+        """
+        with self._condicao:
+            if not self._fila:
+                self._condicao.wait(timeout)
+            lote = list(self._fila)
+            self._fila.clear()
+            return lote
+
+class BarramentoEventos:
+    """Eventos de mudança gravados na tabela eventos e distribuídos aos streams do worker
+
+    O evento entra na mesma transação da mudança, então todos os workers o
+    enxergam exatamente quando ela é confirmada; o id da linha é o Last-Event-ID.
+    Uma única thread por worker lê a tabela, e só enquanto houver streams abertos.
+    """
+
+    def __init__(self):
+        self._condicao = threading.Condition()
+        self._assinaturas = set()
+        self._cursor = None  # último id lido; None com o leitor parado
+        self._acordado = False
+        self._thread = None
+
+    def publicar_na_transacao(self, tipo, dados):
+        """Grava o evento na transação corrente; os streams só o recebem se ela for confirmada"""
+        evento_id = db.session.execute(
+            insert(Evento)
+            .values(tipo=tipo, dados=json.dumps(dados, ensure_ascii=False), criado_em=datetime.utcnow())
+            .returning(Evento.id)
+        ).scalar()
+        if evento_id % LIMPEZA_A_CADA == 0:
+            db.session.execute(delete(Evento).where(Evento.id <= evento_id - TAMANHO_HISTORICO))
+        # Os streams deste worker não esperam a próxima leitura periódica
+        apos_commit(self.acordar)
+        return evento_id
+
+    def acordar(self):
+        with self._condicao:
+            self._acordado = True
+            self._condicao.notify_all()
+
+    def assinar(self, ultimo_id=None, filtro=None, limite=MAXIMO_ASSINANTES):
+        """Abre um stream a partir de ultimo_id (Last-Event-ID); filtro(tipo, dados) escolhe os eventos entregues
+
+        Se ultimo_id já saiu do histórico, o stream começa com um EVENTO_SINCRONIZAR.
+        """
+        assinatura = Assinatura(filtro)
+        with self._condicao:
+            if len(self._assinaturas) >= limite:
+                raise LimiteAssinantes()
+            # O maior id é lido junto com o registro: o que vier depois dele chega pelo leitor
+            try:
+                menor, maior = db.session.execute(select(func.min(Evento.id), func.max(Evento.id))).one()
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            maior = maior or 0
+            if self._cursor is None:
+                self._cursor = maior
+            self._assinaturas.add(assinatura)
+            self._iniciar_leitor()
+            self._condicao.notify_all()
+
+        cursor, perdeu = maior, bool(ultimo_id)
+        if ultimo_id:
+            try:
+                pedido = int(ultimo_id)
+            except ValueError:
+                pedido = None
+            # Id de outro banco ou anterior ao histórico mantido
+            if pedido is not None and pedido <= maior and (menor is None or pedido >= menor - 1):
+                cursor, perdeu = pedido, False
+
+        historico = []
+        if cursor < maior:
+            try:
+                linhas = db.session.execute(
+                    select(Evento.id, Evento.tipo, Evento.dados)
+                    .where(Evento.id > cursor, Evento.id <= maior)
+                    .order_by(Evento.id)
+                ).all()
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                self.cancelar(assinatura)
+                raise
+            historico = [(linha.id, linha.tipo, json.loads(linha.dados)) for linha in linhas]
+        assinatura.iniciar(cursor, historico, perdeu)
+        return assinatura
+
+    def cancelar(self, assinatura):
+        with self._condicao:
+            self._assinaturas.discard(assinatura)
+
+    @property
+    def total_assinantes(self):
+        with self._condicao:
+            return len(self._assinaturas)
+
+    def _iniciar_leitor(self):
+        # Chamado com o lock adquirido
+        if self._thread is not None and self._thread.is_alive():
+            return
+        app = current_app._get_current_object()
+        self._thread = threading.Thread(target=self._ler, args=(app,), name='eventos-leitor', daemon=True)
+        self._thread.start()
+
+    def _ler(self, app):
+        with app.app_context():
+            while True:
+                with self._condicao:
+                    while not self._assinaturas:
+                        # Sem streams, nenhuma leitura; o próximo stream reposiciona o cursor
+                        self._cursor = None
+                        self._condicao.wait()
+                    if not self._acordado:
+                        self._condicao.wait(INTERVALO_LEITURA)
+                    self._acordado = False
+                    cursor = self._cursor
+                if cursor is None:
+                    continue
+
+                try:
+                    linhas = db.session.execute(
+                        select(Evento.id, Evento.tipo, Evento.dados)
+                        .where(Evento.id > cursor)
+                        .order_by(Evento.id)
+                        .limit(LOTE_LEITURA)
+                    ).all()
+                    # Não segurar uma transação de leitura aberta entre as consultas
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('Erro ao ler a tabela de eventos')
+                    time.sleep(INTERVALO_LEITURA)
+                    continue
+                if not linhas:
+                    continue
+
+                lote = [(linha.id, linha.tipo, json.loads(linha.dados)) for linha in linhas]
+                # Os ids são contínuos: um salto significa eventos apagados antes de serem lidos
+                if linhas[0].id > cursor + 1:
+                    lote.insert(0, ('', EVENTO_SINCRONIZAR, {}))
+                with self._condicao:
+                    self._cursor = linhas[-1].id
+                    if len(linhas) == LOTE_LEITURA:
+                        self._acordado = True
+                    assinaturas = list(self._assinaturas)
+                for assinatura in assinaturas:
+                    assinatura.receber(lote)
+
+eventos = BarramentoEventos()
@@ -0,0 +1,33 @@
+import tempfile
+from flask import send_file
+
+# Linhas lidas do banco por lote durante uma exportação
+LOTE_EXPORTACAO = 1000
+
+# Acima deste tamanho o arquivo gerado sai da memória para um temporário em disco
+TAMANHO_MAXIMO_EM_MEMORIA = 8 * 1024 * 1024
+
+MIMETYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+def gerar_xlsx(nome_planilha, cabecalho, linhas):
+    """Grava as linhas num XLSX em modo write-only; retorna um arquivo temporário posicionado no início
+
+    O openpyxl em modo write-only descarta cada linha depois de escrevê-la, então
+    o uso de memória não depende da quantidade de linhas.
+    """
+    from openpyxl import Workbook
+
+    pasta = Workbook(write_only=True)
+    planilha = pasta.create_sheet(nome_planilha)
+    planilha.append(cabecalho)
+    for linha in linhas:
+        planilha.append(linha)
+
+    arquivo = tempfile.SpooledTemporaryFile(max_size=TAMANHO_MAXIMO_EM_MEMORIA)
+    pasta.save(arquivo)
+    arquivo.seek(0)
+    return arquivo
+
+def resposta_xlsx(arquivo, nome_arquivo):
+    """Envia o arquivo gerado por gerar_xlsx; o Flask o fecha ao terminar a resposta"""
+    return send_file(arquivo, mimetype=MIMETYPE_XLSX, as_attachment=True, download_name=nome_arquivo)
@@ -0,0 +1,206 @@
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from sqlalchemy import delete
+from src.models.database import db, Agenda
+from src.services.cache_agenda import registrar_alteracao_agenda
+
+COLUNAS = ['hora', 'data', 'link_plataforma', 'nome_canal']
+
+# Motivos de rejeição, na ordem em que as colunas são validadas
+HORA_INVALIDA = 'hora_invalida'
+DATA_INVALIDA = 'data_invalida'
+LINK_OU_CANAL_VAZIO = 'link_ou_canal_vazio'
+MOTIVOS_REJEICAO = (HORA_INVALIDA, DATA_INVALIDA, LINK_OU_CANAL_VAZIO)
+
+# Linhas lidas por vez de um CSV enviado
+LOTE_LEITURA_CSV = 5000
+
+class PlanilhaInvalida(ValueError):
+    """Arquivo enviado sem as colunas mínimas da agenda"""
+
+# Chave natural de um item da agenda, usada na importação diferencial
+CHAVE_AGENDA = ['data', 'hora', 'nome_canal']
+
+SQL_INSERIR = (
+    'INSERT INTO agenda (hora, data, link_plataforma, nome_canal, data_importacao) '
+    'VALUES (?, ?, ?, ?, ?)'
+)
+SQL_AGENDA_ATUAL = 'SELECT id, hora, data, link_plataforma, nome_canal FROM agenda ORDER BY id'
+SQL_ATUALIZAR_LINK = 'UPDATE agenda SET link_plataforma = ?, data_importacao = ? WHERE id = ?'
+SQL_REMOVER = 'DELETE FROM agenda WHERE id = ?'
+
+def _texto(coluna):
+    """Coluna como texto sem espaços nas pontas; vazios viram string vazia"""
+    return coluna.astype(str).str.strip().where(coluna.notna(), '')
+
+def _converter_horas(coluna):
+    # Aceita HH:MM ou só a hora com até dois dígitos (ex.: "9" -> 09:00)
+    texto = _texto(coluna)
+    com_dois_pontos = texto.str.contains(':', regex=False)
+    so_hora = ~com_dois_pontos & (texto.str.len() > 0) & (texto.str.len() <= 2)
+    texto = texto.where(~so_hora, texto + ':00')
+    return pd.to_datetime(texto.where(com_dois_pontos | so_hora), format='%H:%M', errors='coerce')
+
+def _converter_datas(coluna):
+    # DD-MM-AAAA tem precedência sobre DD/MM/AAAA
+    texto = _texto(coluna)
+    com_traco = texto.str.contains('-', regex=False)
+    com_barra = ~com_traco & texto.str.contains('/', regex=False)
+    datas_traco = pd.to_datetime(texto.where(com_traco), format='%d-%m-%Y', errors='coerce')
+    datas_barra = pd.to_datetime(texto.where(com_barra), format='%d/%m/%Y', errors='coerce')
+    return datas_traco.fillna(datas_barra)
+
+def processar_planilha(df):
+    """Valida e converte a planilha com operações por coluna
+
+    Retorna (validos, rejeitados): um DataFrame com as linhas válidas e a
+    contagem de linhas descartadas por motivo.
+    """
+    df = df.iloc[:, :len(COLUNAS)].copy()
+    df.columns = COLUNAS
+
+    horas = _converter_horas(df['hora'])
+    datas = _converter_datas(df['data'])
+    links = _texto(df['link_plataforma'])
+    canais = _texto(df['nome_canal'])
+
+    hora_valida = horas.notna()
+    data_valida = datas.notna()
+    texto_valido = (links != '') & (canais != '')
+
+    # Cada linha rejeitada conta só pelo primeiro motivo, como na validação linha a linha
+    motivos = np.select(
+        [~hora_valida, ~data_valida, ~texto_valido],
+        list(MOTIVOS_REJEICAO),
+        default=''
+    )
+    contagem = pd.Series(motivos[motivos != '']).value_counts()
+    rejeitados = {motivo: int(contagem.get(motivo, 0)) for motivo in MOTIVOS_REJEICAO}
+
+    validas = hora_valida & data_valida & texto_valido
+    validos = pd.DataFrame({
+        'hora': horas[validas],
+        'data': datas[validas],
+        'link_plataforma': links[validas],
+        'nome_canal': canais[validas]
+    })
+
+    return validos, rejeitados
+
+def _processador(coluna):
+    # Conversão que o dialeto aplica a cada parâmetro da coluna (ex.: time -> 'HH:MM:SS.ffffff')
+    dialeto = db.session.get_bind().dialect
+    return coluna.type.dialect_impl(dialeto).bind_processor(dialeto)
+
+def _ler_blocos(arquivo, extensao):
+    # O upload já está inteiro no arquivo que o Werkzeug montou ao receber a requisição;
+    # daqui ele só é lido: o CSV em blocos, o XLSX (que precisa de acesso aleatório) de uma vez
+    if extensao == 'xlsx':
+        yield pd.read_excel(arquivo)
+        return
+    # Tudo como texto, para que a inferência de tipos por bloco não mude a leitura de uma coluna
+    yield from pd.read_csv(arquivo, encoding='utf-8', dtype=str, chunksize=LOTE_LEITURA_CSV)
+
+def processar_arquivo(arquivo, extensao, progresso=None):
+    """Lê e valida o arquivo enviado, sem copiá-lo; retorna (validos, rejeitados)
+
+    Se informado, progresso(linhas_lidas, bytes_lidos) é chamado a cada bloco lido.
+    """
+    partes = []
+    rejeitados = dict.fromkeys(MOTIVOS_REJEICAO, 0)
+    linhas_lidas = 0
+    for bloco in _ler_blocos(arquivo, extensao):
+        if len(bloco.columns) < len(COLUNAS):
+            raise PlanilhaInvalida('Arquivo deve ter pelo menos 4 colunas (Hora, Data, Link, Canal)')
+        validos, rejeitados_bloco = processar_planilha(bloco)
+        partes.append(validos)
+        for motivo, quantidade in rejeitados_bloco.items():
+            rejeitados[motivo] += quantidade
+        linhas_lidas += len(bloco)
+        if progresso:
+            progresso(linhas_lidas, arquivo.tell())
+    if not partes:
+        partes.append(processar_planilha(pd.DataFrame(columns=COLUNAS))[0])
+    return pd.concat(partes, ignore_index=True), rejeitados
+
+def _valores_banco(serie, coluna, converter):
+    """Valores no formato gravado pelo SQLAlchemy, processando só os valores distintos da coluna"""
+    processar = _processador(coluna)
+    return serie.map({valor: processar(converter(valor)) for valor in serie.unique()})
+
+def _tabela_banco(validos, agora):
+    """As linhas válidas com cada coluna no formato gravado no banco"""
+    colunas = Agenda.__table__.c
+    return pd.DataFrame({
+        'hora': _valores_banco(validos['hora'], colunas.hora, lambda valor: valor.time()),
+        'data': _valores_banco(validos['data'], colunas.data, lambda valor: valor.date()),
+        'link_plataforma': validos['link_plataforma'],
+        'nome_canal': validos['nome_canal'],
+        'data_importacao': _processador(colunas.data_importacao)(agora)
+    })
+
+def linhas_banco(validos, agora):
+    """Tuplas (hora, data, link_plataforma, nome_canal, data_importacao) prontas para o driver"""
+    return list(_tabela_banco(validos, agora).itertuples(index=False, name=None))
+
+def substituir_agenda(validos):
+    """Troca a agenda inteira pelas linhas válidas com um único INSERT em lote; o commit fica com quem chama"""
+    linhas = linhas_banco(validos, datetime.utcnow())
+    db.session.execute(delete(Agenda))
+    if linhas:
+        # executemany direto no driver: sem processamento de parâmetros linha a linha
+        db.session.connection().exec_driver_sql(SQL_INSERIR, linhas)
+    registrar_alteracao_agenda()
+    return len(linhas)
+
+def sincronizar_agenda(validos):
+    """Aplica só a diferença entre o arquivo e a agenda atual, pela chave (data, hora, nome_canal)
+
+    Linhas novas são inseridas, as que mudaram de link são atualizadas e as que
+    sumiram do arquivo são removidas; as iguais não são tocadas e mantêm o id.
+    O commit fica com quem chama. Retorna a contagem de cada operação.
+    """
+    conexao = db.session.connection()
+    novos = _tabela_banco(validos, datetime.utcnow())
+    # Chave repetida no arquivo: vale a última ocorrência
+    duplicados = int(novos.duplicated(CHAVE_AGENDA, keep='last').sum())
+    novos = novos.drop_duplicates(CHAVE_AGENDA, keep='last')
+
+    atuais = pd.DataFrame(
+        conexao.exec_driver_sql(SQL_AGENDA_ATUAL).fetchall(),
+        columns=['id', 'hora', 'data', 'link_plataforma', 'nome_canal']
+    )
+    # Chave repetida no banco (importações no modo substituir): fica o menor id, o resto sai
+    repetidos = atuais.duplicated(CHAVE_AGENDA, keep='first')
+    ids_remover = atuais.loc[repetidos, 'id'].tolist()
+    atuais = atuais[~repetidos]
+
+    comparacao = novos.merge(atuais, on=CHAVE_AGENDA, how='outer', suffixes=('', '_atual'), indicator=True)
+    inserir = comparacao[comparacao['_merge'] == 'left_only']
+    existentes = comparacao[comparacao['_merge'] == 'both']
+    alterados = existentes[existentes['link_plataforma'] != existentes['link_plataforma_atual']]
+    ids_remover += comparacao.loc[comparacao['_merge'] == 'right_only', 'id'].astype(int).tolist()
+
+    if ids_remover:
+        conexao.exec_driver_sql(SQL_REMOVER, [(i,) for i in ids_remover])
+    if len(alterados):
+        conexao.exec_driver_sql(SQL_ATUALIZAR_LINK, list(zip(
+            alterados['link_plataforma'], alterados['data_importacao'], alterados['id'].astype(int).tolist()
+        )))
+    if len(inserir):
+        conexao.exec_driver_sql(SQL_INSERIR, list(
+            inserir[['hora', 'data', 'link_plataforma', 'nome_canal', 'data_importacao']].itertuples(index=False, name=None)
+        ))
+
+    # Sem alterações a versão fica, e os clientes continuam com a agenda que já têm
+    if ids_remover or len(alterados) or len(inserir):
+        registrar_alteracao_agenda()
+
+    return {
+        'inseridos': len(inserir),
+        'atualizados': len(alterados),
+        'removidos': len(ids_remover),
+        'inalterados': len(existentes) - len(alterados),
+        'duplicados_no_arquivo': duplicados
+    }
@@ -0,0 +1,58 @@
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import insert, update, or_
+from src.models.database import db, TravaLider
+
+# Identifica este processo entre os workers que compartilham o banco
+IDENTIDADE_PROCESSO = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+def adquirir_lideranca(nome, duracao, agora=None):
+    """Adquire ou renova o lease de liderança; retorna True se este processo é o líder"""
+    agora = agora or datetime.utcnow()
+    
+    db.session.execute(
+        insert(TravaLider).prefix_with('OR IGNORE').values(nome=nome, dono=None, expira_em=agora, ultimo_ciclo=0)
+    )
+    resultado = db.session.execute(
+        update(TravaLider)
+        .where(
+            TravaLider.nome == nome,
+            or_(TravaLider.dono == IDENTIDADE_PROCESSO, TravaLider.dono.is_(None), TravaLider.expira_em < agora)
+        )
+        .values(dono=IDENTIDADE_PROCESSO, expira_em=agora + timedelta(seconds=duracao))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return resultado.rowcount == 1
+
+def reservar_ciclo(nome, instante, intervalo):
+    """Marca o ciclo como executado na transação corrente; falha se outro líder já o executou
+
+    ultimo_ciclo guarda o instante (epoch, em segundos) da última execução. O ciclo
+    é reservado se ela foi há pelo menos meio intervalo; um instante no futuro
+    (relógio atrasado depois da gravação) não bloqueia os ciclos seguintes.
+    """
+    instante = int(instante)
+    resultado = db.session.execute(
+        update(TravaLider)
+        .where(
+            TravaLider.nome == nome,
+            TravaLider.dono == IDENTIDADE_PROCESSO,
+            or_(TravaLider.ultimo_ciclo <= instante - intervalo // 2, TravaLider.ultimo_ciclo > instante + intervalo)
+        )
+        .values(ultimo_ciclo=instante)
+        .execution_options(synchronize_session=False)
+    )
+    return resultado.rowcount == 1
+
+def liberar_lideranca(nome):
+    """Libera o lease para que outro worker assuma imediatamente"""
+    db.session.execute(
+        update(TravaLider)
+        .where(TravaLider.nome == nome, TravaLider.dono == IDENTIDADE_PROCESSO)
+        .values(dono=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+from sqlalchemy import update, select, func, or_
+from sqlalchemy.orm import aliased
+from src.models.database import db, Usuario, SessaoLurk
+from src.services.tarefas import TarefaPeriodica
+from src.services.lideranca import adquirir_lideranca
+from src.services.pontuacao import materializar_pontos
+from src.services.presenca import presenca, notificar_saidas
+
+# Sessões sem heartbeat por este tempo são consideradas abandonadas
+TIMEOUT_SESSAO = 600
+
+def encerrar_sessoes(condicao, agora=None, ate_ultimo_sinal=False):
+    """Encerra em lote as sessões ativas e desconecta os usuários online que atendem à condição
+
+    Com ate_ultimo_sinal, pontos e fim da sessão vão só até a ultima_atividade de
+    cada usuário (sessões abandonadas); sem ele, até agora. O commit fica com quem chama.
+    """
+    agora = agora or datetime.utcnow()
+    alvos = select(Usuario.id).where(Usuario.online == True, condicao)
+
+    referencia = None
+    fim_sessao = agora
+    if ate_ultimo_sinal:
+        # A sessão termina no último sinal de vida do usuário, não no momento da limpeza
+        dono = aliased(Usuario)
+        referencia = select(dono.ultima_atividade).where(dono.id == SessaoLurk.usuario_id).scalar_subquery()
+        fim_sessao = func.max(func.coalesce(referencia, SessaoLurk.inicio_sessao), SessaoLurk.inicio_sessao)
+
+    pontuacao = materializar_pontos(agora, filtro=SessaoLurk.usuario_id.in_(alvos), referencia=referencia)
+
+    resultado_sessoes = db.session.execute(
+        update(SessaoLurk)
+        .where(SessaoLurk.ativa == True, SessaoLurk.usuario_id.in_(alvos))
+        .values(ativa=False, fim_sessao=fim_sessao)
+        .execution_options(synchronize_session=False)
+    )
+    desconectados = db.session.execute(
+        update(Usuario)
+        .where(Usuario.online == True, condicao)
+        .values(online=False)
+        .returning(
+            Usuario.id, Usuario.nick_canal, Usuario.pontos, Usuario.online, Usuario.tipo_janela,
+            Usuario.data_criacao, Usuario.ultima_atividade
+        )
+        .execution_options(synchronize_session=False)
+    ).all()
+    # Os painéis de todos os workers recebem as saídas quando a transação for confirmada
+    notificar_saidas(desconectados)
+
+    return {
+        'sessoes_encerradas': resultado_sessoes.rowcount,
+        'usuarios_desconectados': len(desconectados),
+        'pontos_materializados': pontuacao['usuarios_afetados']
+    }
+
+def encerrar_sessoes_inativas(timeout=TIMEOUT_SESSAO, agora=None):
+    """Encerra em lote as sessões de usuários sem atividade há mais de timeout segundos"""
+    agora = agora or datetime.utcnow()
+    corte = agora - timedelta(seconds=timeout)
+
+    inativos = or_(Usuario.ultima_atividade < corte, Usuario.ultima_atividade.is_(None))
+    resultado = encerrar_sessoes(inativos, agora, ate_ultimo_sinal=True)
+    db.session.commit()
+    return resultado
+
+def desconectar_usuarios(nicks, agora=None):
+    """Encerra o lurk dos nicks informados, com pontos até agora; o commit fica com quem chama"""
+    return encerrar_sessoes(Usuario.nick_canal.in_(nicks), agora)
+
+class TarefaLimpezaSessoes(TarefaPeriodica):
+    """Encerra periodicamente as sessões de quem fechou a janela sem finalizar o lurk"""
+
+    TRAVA = 'limpeza-sessoes'
+
+    def __init__(self, app, intervalo, timeout):
+        super().__init__(app, 'limpeza-sessoes', intervalo)
+        self.timeout = timeout
+
+    def executar(self):
+        # Heartbeats deste worker ainda em memória precisam chegar ao banco antes do corte
+        presenca.gravar_batimentos()
+
+        if not adquirir_lideranca(self.TRAVA, self.intervalo * 3):
+            return {'lider': False}
+
+        resultado = encerrar_sessoes_inativas(self.timeout)
+        if resultado['usuarios_desconectados']:
+            presenca.recarregar_online()
+        return {'lider': True, **resultado}
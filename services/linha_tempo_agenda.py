@@ -0,0 +1,76 @@
+import threading
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from src.models.database import db, Agenda
+from src.services.cache_agenda import cache_agenda
+
+# Duração de um item quando o próximo não começa antes (um slot da grade de horários)
+DURACAO_PADRAO = timedelta(hours=1)
+
+class LinhaTempoAgenda:
+    """Agenda inteira ordenada por início, para achar o item ao vivo e o próximo por busca binária
+
+    O índice é reconstruído quando a versão da agenda (cache_agenda) muda, ou
+    seja, a cada importação ou limpeza.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versao = None
+        self._inicios = []  # datetime de início, em ordem crescente
+        self._itens = []  # (id, link_plataforma, nome_canal), na mesma ordem
+
+    def atualizar(self):
+        """Reconstrói o índice se a agenda mudou desde a última construção"""
+        versao = cache_agenda.versao()
+        with self._lock:
+            if versao == self._versao:
+                return
+        linhas = db.session.execute(
+            select(Agenda.id, Agenda.data, Agenda.hora, Agenda.link_plataforma, Agenda.nome_canal)
+            .order_by(Agenda.data, Agenda.hora, Agenda.id)
+        ).all()
+        inicios = [datetime.combine(linha.data, linha.hora) for linha in linhas]
+        itens = [(linha.id, linha.link_plataforma, linha.nome_canal) for linha in linhas]
+        with self._lock:
+            self._versao = versao
+            self._inicios = inicios
+            self._itens = itens
+
+    def _fim(self, indice):
+        fim = self._inicios[indice] + DURACAO_PADRAO
+        if indice + 1 < len(self._inicios):
+            fim = min(fim, self._inicios[indice + 1])
+        return fim
+
+    def _item(self, indice):
+        item_id, link_plataforma, nome_canal = self._itens[indice]
+        inicio = self._inicios[indice]
+        return {
+            'id': item_id,
+            'hora': inicio.strftime('%H:%M'),
+            'data': inicio.strftime('%Y-%m-%d'),
+            'link_plataforma': link_plataforma,
+            'nome_canal': nome_canal,
+            'inicio': inicio.isoformat(),
+            'fim': self._fim(indice).isoformat()
+        }
+
+    def agora(self, momento):
+        """(ao_vivo, proximo, proxima_mudanca) no momento dado; itens ausentes vêm como None"""
+        self.atualizar()
+        with self._lock:
+            indice = bisect_right(self._inicios, momento)
+            # Até a próxima mudança a resposta é a mesma (salvo nova importação)
+            mudancas = []
+            ao_vivo = proximo = None
+            if indice > 0 and momento < self._fim(indice - 1):
+                ao_vivo = self._item(indice - 1)
+                mudancas.append(self._fim(indice - 1))
+            if indice < len(self._inicios):
+                proximo = self._item(indice)
+                mudancas.append(self._inicios[indice])
+        return ao_vivo, proximo, min(mudancas) if mudancas else None
+
+linha_tempo_agenda = LinhaTempoAgenda()
@@ -0,0 +1,338 @@
+"""Métricas do processo no formato de texto do Prometheus, sem dependências externas
+
+Cada worker mantém as suas séries em memória. Com vários workers atrás da mesma
+porta, cada coleta de /metrics cai num worker qualquer: defina DIRETORIO_METRICAS
+(um diretório local compartilhado, limpo a cada reinício do servidor) para que cada
+worker grave ali as suas séries e /metrics devolva a soma de todos. Sem ele, só um
+worker deve atender /metrics.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from glob import glob
+from bisect import bisect_left
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+
+# Limites (em segundos) dos baldes de latência das requisições
+BALDES_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Limites (em segundos) dos baldes das tarefas em segundo plano e das importações
+BALDES_TAREFA = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+# Comandos SQL por requisição
+BALDES_CONSULTAS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+TIPO_CONTEUDO = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Intervalo, em segundos, entre as gravações das séries do worker em DIRETORIO_METRICAS
+INTERVALO_GRAVACAO = 5
+
+logger = logging.getLogger(__name__)
+
+def _formatar_rotulos(nomes, valores, extra=None):
+    pares = list(zip(nomes, valores)) + ([extra] if extra else [])
+    if not pares:
+        return ''
+    escapados = (
+        (nome, str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for nome, valor in pares
+    )
+    return '{' + ','.join(f'{nome}="{valor}"' for nome, valor in escapados) + '}'
+
+def _formatar_valor(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+class Contador:
+    tipo = 'counter'
+
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = rotulos
+        self._lock = threading.Lock()
+        self._valores = {}  # valores dos rótulos -> total
+
+    def incrementar(self, *rotulos, valor=1):
+        with self._lock:
+            self._valores[rotulos] = self._valores.get(rotulos, 0) + valor
+
+    def instantaneo(self):
+        with self._lock:
+            return dict(self._valores)
+
+    @staticmethod
+    def somar(total, outro):
+        return total + outro
+
+    def linhas(self, series=None):
+        series = self.instantaneo() if series is None else series
+        for rotulos, total in series.items():
+            yield f'{self.nome}{_formatar_rotulos(self.rotulos, rotulos)} {_formatar_valor(total)}'
+
+class Histograma:
+    tipo = 'histogram'
+
+    def __init__(self, nome, ajuda, rotulos=(), baldes=BALDES_LATENCIA):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = rotulos
+        self.baldes = tuple(baldes)
+        self._lock = threading.Lock()
+        self._series = {}  # valores dos rótulos -> [contagem por balde (+Inf no fim), soma]
+
+    def observar(self, valor, *rotulos):
+        indice = bisect_left(self.baldes, valor)
+        with self._lock:
+            serie = self._series.get(rotulos)
+            if serie is None:
+                serie = self._series[rotulos] = [[0] * (len(self.baldes) + 1), 0.0]
+            serie[0][indice] += 1
+            serie[1] += valor
+
+    def instantaneo(self):
+        with self._lock:
+            return {rotulos: [list(contagens), soma] for rotulos, (contagens, soma) in self._series.items()}
+
+    @staticmethod
+    def somar(serie, outra):
+        return [[a + b for a, b in zip(serie[0], outra[0])], serie[1] + outra[1]]
+
+    def linhas(self, series=None):
+        series = self.instantaneo() if series is None else series
+        for rotulos, (contagens, soma) in series.items():
+            # Baldes do Prometheus são cumulativos
+            acumulado = 0
+            for limite, contagem in zip(self.baldes + (float('inf'),), contagens):
+                acumulado += contagem
+                le = _formatar_rotulos(self.rotulos, rotulos, ('le', _formatar_valor(limite)))
+                yield f'{self.nome}_bucket{le} {acumulado}'
+            sufixo = _formatar_rotulos(self.rotulos, rotulos)
+            yield f'{self.nome}_sum{sufixo} {_formatar_valor(soma)}'
+            yield f'{self.nome}_count{sufixo} {acumulado}'
+
+class Medidor:
+    """Valor lido na hora da coleta; somando workers, uma série por worker (rótulo worker)"""
+
+    tipo = 'gauge'
+
+    def __init__(self, nome, ajuda, funcao):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.funcao = funcao
+
+    def instantaneo(self):
+        return {(): self.funcao()}
+
+    def linhas(self, series=None):
+        series = self.instantaneo() if series is None else series
+        for rotulos, valor in series.items():
+            yield f"{self.nome}{_formatar_rotulos(('worker',) if rotulos else (), rotulos)} {_formatar_valor(valor)}"
+
+def _processo_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class RegistroMetricas:
+    def __init__(self):
+        self._metricas = {}
+        self._arquivo_worker = None  # (pid, nome do arquivo) do processo atual
+        self._gravacao = None
+
+    def _registrar(self, metrica):
+        self._metricas[metrica.nome] = metrica
+        return metrica
+
+    def contador(self, nome, ajuda, rotulos=()):
+        return self._registrar(Contador(nome, ajuda, rotulos))
+
+    def histograma(self, nome, ajuda, rotulos=(), baldes=BALDES_LATENCIA):
+        return self._registrar(Histograma(nome, ajuda, rotulos, baldes))
+
+    def medidor(self, nome, ajuda, funcao):
+        return self._registrar(Medidor(nome, ajuda, funcao))
+
+    def exportar(self, mescladas=None):
+        """Todas as séries no formato de exposição de texto do Prometheus"""
+        saida = []
+        for metrica in list(self._metricas.values()):
+            saida.append(f'# HELP {metrica.nome} {metrica.ajuda}')
+            saida.append(f'# TYPE {metrica.nome} {metrica.tipo}')
+            saida.extend(metrica.linhas(None if mescladas is None else mescladas.get(metrica.nome, {})))
+        return '\n'.join(saida) + '\n'
+
+    def gravar(self, diretorio):
+        """Grava as séries deste worker em diretorio, num arquivo só dele"""
+        pid = os.getpid()
+        # Um arquivo por processo: um worker novo com o pid de um antigo não apaga os totais dele
+        if self._arquivo_worker is None or self._arquivo_worker[0] != pid:
+            self._arquivo_worker = (pid, os.path.join(diretorio, f'worker-{pid}-{time.time_ns()}.json'))
+        caminho = self._arquivo_worker[1]
+        dados = {
+            'pid': pid,
+            'metricas': {
+                metrica.nome: [[list(rotulos), valor] for rotulos, valor in metrica.instantaneo().items()]
+                for metrica in list(self._metricas.values())
+            }
+        }
+        with open(f'{caminho}.tmp', 'w', encoding='utf-8') as arquivo:
+            json.dump(dados, arquivo)
+        # Quem lê nunca vê um arquivo pela metade
+        os.replace(f'{caminho}.tmp', caminho)
+
+    def exportar_workers(self, diretorio):
+        """Soma das séries gravadas por todos os workers em diretorio
+
+        Contadores e histogramas de workers encerrados continuam na soma (senão os totais
+        voltariam atrás); medidores saem por worker, só dos que ainda estão vivos.
+        """
+        self.gravar(diretorio)
+        mescladas = {}
+        for caminho in glob(os.path.join(diretorio, 'worker-*.json')):
+            try:
+                with open(caminho, encoding='utf-8') as arquivo:
+                    dados = json.load(arquivo)
+            except (OSError, ValueError):
+                logger.warning('Arquivo de métricas ilegível: %s', caminho)
+                continue
+            vivo = None
+            for nome, series in dados['metricas'].items():
+                metrica = self._metricas.get(nome)
+                if metrica is None:
+                    continue
+                destino = mescladas.setdefault(nome, {})
+                if metrica.tipo == 'gauge':
+                    vivo = _processo_vivo(dados['pid']) if vivo is None else vivo
+                    if vivo:
+                        for _rotulos, valor in series:
+                            destino[(dados['pid'],)] = valor
+                    continue
+                for rotulos, valor in series:
+                    chave = tuple(rotulos)
+                    destino[chave] = metrica.somar(destino[chave], valor) if chave in destino else valor
+        return self.exportar(mescladas)
+
+    def iniciar_gravacao(self, app, diretorio):
+        """Grava as séries deste worker a cada INTERVALO_GRAVACAO segundos, numa thread daemon"""
+        if self._gravacao is not None and self._gravacao.is_alive():
+            return
+        os.makedirs(diretorio, exist_ok=True)
+
+        def gravar_periodicamente():
+            # Contexto do app: os medidores podem consultar o banco
+            with app.app_context():
+                while True:
+                    try:
+                        self.gravar(diretorio)
+                    except Exception:
+                        logger.exception('Erro ao gravar as métricas do worker')
+                    time.sleep(INTERVALO_GRAVACAO)
+
+        self._gravacao = threading.Thread(target=gravar_periodicamente, name='metricas-gravacao', daemon=True)
+        self._gravacao.start()
+
+metricas = RegistroMetricas()
+
+requisicoes = metricas.contador(
+    'weblurk_requisicoes_total', 'Requisições HTTP atendidas', ('endpoint', 'metodo', 'status'))
+duracao_requisicao = metricas.histograma(
+    'weblurk_requisicao_duracao_segundos', 'Duração das requisições HTTP até a resposta', ('endpoint', 'metodo'))
+consultas_sql = metricas.contador(
+    'weblurk_sql_comandos_total', 'Comandos SQL executados, por endpoint ou thread de origem', ('origem',))
+duracao_sql = metricas.contador(
+    'weblurk_sql_duracao_segundos_total', 'Tempo gasto em comandos SQL, por endpoint ou thread de origem', ('origem',))
+erros_sql = metricas.contador(
+    'weblurk_sql_erros_total', 'Comandos SQL que falharam (travado = database is locked)', ('origem', 'tipo'))
+consultas_por_requisicao = metricas.histograma(
+    'weblurk_sql_comandos_por_requisicao', 'Comandos SQL emitidos em cada requisição', ('endpoint',), BALDES_CONSULTAS)
+execucoes_tarefa = metricas.contador(
+    'weblurk_tarefa_execucoes_total', 'Ciclos das tarefas periódicas', ('tarefa', 'resultado'))
+duracao_tarefa = metricas.histograma(
+    'weblurk_tarefa_duracao_segundos', 'Duração dos ciclos das tarefas periódicas', ('tarefa',), BALDES_TAREFA)
+ciclos_pontuacao = metricas.contador(
+    'weblurk_pontuacao_ciclos_total', 'Ticks do agendador de pontuação neste worker', ('resultado',))
+usuarios_pontuados = metricas.contador(
+    'weblurk_pontuacao_usuarios_pontuados_total', 'Usuários que receberam pontos nos ticks do agendador')
+importacoes = metricas.contador(
+    'weblurk_importacoes_total', 'Importações da agenda terminadas', ('modo', 'status'))
+duracao_importacao = metricas.histograma(
+    'weblurk_importacao_duracao_segundos', 'Duração das importações da agenda', ('modo',), BALDES_TAREFA)
+linhas_importacao = metricas.contador(
+    'weblurk_importacao_linhas_total', 'Linhas lidas nas importações da agenda', ('resultado',))
+
+def origem_atual():
+    """Endpoint da requisição corrente ou, fora de requisições, o nome da thread (tarefa)"""
+    if has_request_context():
+        return request.endpoint or 'desconhecido'
+    return threading.current_thread().name
+
+def _antes_sql(conexao, cursor, comando, parametros, contexto, executemany):
+    conexao.info['inicio_sql'] = time.perf_counter()
+
+def _depois_sql(conexao, cursor, comando, parametros, contexto, executemany):
+    duracao = time.perf_counter() - conexao.info.pop('inicio_sql', time.perf_counter())
+    origem = origem_atual()
+    consultas_sql.incrementar(origem)
+    duracao_sql.incrementar(origem, valor=duracao)
+    if has_request_context():
+        g.comandos_sql = g.get('comandos_sql', 0) + 1
+
+def _erro_sql(contexto):
+    conexao = contexto.connection
+    if conexao is not None:
+        conexao.info.pop('inicio_sql', None)
+    tipo = 'travado' if 'database is locked' in str(contexto.original_exception) else 'outro'
+    erros_sql.incrementar(origem_atual(), tipo)
+
+def _registrar_requisicao(status):
+    if g.get('metricas_registradas') or 'inicio_requisicao' not in g:
+        return
+    g.metricas_registradas = True
+    endpoint = request.endpoint or 'desconhecido'
+    requisicoes.incrementar(endpoint, request.method, str(status))
+    duracao_requisicao.observar(time.perf_counter() - g.inicio_requisicao, endpoint, request.method)
+    consultas_por_requisicao.observar(g.get('comandos_sql', 0), endpoint)
+
+def _exportar_metricas():
+    token = current_app.config.get('TOKEN_METRICAS')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return Response('Acesso negado\n', status=401, mimetype='text/plain')
+    diretorio = current_app.config.get('DIRETORIO_METRICAS')
+    if diretorio:
+        return Response(metricas.exportar_workers(diretorio), content_type=TIPO_CONTEUDO)
+    return Response(metricas.exportar(), content_type=TIPO_CONTEUDO)
+
+def registrar_metricas(app, engine):
+    """Instrumenta requisições e comandos SQL do app e expõe /metrics"""
+
+    @app.before_request
+    def _iniciar_requisicao():
+        g.inicio_requisicao = time.perf_counter()
+        g.comandos_sql = 0
+
+    @app.after_request
+    def _finalizar_requisicao(response):
+        _registrar_requisicao(response.status_code)
+        return response
+
+    @app.teardown_request
+    def _falha_requisicao(erro):
+        # Exceção não tratada: o after_request não roda
+        if erro is not None:
+            _registrar_requisicao(500)
+
+    event.listen(engine, 'before_cursor_execute', _antes_sql)
+    event.listen(engine, 'after_cursor_execute', _depois_sql)
+    event.listen(engine, 'handle_error', _erro_sql)
+
+    app.add_url_rule('/metrics', 'metricas', _exportar_metricas)
+
+    if app.config.get('DIRETORIO_METRICAS'):
+        metricas.iniciar_gravacao(app, app.config['DIRETORIO_METRICAS'])
@@ -0,0 +1,91 @@
+from datetime import datetime
+from sqlalchemy import select, update, delete, or_
+from src.models.database import db, Usuario, SessaoLurk, ResumoDiarioLurk
+from src.services.eventos import eventos, EVENTO_PONTOS, EVENTO_RANKING
+from src.services.pontuacao import materializar_pontos
+from src.services.presenca import presenca
+from src.services.ranking import ranking, registrar_alteracao_ranking
+from src.services.transacao import apos_commit
+
+# Valores por cláusula IN, bem abaixo do limite de parâmetros do SQLite
+LOTE_IN = 500
+
+def _lotes(valores):
+    for inicio in range(0, len(valores), LOTE_IN):
+        yield valores[inicio:inicio + LOTE_IN]
+
+def ids_por_nick(nicks):
+    """{nick_canal: id} dos nicks existentes, com uma consulta por colunas a cada LOTE_IN nicks"""
+    ids = {}
+    for lote in _lotes(list(dict.fromkeys(nicks))):
+        ids.update(db.session.execute(
+            select(Usuario.nick_canal, Usuario.id).where(Usuario.nick_canal.in_(lote))
+        ).all())
+    return ids
+
+def zerar_pontos():
+    """Zera os pontos de todos os usuários com um único UPDATE; o commit fica com quem chama"""
+    # Pontos já devidos às sessões ativas são consumidos pelo reset, senão voltariam na próxima gravação
+    agora = datetime.utcnow()
+    materializar_pontos(agora)
+    resultado = db.session.execute(
+        update(Usuario)
+        .where(or_(Usuario.pontos != 0, Usuario.pontos.is_(None)))
+        .values(pontos=0)
+        .execution_options(synchronize_session=False)
+    )
+    apos_commit(ranking.invalidar)
+    registrar_alteracao_ranking()
+    apos_commit(presenca.zerar_pontos, agora)
+    eventos.publicar_na_transacao(EVENTO_RANKING, {'acao': 'limpar'})
+    return resultado.rowcount
+
+def editar_pontos(pontos_por_nick):
+    """Define os pontos de vários usuários com um UPDATE em lote por chave primária
+
+    Retorna (usuarios_atualizados, nicks_nao_encontrados). O commit fica com quem chama.
+    """
+    ids = ids_por_nick(pontos_por_nick)
+    alterados = [(ids[nick], nick, pontos) for nick, pontos in pontos_por_nick.items() if nick in ids]
+    if alterados:
+        # Os pontos pendentes de antes da edição são gravados e substituídos, não somados depois
+        agora = datetime.utcnow()
+        for lote in _lotes([i for i, _, _ in alterados]):
+            materializar_pontos(agora, filtro=SessaoLurk.usuario_id.in_(lote))
+        db.session.execute(update(Usuario), [{'id': i, 'pontos': pontos} for i, _, pontos in alterados])
+        apos_commit(ranking.atualizar, alterados)
+        registrar_alteracao_ranking()
+        apos_commit(presenca.atualizar_pontos, alterados, agora)
+        eventos.publicar_na_transacao(
+            EVENTO_PONTOS,
+            {'usuarios': [{'id': i, 'nick_canal': nick, 'pontos': pontos} for i, nick, pontos in alterados]}
+        )
+    return len(alterados), [nick for nick in pontos_por_nick if nick not in ids]
+
+def excluir_usuarios(nicks):
+    """Exclui usuários, as suas sessões e o seu resumo diário com DELETEs em lote; o commit fica com quem chama"""
+    ids = ids_por_nick(nicks)
+    usuario_ids = list(ids.values())
+    sessoes_excluidas = usuarios_excluidos = 0
+    for lote in _lotes(usuario_ids):
+        db.session.execute(
+            delete(ResumoDiarioLurk).where(ResumoDiarioLurk.usuario_id.in_(lote)).execution_options(synchronize_session=False)
+        )
+        sessoes_excluidas += db.session.execute(
+            delete(SessaoLurk).where(SessaoLurk.usuario_id.in_(lote)).execution_options(synchronize_session=False)
+        ).rowcount
+        usuarios_excluidos += db.session.execute(
+            delete(Usuario).where(Usuario.id.in_(lote)).execution_options(synchronize_session=False)
+        ).rowcount
+
+    if usuario_ids:
+        apos_commit(ranking.remover, usuario_ids)
+        registrar_alteracao_ranking()
+        for usuario_id in usuario_ids:
+            apos_commit(presenca.esquecer, usuario_id)
+        eventos.publicar_na_transacao(EVENTO_RANKING, {'acao': 'excluir', 'ids': usuario_ids})
+    return {
+        'usuarios_excluidos': usuarios_excluidos,
+        'sessoes_excluidas': sessoes_excluidas,
+        'nao_encontrados': [nick for nick in dict.fromkeys(nicks) if nick not in ids]
+    }
@@ -0,0 +1,141 @@
+"""Perfil opcional dos comandos SQL de cada requisição, com detecção de repetições e N+1
+
+Ative com PERFIL_SQL=1. Cada resposta ganha os cabeçalhos Server-Timing e
+X-Comandos-SQL, requisições suspeitas vão para o log e os últimos
+relatórios ficam disponíveis em /api/admin/perfil-sql.
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter, deque
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Execuções da mesma forma de comando numa requisição a partir das quais ela é marcada como N+1
+LIMITE_N_MAIS_1 = 5
+
+# Relatórios das últimas requisições mantidos em memória
+TAMANHO_HISTORICO_PERFIL = 200
+
+_LITERAIS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LISTA_PARAMETROS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_ESPACOS = re.compile(r'\s+')
+
+def forma_comando(comando):
+    """Comando sem literais e com listas IN colapsadas: mesma forma = mesma consulta com outros valores"""
+    comando = _ESPACOS.sub(' ', comando.strip())
+    comando = _LITERAIS.sub('?', comando)
+    return _LISTA_PARAMETROS.sub('(?)', comando)
+
+class PerfilSQL:
+    """Registra os comandos SQL de cada requisição e guarda os relatórios mais recentes"""
+
+    def __init__(self, limite_n_mais_1=LIMITE_N_MAIS_1, tamanho_historico=TAMANHO_HISTORICO_PERFIL):
+        self.limite_n_mais_1 = limite_n_mais_1
+        self._lock = threading.Lock()
+        self._relatorios = deque(maxlen=tamanho_historico)
+
+    def _antes_sql(self, conexao, cursor, comando, parametros, contexto, executemany):
+        conexao.info['inicio_perfil_sql'] = time.perf_counter()
+
+    def _depois_sql(self, conexao, cursor, comando, parametros, contexto, executemany):
+        inicio = conexao.info.pop('inicio_perfil_sql', None)
+        if inicio is None or not has_request_context() or 'perfil_sql' not in g:
+            return
+        # Em lote os parâmetros podem ser enormes: basta o tamanho do lote para comparar
+        chave = f'lote de {len(parametros)}' if executemany else repr(parametros)
+        g.perfil_sql.append((comando, chave, time.perf_counter() - inicio))
+
+    def relatorio(self, status):
+        """Relatório da requisição corrente"""
+        comandos = g.perfil_sql
+        identicos = Counter((comando, chave) for comando, chave, _ in comandos)
+        formas = Counter(forma_comando(comando) for comando, _, _ in comandos)
+        duracao_sql = sum(duracao for _, _, duracao in comandos)
+        return {
+            'endpoint': request.endpoint,
+            'metodo': request.method,
+            'caminho': request.path,
+            'status': status,
+            'comandos': len(comandos),
+            'duracao_ms': round((time.perf_counter() - g.inicio_perfil_sql) * 1000, 3),
+            'duracao_sql_ms': round(duracao_sql * 1000, 3),
+            # Mesmo comando com os mesmos parâmetros: resultado já conhecido, consulta redundante
+            'repetidos': [
+                {'comando': comando, 'vezes': vezes}
+                for (comando, _), vezes in identicos.items() if vezes > 1
+            ],
+            # Mesma forma com valores diferentes muitas vezes: provável consulta dentro de um laço
+            'suspeitas_n_mais_1': [
+                {'forma': forma, 'vezes': vezes}
+                for forma, vezes in formas.items() if vezes >= self.limite_n_mais_1
+            ],
+            'detalhes': [
+                {'comando': comando, 'duracao_ms': round(duracao * 1000, 3)}
+                for comando, _, duracao in comandos
+            ]
+        }
+
+    def registrar(self, relatorio):
+        with self._lock:
+            self._relatorios.append(relatorio)
+        if relatorio['repetidos'] or relatorio['suspeitas_n_mais_1']:
+            logger.warning(
+                'SQL repetido em %s %s: %d comandos, repetidos=%s, n+1=%s',
+                relatorio['metodo'], relatorio['caminho'], relatorio['comandos'],
+                [r['vezes'] for r in relatorio['repetidos']],
+                [s['forma'] for s in relatorio['suspeitas_n_mais_1']]
+            )
+
+    def relatorios(self, apenas_suspeitos=False):
+        with self._lock:
+            relatorios = list(self._relatorios)
+        if apenas_suspeitos:
+            relatorios = [r for r in relatorios if r['repetidos'] or r['suspeitas_n_mais_1']]
+        return relatorios
+
+    def resumo(self):
+        """Média de comandos e de tempo SQL por endpoint nos relatórios guardados"""
+        por_endpoint = {}
+        for relatorio in self.relatorios():
+            item = por_endpoint.setdefault(relatorio['endpoint'], {'requisicoes': 0, 'comandos': 0, 'duracao_sql_ms': 0.0})
+            item['requisicoes'] += 1
+            item['comandos'] += relatorio['comandos']
+            item['duracao_sql_ms'] += relatorio['duracao_sql_ms']
+        return {
+            endpoint: {
+                'requisicoes': item['requisicoes'],
+                'media_comandos': round(item['comandos'] / item['requisicoes'], 2),
+                'media_duracao_sql_ms': round(item['duracao_sql_ms'] / item['requisicoes'], 3)
+            }
+            for endpoint, item in por_endpoint.items()
+        }
+
+def registrar_perfil_sql(app, engine, limite_n_mais_1=LIMITE_N_MAIS_1):
+    """Liga o perfil de SQL por requisição no app; retorna o PerfilSQL criado"""
+    perfil = PerfilSQL(limite_n_mais_1)
+
+    @app.before_request
+    def _iniciar_perfil():
+        g.inicio_perfil_sql = time.perf_counter()
+        g.perfil_sql = []
+
+    @app.after_request
+    def _finalizar_perfil(response):
+        if 'perfil_sql' not in g:
+            return response
+        relatorio = perfil.relatorio(response.status_code)
+        perfil.registrar(relatorio)
+        response.headers['X-Comandos-SQL'] = str(relatorio['comandos'])
+        response.headers['Server-Timing'] = (
+            f'sql;dur={relatorio["duracao_sql_ms"]};desc="{relatorio["comandos"]} comandos", '
+            f'app;dur={relatorio["duracao_ms"]}'
+        )
+        return response
+
+    event.listen(engine, 'before_cursor_execute', perfil._antes_sql)
+    event.listen(engine, 'after_cursor_execute', perfil._depois_sql)
+    return perfil
@@ -0,0 +1,132 @@
+import time
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import update, select, func, cast, Integer
+from src.models.database import db, Usuario, SessaoLurk
+from src.services.tarefas import TarefaPeriodica
+from src.services.transacao import apos_commit
+from src.services.eventos import eventos, EVENTO_PONTOS
+from src.services.ranking import ranking, registrar_alteracao_ranking
+from src.services.metricas import ciclos_pontuacao, usuarios_pontuados
+from src.services.lideranca import adquirir_lideranca, reservar_ciclo, liberar_lideranca, IDENTIDADE_PROCESSO
+
+# Um ponto a cada 6 minutos de lurk
+INTERVALO_PONTUACAO = 360
+
+# 'agendador': uma thread concede os pontos periodicamente
+# 'sob_demanda': os pontos são derivados dos horários da sessão e gravados na leitura ou no encerramento
+MODO_AGENDADOR = 'agendador'
+MODO_SOB_DEMANDA = 'sob_demanda'
+
+def pontos_devidos_sql(referencia, intervalo=INTERVALO_PONTUACAO):
+    """Expressão SQL com os pontos devidos a uma sessão até o instante de referência"""
+    segundos = (func.julianday(referencia) - func.julianday(SessaoLurk.inicio_sessao)) * 86400
+    return cast(segundos / intervalo, Integer)
+
+def pontos_devidos(inicio, referencia, intervalo=INTERVALO_PONTUACAO):
+    """Mesma conta de pontos_devidos_sql, em Python, para respostas servidas da memória"""
+    if not inicio:
+        return 0
+    return max(0, int((referencia - inicio).total_seconds() // intervalo))
+
+def modo_sob_demanda():
+    return current_app.config.get('MODO_PONTUACAO', MODO_AGENDADOR) == MODO_SOB_DEMANDA
+
+def materializar_pontos(agora=None, usuario_id=None, intervalo=None, filtro=None, referencia=None):
+    """Grava os pontos pendentes das sessões ativas (de todos ou de um usuário); o commit fica com quem chama
+
+    filtro restringe as sessões consideradas e referencia substitui o instante
+    final da contagem (por padrão, agora).
+    """
+    agora = agora or datetime.utcnow()
+    intervalo = intervalo or current_app.config.get('INTERVALO_PONTUACAO', INTERVALO_PONTUACAO)
+    devidos = pontos_devidos_sql(agora if referencia is None else referencia, intervalo)
+
+    pendente = (SessaoLurk.ativa == True) & (devidos > SessaoLurk.pontos_gerados)
+    if usuario_id is not None:
+        pendente = pendente & (SessaoLurk.usuario_id == usuario_id)
+    if filtro is not None:
+        pendente = pendente & filtro
+    usuarios_online = select(Usuario.id).where(Usuario.online == True)
+
+    # Somar ao usuário os pontos ainda não concedidos das suas sessões
+    pontos_pendentes = select(func.sum(devidos - SessaoLurk.pontos_gerados)).where(
+        SessaoLurk.usuario_id == Usuario.id,
+        pendente
+    ).scalar_subquery()
+
+    usuarios_alterados = db.session.execute(
+        update(Usuario)
+        .where(Usuario.online == True, Usuario.id.in_(select(SessaoLurk.usuario_id).where(pendente)))
+        .values(pontos=Usuario.pontos + pontos_pendentes)
+        .returning(Usuario.id, Usuario.nick_canal, Usuario.pontos)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+    # Marcar os pontos como gerados nas sessões
+    resultado_sessoes = db.session.execute(
+        update(SessaoLurk)
+        .where(pendente, SessaoLurk.usuario_id.in_(usuarios_online))
+        .values(pontos_gerados=devidos)
+        .execution_options(synchronize_session=False)
+    )
+
+    if usuarios_alterados:
+        apos_commit(ranking.atualizar, [tuple(linha) for linha in usuarios_alterados])
+        registrar_alteracao_ranking()
+        eventos.publicar_na_transacao(
+            EVENTO_PONTOS,
+            {'usuarios': [{'id': l.id, 'nick_canal': l.nick_canal, 'pontos': l.pontos} for l in usuarios_alterados]}
+        )
+
+    return {
+        'usuarios_afetados': len(usuarios_alterados),
+        'sessoes_afetadas': resultado_sessoes.rowcount
+    }
+
+def sincronizar_pontos(usuario_id=None):
+    """No modo sob demanda, materializa os pontos antes de uma leitura"""
+    if not modo_sob_demanda():
+        return None
+    resultado = materializar_pontos(usuario_id=usuario_id)
+    db.session.commit()
+    return resultado
+
+class AgendadorPontuacao(TarefaPeriodica):
+    """Agendador único que concede pontos a todos os usuários em lurk
+
+    Com vários workers, só o detentor do lease de liderança pontua, e cada
+    ciclo é reservado na mesma transação dos pontos para nunca ser concedido duas vezes.
+    """
+
+    TRAVA = 'pontuacao'
+
+    def __init__(self, app, intervalo):
+        super().__init__(app, 'agendador-pontuacao', intervalo)
+
+    def executar(self):
+        # O lease expira após alguns ciclos sem renovação, e outro worker assume
+        if not adquirir_lideranca(self.TRAVA, self.intervalo * 3):
+            ciclos_pontuacao.incrementar('nao_lider')
+            return {'lider': False}
+        
+        # O instante da execução, e não o número do ciclo: mudar o intervalo não invalida o que está gravado
+        ciclo = int(time.time())
+        if not reservar_ciclo(self.TRAVA, ciclo, self.intervalo):
+            db.session.rollback()
+            ciclos_pontuacao.incrementar('ja_executado')
+            return {'lider': True, 'ciclo': ciclo, 'ciclo_ja_executado': True}
+        
+        resultado = materializar_pontos()
+        db.session.commit()
+        ciclos_pontuacao.incrementar('executado')
+        usuarios_pontuados.incrementar(valor=resultado['usuarios_afetados'])
+        return {'lider': True, 'ciclo': ciclo, **resultado}
+
+    def parar(self, timeout=None):
+        super().parar(timeout)
+        with self.app.app_context():
+            liberar_lideranca(self.TRAVA)
+
+    def to_dict(self):
+        return {'processo': IDENTIDADE_PROCESSO, **super().to_dict()}
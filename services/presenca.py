@@ -0,0 +1,300 @@
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import select, update, and_
+from src.models.database import db, Usuario, SessaoLurk
+from src.services.tarefas import TarefaPeriodica
+from src.services.eventos import eventos, EVENTO_PRESENCA, EVENTO_SINCRONIZAR
+from src.services.pontuacao import pontos_devidos, modo_sob_demanda, INTERVALO_PONTUACAO
+from src.services.ranking import versao_ranking, INTERVALO_VERIFICACAO
+
+# Saídas em lote acima disso viram um único evento de sincronização
+MAXIMO_EVENTOS_SAIDA = 100
+
+CAMPOS_USUARIO = ('id', 'nick_canal', 'pontos', 'online', 'tipo_janela', 'data_criacao', 'ultima_atividade')
+
+def _usuario_dict(linha):
+    return {
+        'id': linha.id,
+        'nick_canal': linha.nick_canal,
+        'pontos': linha.pontos,
+        'online': linha.online,
+        'tipo_janela': linha.tipo_janela,
+        'data_criacao': linha.data_criacao.isoformat() if linha.data_criacao else None,
+        'ultima_atividade': linha.ultima_atividade.isoformat() if linha.ultima_atividade else None
+    }
+
+def _sessao_dict(linha):
+    if linha.sessao_id is None:
+        return None
+    return {
+        'id': linha.sessao_id,
+        'usuario_id': linha.id,
+        'tipo_janela': linha.sessao_tipo_janela,
+        'ativa': True,
+        'inicio_sessao': linha.inicio_sessao.isoformat() if linha.inicio_sessao else None,
+        'fim_sessao': None,
+        'pontos_gerados': linha.pontos_gerados
+    }
+
+def notificar_presenca(usuario, lurk_ativo):
+    """Publica na transação corrente a entrada ou saída do lurk de um usuário"""
+    eventos.publicar_na_transacao(EVENTO_PRESENCA, {'usuario': usuario.to_dict(), 'lurk_ativo': lurk_ativo})
+
+def notificar_saidas(linhas):
+    """Publica na transação corrente a saída do lurk de usuários desconectados em lote (linhas com CAMPOS_USUARIO)"""
+    if len(linhas) > MAXIMO_EVENTOS_SAIDA:
+        eventos.publicar_na_transacao(EVENTO_SINCRONIZAR, {})
+        return
+    for linha in linhas:
+        eventos.publicar_na_transacao(EVENTO_PRESENCA, {'usuario': _usuario_dict(linha), 'lurk_ativo': False})
+
+class RegistroPresenca:
+    """Presença dos usuários em memória, com gravação periódica em lote de ultima_atividade
+
+    Cada worker mantém o seu registro; a recarga periódica do conjunto online
+    propaga as mudanças feitas pelos demais workers. Toda alteração de pontos troca
+    a versão do ranking em versoes_cache, e a troca também dispara a recarga. Os
+    eventos de presença são publicados na transação de quem fez a mudança, não aqui.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._usuarios = {}  # usuario_id -> {'usuario', 'sessao', 'inicio_sessao', 'registrada_em'}
+        self._batimentos = {}  # usuario_id -> horário do último heartbeat ainda não gravado
+        self._ids_online = []  # ids dos usuários online em ordem crescente (paginação por chave)
+        self._online_carregado = False
+        self._versao = None  # versão do ranking vista na última recarga
+        self._verificada_em = 0.0
+
+    def registrar(self, usuario, sessao=None):
+        """Atualiza a presença a partir dos objetos do banco após uma escrita"""
+        entrada = {
+            'usuario': usuario.to_dict(),
+            'sessao': sessao.to_dict() if sessao is not None and sessao.ativa else None,
+            'inicio_sessao': sessao.inicio_sessao if sessao is not None and sessao.ativa else None,
+            'registrada_em': time.monotonic()
+        }
+        with self._lock:
+            self._usuarios[usuario.id] = entrada
+            self._marcar_online(usuario.id, entrada['usuario']['online'])
+
+    def batimento(self, usuario_id, agora=None):
+        """Registra um heartbeat; retorna False se o usuário não está em lurk"""
+        agora = agora or datetime.utcnow()
+        with self._lock:
+            entrada = self._usuarios.get(usuario_id)
+            if entrada is not None and not entrada['usuario']['online']:
+                return False
+            self._batimentos[usuario_id] = agora
+            if entrada is not None:
+                entrada['usuario']['ultima_atividade'] = agora.isoformat()
+        return True
+
+    def status(self, usuario_id):
+        """Status de lurk servido da memória; None se o usuário ainda não foi carregado"""
+        self.verificar_versao()
+        with self._lock:
+            entrada = self._usuarios.get(usuario_id)
+            if entrada is None:
+                return None
+            usuario = dict(entrada['usuario'])
+            sessao = dict(entrada['sessao']) if entrada['sessao'] else None
+            inicio = entrada['inicio_sessao']
+
+        self._aplicar_pontos_pendentes(usuario, sessao, inicio)
+        return {
+            'lurk_ativo': usuario['online'] and sessao is not None,
+            'usuario': usuario,
+            'sessao': sessao
+        }
+
+    def _marcar_online(self, usuario_id, online):
+        # Chamado com o lock adquirido
+        indice = bisect_left(self._ids_online, usuario_id)
+        presente = indice < len(self._ids_online) and self._ids_online[indice] == usuario_id
+        if online and not presente:
+            insort(self._ids_online, usuario_id)
+        elif not online and presente:
+            del self._ids_online[indice]
+
+    def usuarios_online(self):
+        """Lista completa dos usuários online servida da memória"""
+        return self.pagina_online()[0]
+
+    def total_online(self):
+        if not self._online_carregado:
+            self.recarregar_online()
+        with self._lock:
+            return len(self._ids_online)
+
+    def pagina_online(self, apos_id=0, limite=None, campos=None):
+        """Usuários online com id maior que apos_id, em ordem de id
+
+        Retorna (usuarios, total, proximo_apos_id); proximo_apos_id é None na última
+        página. campos restringe as chaves de cada usuário (o id sempre vem).
+        """
+        self.verificar_versao()
+        with self._lock:
+            inicio = bisect_right(self._ids_online, apos_id)
+            ids = self._ids_online[inicio:] if limite is None else self._ids_online[inicio:inicio + limite]
+            total = len(self._ids_online)
+            proximo = ids[-1] if ids and inicio + len(ids) < total else None
+            entradas = []
+            for usuario_id in ids:
+                e = self._usuarios[usuario_id]
+                entradas.append((dict(e['usuario']), dict(e['sessao']) if e['sessao'] else None, e['inicio_sessao']))
+
+        usuarios = []
+        for usuario, sessao, inicio in entradas:
+            if campos is None or 'pontos' in campos:
+                self._aplicar_pontos_pendentes(usuario, sessao, inicio)
+            if campos is not None:
+                usuario = {campo: usuario[campo] for campo in ('id', *campos) if campo in usuario}
+            usuarios.append(usuario)
+        return usuarios, total, proximo
+
+    def _aplicar_pontos_pendentes(self, usuario, sessao, inicio):
+        # No modo sob demanda os pontos ainda não gravados são calculados na hora
+        if sessao is None or not modo_sob_demanda():
+            return
+        intervalo = current_app.config.get('INTERVALO_PONTUACAO', INTERVALO_PONTUACAO)
+        pendentes = pontos_devidos(inicio, datetime.utcnow(), intervalo) - (sessao['pontos_gerados'] or 0)
+        if pendentes > 0:
+            usuario['pontos'] = (usuario['pontos'] or 0) + pendentes
+            sessao['pontos_gerados'] = (sessao['pontos_gerados'] or 0) + pendentes
+
+    def gravar_batimentos(self):
+        """Grava em lote a ultima_atividade dos heartbeats recebidos desde a última gravação"""
+        with self._lock:
+            pendentes, self._batimentos = self._batimentos, {}
+        if not pendentes:
+            return 0
+
+        try:
+            db.session.execute(
+                update(Usuario),
+                [{'id': usuario_id, 'ultima_atividade': horario} for usuario_id, horario in pendentes.items()]
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # Devolver para a próxima gravação, sem sobrescrever heartbeats chegados no meio
+            with self._lock:
+                for usuario_id, horario in pendentes.items():
+                    self._batimentos.setdefault(usuario_id, horario)
+            raise
+        return len(pendentes)
+
+    def verificar_versao(self):
+        """Carrega o conjunto online, ou o recarrega se a versão do ranking mudou desde a última recarga"""
+        if not self._online_carregado:
+            self.recarregar_online()
+            return
+        agora = time.monotonic()
+        with self._lock:
+            if agora - self._verificada_em < INTERVALO_VERIFICACAO:
+                return
+            self._verificada_em = agora
+            versao_anterior = self._versao
+
+        versao = versao_ranking()
+        db.session.commit()
+        if versao != versao_anterior:
+            self.recarregar_online()
+
+    def recarregar_online(self):
+        """Recarrega o conjunto online com uma consulta por colunas (sem hidratar objetos ORM)
+
+        Entradas de usuários fora do conjunto online são descartadas: a próxima
+        consulta de status delas lê o banco, com os pontos atuais.
+        """
+        inicio = time.monotonic()
+        # Versão lida antes dos usuários: uma escrita no meio deixa a versão velha e força outra recarga
+        versao = versao_ranking()
+        linhas = db.session.execute(
+            select(
+                Usuario.id, Usuario.nick_canal, Usuario.pontos, Usuario.online, Usuario.tipo_janela,
+                Usuario.data_criacao, Usuario.ultima_atividade,
+                SessaoLurk.id.label('sessao_id'), SessaoLurk.tipo_janela.label('sessao_tipo_janela'),
+                SessaoLurk.inicio_sessao, SessaoLurk.pontos_gerados
+            )
+            .outerjoin(SessaoLurk, and_(SessaoLurk.usuario_id == Usuario.id, SessaoLurk.ativa == True))
+            .where(Usuario.online == True)
+        ).all()
+        db.session.commit()
+
+        with self._lock:
+            # Registradas por este worker depois do início da leitura: mais novas que o banco lido
+            recentes = {
+                usuario_id: entrada for usuario_id, entrada in self._usuarios.items()
+                if entrada['registrada_em'] >= inicio
+            }
+            usuarios = {}
+            for linha in linhas:
+                usuario = _usuario_dict(linha)
+                # Heartbeat ainda não gravado é mais recente que o banco
+                if linha.id in self._batimentos:
+                    usuario['ultima_atividade'] = self._batimentos[linha.id].isoformat()
+                usuarios[linha.id] = {
+                    'usuario': usuario,
+                    'sessao': _sessao_dict(linha),
+                    'inicio_sessao': linha.inicio_sessao,
+                    'registrada_em': inicio
+                }
+            usuarios.update(recentes)
+            self._usuarios = usuarios
+            self._ids_online = sorted(usuario_id for usuario_id, e in usuarios.items() if e['usuario']['online'])
+            self._versao = versao
+            self._verificada_em = time.monotonic()
+            self._online_carregado = True
+            return len(self._ids_online)
+
+    def atualizar_pontos(self, linhas, referencia=None):
+        """Aplica (id, nick_canal, pontos) alterados fora do lurk às entradas em memória
+
+        referencia é o instante até o qual os pontos pendentes das sessões foram
+        gravados antes da alteração; eles deixam de ser somados na leitura.
+        """
+        with self._lock:
+            for usuario_id, _, pontos in linhas:
+                entrada = self._usuarios.get(usuario_id)
+                if entrada is not None:
+                    entrada['usuario']['pontos'] = pontos
+                    self._consumir_pendentes(entrada, referencia)
+
+    def zerar_pontos(self, referencia=None):
+        with self._lock:
+            for entrada in self._usuarios.values():
+                entrada['usuario']['pontos'] = 0
+                self._consumir_pendentes(entrada, referencia)
+
+    def _consumir_pendentes(self, entrada, referencia):
+        # Chamado com o lock adquirido: a sessão passa a ter gerado os pontos devidos até a referência
+        if referencia is None or entrada['sessao'] is None:
+            return
+        intervalo = current_app.config.get('INTERVALO_PONTUACAO', INTERVALO_PONTUACAO)
+        devidos = pontos_devidos(entrada['inicio_sessao'], referencia, intervalo)
+        entrada['sessao']['pontos_gerados'] = max(entrada['sessao']['pontos_gerados'] or 0, devidos)
+
+    def esquecer(self, usuario_id):
+        with self._lock:
+            self._usuarios.pop(usuario_id, None)
+            self._batimentos.pop(usuario_id, None)
+            self._marcar_online(usuario_id, False)
+
+presenca = RegistroPresenca()
+
+class TarefaPresenca(TarefaPeriodica):
+    """Grava os heartbeats em lote e recarrega o conjunto online"""
+
+    def __init__(self, app, intervalo):
+        super().__init__(app, 'presenca', intervalo)
+
+    def executar(self):
+        return {
+            'batimentos_gravados': presenca.gravar_batimentos(),
+            'usuarios_online': presenca.recarregar_online()
+        }
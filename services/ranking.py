@@ -0,0 +1,381 @@
+import random
+import threading
+import time
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import select, func, desc, cast, Integer, String
+from sqlalchemy.dialects.sqlite import insert
+from src.models.database import db, Usuario, VersaoCache
+from src.services.transacao import apos_commit
+
+NOME_VERSAO = 'ranking'
+
+# Com vários workers, a versão gravada por outro processo é percebida em até este intervalo (segundos)
+INTERVALO_VERIFICACAO = 2
+
+# Níveis da lista de saltos: com p = 1/4, suficiente para dezenas de milhões de chaves
+NIVEL_MAXIMO = 16
+
+def calcular_media(pontos):
+    """Média baseada em 1000 pontos"""
+    media = (pontos / 1000) * 100 if pontos and pontos > 0 else 0
+    return round(media, 2)
+
+def item_ranking(posicao, nick_canal, pontos):
+    return {
+        'posicao': posicao,
+        'espectador': nick_canal,
+        'pontos': pontos,
+        'media': calcular_media(pontos)
+    }
+
+def _ordem_ranking():
+    # Maior pontuação primeiro; empates pela ordem de cadastro
+    return (desc(Usuario.pontos), Usuario.id)
+
+class _No:
+    __slots__ = ('chave', 'proximos', 'larguras')
+
+    def __init__(self, chave, nivel):
+        self.chave = chave
+        self.proximos = [None] * nivel
+        self.larguras = [0] * nivel  # posições puladas até o próximo nó de cada nível
+
+class ListaSaltos:
+    """Lista de saltos indexável: chaves ordenadas com inserção, remoção, posição e
+    acesso por índice em O(log n) esperado
+    """
+
+    def __init__(self, chaves_ordenadas=(), semente=None):
+        self._aleatorio = random.Random(semente)
+        self._cabeca = _No(None, NIVEL_MAXIMO)
+        self._nivel = 1
+        self._tamanho = 0
+        # Montagem em O(n) a partir de chaves já ordenadas: encadear cada nó no fim de cada nível
+        ultimos = [self._cabeca] * NIVEL_MAXIMO
+        posicoes = [0] * NIVEL_MAXIMO
+        for posicao, chave in enumerate(chaves_ordenadas, 1):
+            no = _No(chave, self._sortear_nivel())
+            for nivel in range(len(no.proximos)):
+                ultimos[nivel].proximos[nivel] = no
+                ultimos[nivel].larguras[nivel] = posicao - posicoes[nivel]
+                ultimos[nivel] = no
+                posicoes[nivel] = posicao
+            self._nivel = max(self._nivel, len(no.proximos))
+            self._tamanho = posicao
+
+    def __len__(self):
+        return self._tamanho
+
+    def _sortear_nivel(self):
+        # Cada par de bits zerado (probabilidade 1/4) sobe um nível
+        bits = self._aleatorio.getrandbits(2 * NIVEL_MAXIMO)
+        nivel = 1
+        while nivel < NIVEL_MAXIMO and not bits & 3:
+            nivel += 1
+            bits >>= 2
+        return nivel
+
+    def _anteriores(self, chave):
+        # Último nó de cada nível com chave menor e a sua posição (cabeça = 0)
+        anteriores = [self._cabeca] * NIVEL_MAXIMO
+        posicoes = [0] * NIVEL_MAXIMO
+        no, posicao = self._cabeca, 0
+        for nivel in range(self._nivel - 1, -1, -1):
+            proximo = no.proximos[nivel]
+            while proximo is not None and proximo.chave < chave:
+                posicao += no.larguras[nivel]
+                no, proximo = proximo, proximo.proximos[nivel]
+            anteriores[nivel] = no
+            posicoes[nivel] = posicao
+        return anteriores, posicoes
+
+    def inserir(self, chave):
+        anteriores, posicoes = self._anteriores(chave)
+        no = _No(chave, self._sortear_nivel())
+        posicao = posicoes[0] + 1
+        self._nivel = max(self._nivel, len(no.proximos))
+        for nivel in range(self._nivel):
+            anterior = anteriores[nivel]
+            if nivel < len(no.proximos):
+                no.proximos[nivel] = anterior.proximos[nivel]
+                anterior.proximos[nivel] = no
+                if no.proximos[nivel] is not None:
+                    no.larguras[nivel] = anterior.larguras[nivel] - (posicao - posicoes[nivel]) + 1
+                anterior.larguras[nivel] = posicao - posicoes[nivel]
+            elif anterior.proximos[nivel] is not None:
+                anterior.larguras[nivel] += 1
+        self._tamanho += 1
+
+    def remover(self, chave):
+        """Remove a chave; retorna False se ela não estava na lista"""
+        anteriores, _ = self._anteriores(chave)
+        no = anteriores[0].proximos[0]
+        if no is None or no.chave != chave:
+            return False
+        for nivel in range(self._nivel):
+            anterior = anteriores[nivel]
+            if anterior.proximos[nivel] is no:
+                anterior.proximos[nivel] = no.proximos[nivel]
+                if no.proximos[nivel] is not None:
+                    anterior.larguras[nivel] += no.larguras[nivel] - 1
+            elif anterior.proximos[nivel] is not None:
+                anterior.larguras[nivel] -= 1
+        while self._nivel > 1 and self._cabeca.proximos[self._nivel - 1] is None:
+            self._nivel -= 1
+        self._tamanho -= 1
+        return True
+
+    def indice(self, chave):
+        """Quantidade de chaves menores que a chave (o índice dela, se estiver na lista)"""
+        no, posicao = self._cabeca, 0
+        for nivel in range(self._nivel - 1, -1, -1):
+            proximo = no.proximos[nivel]
+            while proximo is not None and proximo.chave < chave:
+                posicao += no.larguras[nivel]
+                no, proximo = proximo, proximo.proximos[nivel]
+        return posicao
+
+    def fatia(self, inicio, quantidade=None):
+        """Chaves a partir do índice inicio, até quantidade delas"""
+        fim = self._tamanho if quantidade is None else min(self._tamanho, inicio + quantidade)
+        if inicio >= fim:
+            return []
+        # Descer até o nó da posição inicio + 1 somando as larguras
+        no, posicao = self._cabeca, 0
+        for nivel in range(self._nivel - 1, -1, -1):
+            while no.proximos[nivel] is not None and posicao + no.larguras[nivel] <= inicio + 1:
+                posicao += no.larguras[nivel]
+                no = no.proximos[nivel]
+        chaves = []
+        for _ in range(fim - inicio):
+            chaves.append(no.chave)
+            no = no.proximos[0]
+        return chaves
+
+class RankingEmMemoria:
+    """Ranking mantido ordenado em memória e atualizado a cada mudança de pontos
+
+    As chaves (-pontos, id) ficam numa lista de saltos indexável: mudar os pontos
+    de um usuário, achar a sua posição e o início de uma página custam O(log n).
+
+    Cada alteração incrementa a versão do ranking na tabela versoes_cache. O worker
+    que alterou aplica a mudança na memória; os demais percebem a troca de versão
+    e recarregam. Sem troca de versão a memória não é recarregada: pontos alterados
+    fora do app (SQL manual, scripts) pedem invalidar() ou uma nova versão.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chaves = ListaSaltos()  # (-pontos, id) em ordem crescente = ranking
+        self._usuarios = {}  # id -> (nick_canal, pontos)
+        self._ids_por_nick = {}
+        self._carregado = False
+        self._carregando = False
+        self._alteracoes = 0  # contador de mudanças, detecta escrita concorrente à carga
+        self._versao = None  # versão do banco refletida na memória
+        self._verificada_em = 0.0
+
+    @property
+    def carregado(self):
+        return self._carregado
+
+    def carregar(self, tentativas=3):
+        """Carrega o ranking inteiro com uma consulta por colunas, já na ordem do índice"""
+        for _ in range(tentativas):
+            with self._lock:
+                alteracoes = self._alteracoes
+            # Versão lida antes dos usuários: uma escrita no meio deixa a versão velha e força outra carga
+            versao = versao_ranking()
+            linhas = db.session.execute(
+                select(Usuario.id, Usuario.nick_canal, Usuario.pontos).order_by(*_ordem_ranking())
+            ).all()
+            db.session.commit()
+            # Montagem fora do lock; pontos nulos vêm depois dos zerados na ordem do banco, então ordenar
+            chaves = ListaSaltos(sorted((-(linha.pontos or 0), linha.id) for linha in linhas))
+            usuarios = {linha.id: (linha.nick_canal, linha.pontos or 0) for linha in linhas}
+            ids_por_nick = {linha.nick_canal: linha.id for linha in linhas}
+            with self._lock:
+                # Pontos alterados durante a leitura: a foto pode estar velha, ler de novo
+                if self._alteracoes != alteracoes:
+                    continue
+                self._chaves = chaves
+                self._usuarios = usuarios
+                self._ids_por_nick = ids_por_nick
+                self._versao = versao
+                self._verificada_em = time.monotonic()
+                self._carregado = True
+                self._carregando = False
+                return len(linhas)
+        with self._lock:
+            self._carregando = False
+        return None
+
+    def aquecer_em_segundo_plano(self):
+        """Dispara a carga do cache sem segurar a requisição que o encontrou frio"""
+        with self._lock:
+            if self._carregado or self._carregando:
+                return
+            self._carregando = True
+        app = current_app._get_current_object()
+
+        def _carregar():
+            with app.app_context():
+                try:
+                    self.carregar()
+                except Exception:
+                    with self._lock:
+                        self._carregando = False
+                    raise
+
+        threading.Thread(target=_carregar, name='ranking-aquecimento', daemon=True).start()
+
+    def invalidar(self):
+        with self._lock:
+            self._invalidar()
+
+    def _invalidar(self):
+        # Chamado com o lock adquirido
+        self._alteracoes += 1
+        self._chaves = ListaSaltos()
+        self._usuarios = {}
+        self._ids_por_nick = {}
+        self._versao = None
+        self._carregado = False
+
+    def definir_versao(self, versao):
+        """Versão gravada por uma alteração deste processo, já aplicada na memória
+
+        Se a memória não estava na versão imediatamente anterior, outro worker
+        alterou o ranking no meio e a memória é descartada.
+        """
+        with self._lock:
+            self._alteracoes += 1
+            if not self._carregado:
+                return
+            if self._versao is not None and versao == self._versao + 1:
+                self._versao = versao
+            else:
+                self._invalidar()
+
+    def verificar_versao(self):
+        """Descarta a memória se outro worker trocou a versão"""
+        agora = time.monotonic()
+        with self._lock:
+            if not self._carregado or agora - self._verificada_em < INTERVALO_VERIFICACAO:
+                return
+            self._verificada_em = agora
+            alteracoes = self._alteracoes
+
+        versao = versao_ranking()
+        db.session.commit()
+        with self._lock:
+            # Uma alteração deste processo no meio da leitura já acertou a versão
+            if self._carregado and self._alteracoes == alteracoes and versao != self._versao:
+                self._invalidar()
+
+    def atualizar(self, linhas):
+        """Aplica (id, nick_canal, pontos) de usuários novos ou com pontos alterados"""
+        with self._lock:
+            self._alteracoes += 1
+            if not self._carregado:
+                return
+            for usuario_id, nick_canal, pontos in linhas:
+                pontos = pontos or 0
+                anterior = self._usuarios.get(usuario_id)
+                if anterior is not None:
+                    self._chaves.remover((-anterior[1], usuario_id))
+                    if anterior[0] != nick_canal:
+                        self._ids_por_nick.pop(anterior[0], None)
+                self._chaves.inserir((-pontos, usuario_id))
+                self._usuarios[usuario_id] = (nick_canal, pontos)
+                self._ids_por_nick[nick_canal] = usuario_id
+
+    def remover(self, usuario_ids):
+        with self._lock:
+            self._alteracoes += 1
+            if not self._carregado:
+                return
+            for usuario_id in usuario_ids:
+                anterior = self._usuarios.pop(usuario_id, None)
+                if anterior is not None:
+                    self._chaves.remover((-anterior[1], usuario_id))
+                    self._ids_por_nick.pop(anterior[0], None)
+
+    def pagina(self, inicio, quantidade=None):
+        with self._lock:
+            chaves = self._chaves.fatia(inicio, quantidade)
+            return [
+                item_ranking(inicio + i + 1, *self._usuarios[usuario_id])
+                for i, (_, usuario_id) in enumerate(chaves)
+            ], len(self._chaves)
+
+    def posicao(self, nick_canal):
+        with self._lock:
+            usuario_id = self._ids_por_nick.get(nick_canal)
+            if usuario_id is None:
+                return None
+            pontos = self._usuarios[usuario_id][1]
+            return item_ranking(self._chaves.indice((-pontos, usuario_id)) + 1, nick_canal, pontos)
+
+ranking = RankingEmMemoria()
+
+def versao_ranking():
+    """Versão do ranking gravada em versoes_cache; None antes da primeira alteração"""
+    versao = db.session.execute(select(VersaoCache.versao).where(VersaoCache.nome == NOME_VERSAO)).scalar()
+    return int(versao) if versao is not None else None
+
+def registrar_alteracao_ranking():
+    """Incrementa a versão do ranking na transação corrente; os outros workers recarregam ao perceber a troca
+
+    A versão é um contador para que o worker que alterou saiba se a sua memória
+    estava na versão anterior. Deve ser chamada depois da escrita nos usuários,
+    com a trava de escrita do SQLite já adquirida.
+    """
+    agora = datetime.utcnow()
+    versao = db.session.execute(
+        insert(VersaoCache)
+        .values(nome=NOME_VERSAO, versao='1', atualizada_em=agora)
+        .on_conflict_do_update(
+            index_elements=['nome'],
+            set_={'versao': cast(cast(VersaoCache.versao, Integer) + 1, String), 'atualizada_em': agora}
+        )
+        .returning(VersaoCache.versao)
+    ).scalar()
+    apos_commit(ranking.definir_versao, int(versao))
+    return versao
+
+def _ranking_sql():
+    return select(
+        Usuario.id,
+        Usuario.nick_canal,
+        Usuario.pontos,
+        func.row_number().over(order_by=_ordem_ranking()).label('posicao')
+    )
+
+def obter_pagina(inicio=0, quantidade=None):
+    """Página do ranking; com o cache frio, responde pelo SQL com função de janela"""
+    ranking.verificar_versao()
+    if ranking.carregado:
+        return ranking.pagina(inicio, quantidade)
+
+    ranking.aquecer_em_segundo_plano()
+    consulta = _ranking_sql().order_by(*_ordem_ranking()).offset(inicio)
+    if quantidade is not None:
+        consulta = consulta.limit(quantidade)
+    itens = [item_ranking(l.posicao, l.nick_canal, l.pontos or 0) for l in db.session.execute(consulta)]
+    total = db.session.execute(select(func.count(Usuario.id))).scalar()
+    return itens, total
+
+def obter_posicao(nick_canal):
+    """Posição de um nick no ranking; None se o nick não existe"""
+    ranking.verificar_versao()
+    if ranking.carregado:
+        return ranking.posicao(nick_canal)
+
+    ranking.aquecer_em_segundo_plano()
+    classificados = _ranking_sql().subquery()
+    linha = db.session.execute(
+        select(classificados).where(classificados.c.nick_canal == nick_canal)
+    ).first()
+    return item_ranking(linha.posicao, linha.nick_canal, linha.pontos or 0) if linha else None
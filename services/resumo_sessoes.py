@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, delete, func, text
+from sqlalchemy.dialects.sqlite import insert
+from src.models.database import db, SessaoLurk, ResumoDiarioLurk
+from src.services.tarefas import TarefaPeriodica
+from src.services.lideranca import adquirir_lideranca
+
+# Lease da tarefa: um worker compacta por vez
+TRAVA = 'resumo-sessoes'
+
+# Sessões compactadas por transação
+LOTE_RESUMO = 50000
+
+# Lotes por execução: um atraso grande é recuperado aos poucos, sem segurar a trava de escrita
+MAXIMO_LOTES_POR_EXECUCAO = 20
+
+# Sessões brutas encerradas há mais que isso só ficam no resumo diário
+RETENCAO_DIAS = 90
+
+# Sessões removidas por transação na limpeza da retenção
+LOTE_EXCLUSAO = 10000
+
+# Ids das primeiras sessões encerradas ainda fora do resumo. O índice parcial é fixado com
+# INDEXED BY: vazio no ANALYZE, ele fica sem estatísticas e o planejador preferiria varrer a tabela
+SQL_PENDENTES = (
+    'SELECT id FROM sessoes_lurk INDEXED BY ix_sessoes_lurk_pendentes_resumo '
+    'WHERE ativa = 0 AND resumida = 0 ORDER BY id LIMIT :limite'
+)
+
+def _pendentes(limite):
+    return text(SQL_PENDENTES).bindparams(limite=limite).columns(SessaoLurk.id)
+
+def compactar_lote(tamanho=LOTE_RESUMO):
+    """Soma um lote de sessões encerradas ao resumo diário e as marca como resumidas na mesma transação
+
+    Retorna a quantidade de sessões compactadas. Uma sessão longa ainda ativa não
+    segura as demais, e a marca por linha impede que uma sessão seja somada duas vezes.
+    """
+    lote = SessaoLurk.id.in_(_pendentes(tamanho))
+    dia = func.date(SessaoLurk.inicio_sessao)
+    origem = (
+        select(
+            SessaoLurk.usuario_id,
+            dia,
+            func.count(),
+            func.coalesce(func.sum((func.julianday(SessaoLurk.fim_sessao) - func.julianday(SessaoLurk.inicio_sessao)) * 1440), 0),
+            func.coalesce(func.sum(SessaoLurk.pontos_gerados), 0)
+        )
+        .where(lote)
+        .group_by(SessaoLurk.usuario_id, dia)
+    )
+    comando = insert(ResumoDiarioLurk).from_select(['usuario_id', 'dia', 'sessoes', 'minutos', 'pontos'], origem)
+    comando = comando.on_conflict_do_update(
+        index_elements=['usuario_id', 'dia'],
+        set_={
+            'sessoes': ResumoDiarioLurk.sessoes + comando.excluded.sessoes,
+            'minutos': ResumoDiarioLurk.minutos + comando.excluded.minutos,
+            'pontos': ResumoDiarioLurk.pontos + comando.excluded.pontos
+        }
+    )
+    # O INSERT adquire a trava de escrita: o lote é o mesmo no UPDATE seguinte
+    db.session.execute(comando)
+    sessoes = db.session.execute(
+        update(SessaoLurk).where(lote).values(resumida=True).execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return sessoes
+
+def resumir_sessoes(maximo_lotes=MAXIMO_LOTES_POR_EXECUCAO):
+    """Compacta as sessões encerradas ainda fora do resumo, um lote por transação"""
+    sessoes = lotes = 0
+    pendente = True
+    while pendente and lotes < maximo_lotes:
+        compactadas = compactar_lote()
+        sessoes += compactadas
+        lotes += 1
+        pendente = compactadas == LOTE_RESUMO
+    return {'sessoes_resumidas': sessoes, 'pendente': pendente}
+
+def remover_sessoes_antigas(retencao_dias=RETENCAO_DIAS, agora=None):
+    """Remove, em lotes, as sessões já resumidas que terminaram antes da janela de retenção"""
+    corte = (agora or datetime.utcnow()) - timedelta(days=retencao_dias)
+    removidas = 0
+    while True:
+        # Só o que já está no resumo (índice parcial ix_sessoes_lurk_resumidas_fim)
+        ids = (
+            select(SessaoLurk.id)
+            .where(SessaoLurk.resumida == True, SessaoLurk.fim_sessao < corte)
+            .limit(LOTE_EXCLUSAO)
+        )
+        lote = db.session.execute(
+            delete(SessaoLurk).where(SessaoLurk.id.in_(ids)).execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        removidas += lote
+        if lote < LOTE_EXCLUSAO:
+            return removidas
+
+class TarefaResumoSessoes(TarefaPeriodica):
+    """Compacta as sessões encerradas no resumo diário e aplica a retenção das sessões brutas"""
+
+    TRAVA = TRAVA
+
+    def __init__(self, app, intervalo, retencao_dias=RETENCAO_DIAS):
+        super().__init__(app, 'resumo-sessoes', intervalo)
+        self.retencao_dias = retencao_dias
+
+    def executar(self):
+        if not adquirir_lideranca(self.TRAVA, self.intervalo * 3):
+            return {'lider': False}
+
+        resultado = resumir_sessoes()
+        resultado['sessoes_removidas'] = remover_sessoes_antigas(self.retencao_dias)
+        return {'lider': True, **resultado}
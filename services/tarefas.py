@@ -0,0 +1,81 @@
+import logging
+import threading
+import time
+from datetime import datetime
+from src.models.database import db
+from src.services.metricas import execucoes_tarefa, duracao_tarefa
+
+logger = logging.getLogger(__name__)
+
+class TarefaPeriodica:
+    """Executa um trabalho em cadência fixa numa única thread daemon"""
+
+    def __init__(self, app, nome, intervalo):
+        self.app = app
+        self.nome = nome
+        self.intervalo = intervalo
+        self._parar = threading.Event()
+        self._thread = None
+        self.estatisticas = {
+            'execucoes': 0,
+            'falhas': 0,
+            'ultima_execucao': None,
+            'ultima_duracao_ms': None,
+            'ultimo_resultado': None,
+            'ultimo_erro': None
+        }
+
+    def executar(self):
+        """Trabalho de um ciclo; retorna um dicionário com o resultado"""
+        raise NotImplementedError
+
+    def iniciar(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._loop, name=self.nome, daemon=True)
+        self._thread.start()
+
+    def parar(self, timeout=None):
+        self._parar.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _loop(self):
+        proximo = time.monotonic() + self.intervalo
+        while not self._parar.wait(max(0, proximo - time.monotonic())):
+            self.executar_agora()
+            # Cadência fixa: se o ciclo atrasar, não acumula execuções pendentes
+            proximo = max(proximo + self.intervalo, time.monotonic())
+
+    def executar_agora(self):
+        """Executa um ciclo imediatamente, registrando duração e resultado"""
+        inicio = time.perf_counter()
+        resultado = None
+        falhou = False
+        with self.app.app_context():
+            try:
+                resultado = self.executar()
+                self.estatisticas['ultimo_resultado'] = resultado
+                self.estatisticas['ultimo_erro'] = None
+            except Exception as e:
+                db.session.rollback()
+                falhou = True
+                self.estatisticas['falhas'] += 1
+                self.estatisticas['ultimo_erro'] = str(e)
+                logger.exception('Erro na tarefa %s', self.nome)
+        self.estatisticas['execucoes'] += 1
+        self.estatisticas['ultima_execucao'] = datetime.utcnow().isoformat()
+        duracao = time.perf_counter() - inicio
+        self.estatisticas['ultima_duracao_ms'] = round(duracao * 1000, 3)
+        execucoes_tarefa.incrementar(self.nome, 'falha' if falhou else 'ok')
+        duracao_tarefa.observar(duracao, self.nome)
+        return resultado
+
+    def to_dict(self):
+        return {
+            'nome': self.nome,
+            'intervalo': self.intervalo,
+            'ativa': bool(self._thread and self._thread.is_alive()),
+            **self.estatisticas
+        }
@@ -0,0 +1,189 @@
+import io
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy import update
+from src.models.database import db, TarefaImportacao
+from src.services.linha_tempo_agenda import linha_tempo_agenda
+from src.services.metricas import importacoes, duracao_importacao, linhas_importacao
+
+logger = logging.getLogger(__name__)
+
+PENDENTE = 'pendente'
+PROCESSANDO = 'processando'
+CONCLUIDA = 'concluida'
+FALHOU = 'falhou'
+
+# Modos de importação: trocar a agenda inteira ou aplicar só a diferença
+MODO_SUBSTITUIR = 'substituir'
+MODO_DIFERENCIAL = 'diferencial'
+MODOS_IMPORTACAO = (MODO_SUBSTITUIR, MODO_DIFERENCIAL)
+
+ETAPA_LEITURA = 'leitura'
+ETAPA_GRAVACAO = 'gravacao'
+
+# Intervalo mínimo, em segundos, entre duas gravações do progresso de uma tarefa
+INTERVALO_PROGRESSO = 0.5
+
+# Tentativas de gravar a falha de uma tarefa (banco travado, disco cheio), com espera crescente entre elas
+TENTATIVAS_FALHA = 3
+ESPERA_TENTATIVA_FALHA = 1
+
+def _atualizar(tarefa_id, **campos):
+    db.session.execute(
+        update(TarefaImportacao).where(TarefaImportacao.id == tarefa_id).values(**campos)
+    )
+
+def _marcar_falha(tarefa_id, mensagem, inicio):
+    """Grava a falha da tarefa; tenta de novo para ela não ficar em processamento para sempre"""
+    for tentativa in range(1, TENTATIVAS_FALHA + 1):
+        try:
+            _atualizar(
+                tarefa_id,
+                status=FALHOU,
+                mensagem=mensagem,
+                concluida_em=datetime.utcnow(),
+                duracao_ms=round((time.perf_counter() - inicio) * 1000, 3)
+            )
+            db.session.commit()
+            return True
+        except Exception:
+            db.session.rollback()
+            logger.exception('Erro ao gravar a falha da importação %s (tentativa %d)', tarefa_id, tentativa)
+            if tentativa < TENTATIVAS_FALHA:
+                time.sleep(ESPERA_TENTATIVA_FALHA * tentativa)
+    return False
+
+def _mensagem_conclusao(modo, alteracoes):
+    if modo == MODO_DIFERENCIAL:
+        return (
+            f"Agenda atualizada! {alteracoes['inseridos']} inseridos, {alteracoes['atualizados']} atualizados, "
+            f"{alteracoes['removidos']} removidos, {alteracoes['inalterados']} inalterados."
+        )
+    return f"Agenda importada com sucesso! {alteracoes['inseridos']} registros inseridos."
+
+class ExecutorImportacao:
+    """Importações da agenda processadas fora da requisição, num pool de threads
+
+    O estado de cada tarefa fica na tabela tarefas_importacao: o status pode ser
+    consultado em qualquer worker, não só no que recebeu o upload.
+    """
+
+    def __init__(self, app, max_workers=1):
+        self.app = app
+        # Um worker basta: o SQLite aceita um escritor por vez
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='importacao-agenda')
+
+    def enviar(self, arquivo_enviado, extensao, modo, admin_id=None):
+        """Registra a tarefa e a enfileira com o arquivo do upload; retorna a tarefa criada"""
+        # O Werkzeug já guardou o upload (em memória se pequeno, senão num temporário em disco)
+        # e o fecharia no fim da requisição: a tarefa fica com o mesmo arquivo, sem copiá-lo
+        arquivo = arquivo_enviado.stream
+        arquivo_enviado.stream = io.BytesIO()
+        tamanho = arquivo.seek(0, io.SEEK_END)
+        arquivo.seek(0)
+
+        try:
+            tarefa = TarefaImportacao(
+                id=uuid.uuid4().hex,
+                status=PENDENTE,
+                modo=modo,
+                nome_arquivo=arquivo_enviado.filename,
+                admin_id=admin_id,
+                bytes_total=tamanho
+            )
+            db.session.add(tarefa)
+            db.session.commit()
+        except Exception:
+            arquivo.close()
+            raise
+
+        self._executor.submit(self._executar, tarefa.id, arquivo, extensao, modo)
+        return tarefa
+
+    def _registrar_progresso(self, tarefa_id):
+        ultima_gravacao = 0.0
+
+        def registrar(linhas_lidas, bytes_lidos):
+            nonlocal ultima_gravacao
+            agora = time.monotonic()
+            if agora - ultima_gravacao < INTERVALO_PROGRESSO:
+                return
+            ultima_gravacao = agora
+            _atualizar(tarefa_id, linhas_lidas=linhas_lidas, bytes_lidos=bytes_lidos)
+            db.session.commit()
+
+        return registrar
+
+    def _executar(self, tarefa_id, arquivo, extensao, modo):
+        inicio = time.perf_counter()
+        planilha_invalida = ()  # tipo do erro de validação, conhecido depois do import
+        with self.app.app_context():
+            try:
+                # pandas só é carregado na primeira importação, não na inicialização dos workers;
+                # se o import falhar, a tarefa é marcada como falha em vez de ficar pendente
+                from src.services.importacao_agenda import (
+                    PlanilhaInvalida, processar_arquivo, sincronizar_agenda, substituir_agenda
+                )
+                planilha_invalida = PlanilhaInvalida
+
+                _atualizar(tarefa_id, status=PROCESSANDO, etapa=ETAPA_LEITURA, iniciada_em=datetime.utcnow())
+                db.session.commit()
+
+                validos, rejeitados = processar_arquivo(arquivo, extensao, self._registrar_progresso(tarefa_id))
+                _atualizar(
+                    tarefa_id,
+                    etapa=ETAPA_GRAVACAO,
+                    bytes_lidos=TarefaImportacao.bytes_total,
+                    linhas_lidas=len(validos) + sum(rejeitados.values()),
+                    registros_validos=len(validos),
+                    registros_rejeitados=sum(rejeitados.values()),
+                    rejeitados_por_motivo=rejeitados
+                )
+                db.session.commit()
+
+                if modo == MODO_DIFERENCIAL:
+                    alteracoes = sincronizar_agenda(validos)
+                else:
+                    alteracoes = {'inseridos': substituir_agenda(validos)}
+
+                # Status final na mesma transação da agenda: só fica concluída se os dados foram gravados
+                _atualizar(
+                    tarefa_id,
+                    status=CONCLUIDA,
+                    alteracoes=alteracoes,
+                    mensagem=_mensagem_conclusao(modo, alteracoes),
+                    concluida_em=datetime.utcnow(),
+                    duracao_ms=round((time.perf_counter() - inicio) * 1000, 3)
+                )
+                db.session.commit()
+                linhas_importacao.incrementar('valida', valor=len(validos))
+                linhas_importacao.incrementar('rejeitada', valor=sum(rejeitados.values()))
+                status = CONCLUIDA
+            except Exception as e:
+                db.session.rollback()
+                if isinstance(e, planilha_invalida):
+                    mensagem = str(e)
+                else:
+                    logger.exception('Erro na importação %s', tarefa_id)
+                    mensagem = f'Erro ao processar arquivo: {str(e)}'
+                _marcar_falha(tarefa_id, mensagem, inicio)
+                status = FALHOU
+            finally:
+                arquivo.close()
+
+            importacoes.incrementar(modo, status)
+            duracao_importacao.observar(time.perf_counter() - inicio, modo)
+
+            # Reconstruir o índice de "ao vivo agora" aqui, fora de qualquer requisição
+            try:
+                linha_tempo_agenda.atualizar()
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                logger.exception('Erro ao reconstruir a linha do tempo da agenda')
+
+    def parar(self, aguardar=True):
+        self._executor.shutdown(wait=aguardar)
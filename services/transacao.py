@@ -0,0 +1,29 @@
+import logging
+from sqlalchemy import event
+from src.models.database import db
+
+logger = logging.getLogger(__name__)
+
+CHAVE_CALLBACKS = 'apos_commit'
+
+def apos_commit(funcao, *args):
+    """Agenda funcao(*args) para rodar somente quando a transação corrente for confirmada"""
+    sessao = db.session()
+    if not sessao.in_transaction():
+        sessao.begin()
+    sessao.info.setdefault(CHAVE_CALLBACKS, []).append((funcao, args))
+
+@event.listens_for(db.session, 'after_commit')
+def _executar_callbacks(sessao):
+    for funcao, args in sessao.info.pop(CHAVE_CALLBACKS, []):
+        try:
+            funcao(*args)
+        except Exception:
+            # Caches em memória não podem derrubar uma transação já confirmada
+            logger.exception('Erro ao executar callback pós-commit %s', funcao)
+
+@event.listens_for(db.session, 'after_transaction_end')
+def _descartar_callbacks(sessao, transacao):
+    # Após um rollback da transação raiz os callbacks pendentes são descartados
+    if transacao.parent is None:
+        sessao.info.pop(CHAVE_CALLBACKS, None)
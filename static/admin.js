@@ -494,6 +494,7 @@ async function uploadAgenda() {
     
     const formData = new FormData();
     formData.append('file', file);
+    formData.append('modo', document.getElementById('agendaDiferencial').checked ? 'diferencial' : 'substituir');
     
     try {
         mostrarLoading(true);
@@ -505,12 +506,19 @@ async function uploadAgenda() {
         
         const data = await response.json();
         
-        if (data.success) {
-            mostrarNotificacao(data.message, 'success');
-            fileInput.value = '';
+        if (!data.success) {
+            mostrarNotificacao(data.message, 'error');
+            return;
+        }
+        
+        // O processamento roda em segundo plano: acompanhar a tarefa até terminar
+        fileInput.value = '';
+        const tarefa = await acompanharImportacao(data.tarefa.id);
+        if (tarefa.status === 'concluida') {
+            mostrarNotificacao(tarefa.mensagem, 'success');
             carregarAgenda();
         } else {
-            mostrarNotificacao(data.message, 'error');
+            mostrarNotificacao(tarefa.mensagem || 'Erro ao processar arquivo', 'error');
         }
     } catch (error) {
         console.error('Erro no upload:', error);
@@ -520,6 +528,22 @@ async function uploadAgenda() {
     }
 }
 
+// Consultar o status da importação até ela terminar
+async function acompanharImportacao(tarefaId) {
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        const response = await fetch(`${API_BASE}/agenda/importacoes/${tarefaId}`);
+        const data = await response.json();
+        
+        if (!data.success) {
+            throw new Error(data.message);
+        }
+        if (data.tarefa.status === 'concluida' || data.tarefa.status === 'falhou') {
+            return data.tarefa;
+        }
+    }
+}
+
 // Exportar agenda para Excel
 async function exportarAgendaExcel() {
     try {
@@ -968,7 +992,7 @@ async function limparRanking() {
     try {
         mostrarLoading(true);
         
-        const response = await fetch(`${API_BASE}/ranking/limpar-dados`, {
+        const response = await fetch(`${API_BASE}/ranking/limpar-ranking`, {
             method: 'DELETE'
         });
         
@@ -992,22 +1016,70 @@ async function limparRanking() {
 // Variáveis globais para usuários online
 let usuariosOnlineData = [];
 let usuariosOnlineFiltrados = [];
-let autoUpdateInterval = null;
+let fonteEventos = null;
+let atualizacaoPeriodica = null;
+let recargaRankingPendente = null;
 let autoUpdateAtivo = false;
-let intervaloAutoUpdate = 30; // segundos
+let totalOnlineServidor = 0;
+let proximoAposIdOnline = null;
+
+// Sem stream de eventos (servidor sem threads ou limite de conexões), consultar a cada 30 segundos
+const INTERVALO_ATUALIZACAO_PERIODICA = 30000;
+
+// Pontos chegam a cada ciclo de pontuação: o ranking visível é recarregado no máximo uma vez neste intervalo
+const INTERVALO_RECARGA_RANKING = 30000;
 
-// Carregar usuários online
+// Página de usuários online e campos usados pela tabela
+const LIMITE_PAGINA_ONLINE = 100;
+const CAMPOS_ONLINE = 'nick_canal,pontos,tipo_janela,ultima_atividade';
+
+// Buscar uma página de usuários online, a partir do último id já carregado
+async function buscarPaginaOnline(aposId) {
+    const params = new URLSearchParams({ limite: LIMITE_PAGINA_ONLINE, campos: CAMPOS_ONLINE });
+    if (aposId) {
+        params.set('apos_id', aposId);
+    }
+    const response = await fetch(`${API_BASE}/usuarios-online?${params}`);
+    return response.json();
+}
+
+function aplicarPaginaOnline(data) {
+    totalOnlineServidor = data.total;
+    proximoAposIdOnline = data.proximo_apos_id;
+    document.getElementById('carregarMaisOnline').style.display = proximoAposIdOnline ? 'block' : 'none';
+    atualizarListaOnline();
+}
+
+// Carregar usuários online (primeira página)
 async function carregarUsuariosOnline() {
     try {
-        const response = await fetch(`${API_BASE}/weblurk/usuarios-online`);
-        const data = await response.json();
+        const data = await buscarPaginaOnline(null);
         
         if (data.success) {
-            usuariosOnlineData = data.usuarios;
-            usuariosOnlineFiltrados = [...usuariosOnlineData];
-            renderizarTabelaUsuariosOnline();
-            atualizarEstatisticasOnline();
-            atualizarUltimaAtualizacao();
+            usuariosOnlineData = data.usuarios_online;
+            aplicarPaginaOnline(data);
+        } else {
+            mostrarNotificacao(data.message, 'error');
+        }
+    } catch (error) {
+        console.error('Erro ao carregar usuários online:', error);
+        mostrarNotificacao('Erro ao carregar usuários online', 'error');
+    }
+}
+
+// Carregar a próxima página de usuários online
+async function carregarMaisUsuariosOnline() {
+    if (!proximoAposIdOnline) {
+        return;
+    }
+    
+    try {
+        const data = await buscarPaginaOnline(proximoAposIdOnline);
+        
+        if (data.success) {
+            const carregados = new Set(usuariosOnlineData.map(u => u.id));
+            usuariosOnlineData = usuariosOnlineData.concat(data.usuarios_online.filter(u => !carregados.has(u.id)));
+            aplicarPaginaOnline(data);
         } else {
             mostrarNotificacao(data.message, 'error');
         }
@@ -1075,7 +1147,7 @@ function renderizarTabelaUsuariosOnline() {
 
 // Atualizar estatísticas de usuários online
 function atualizarEstatisticasOnline() {
-    const totalOnline = usuariosOnlineData.length;
+    const totalOnline = Math.max(totalOnlineServidor, usuariosOnlineData.length);
     const totalPopup = usuariosOnlineData.filter(u => u.tipo_janela === 'Pop-Up').length;
     const totalTab = usuariosOnlineData.filter(u => u.tipo_janela === 'Tab').length;
     
@@ -1155,50 +1227,140 @@ async function atualizarUsuariosOnline() {
     mostrarNotificacao('Lista de usuários online atualizada!', 'success');
 }
 
-// Toggle auto-update
+// Toggle tempo real (mudanças recebidas por SSE, sem consultas periódicas)
 function toggleAutoUpdate() {
     if (autoUpdateAtivo) {
-        // Desativar auto-update
-        clearInterval(autoUpdateInterval);
+        // Desativar tempo real
+        desconectarEventos();
         autoUpdateAtivo = false;
-        document.getElementById('autoUpdateText').textContent = 'Ativar Auto-Update';
+        document.getElementById('autoUpdateText').textContent = 'Ativar Tempo Real';
         document.getElementById('autoUpdateStatus').style.display = 'none';
-        mostrarNotificacao('Auto-update desativado', 'success');
+        mostrarNotificacao('Tempo real desativado', 'success');
     } else {
-        // Ativar auto-update
-        autoUpdateInterval = setInterval(carregarUsuariosOnline, intervaloAutoUpdate * 1000);
+        // Ativar tempo real
+        conectarEventos();
         autoUpdateAtivo = true;
-        document.getElementById('autoUpdateText').textContent = 'Desativar Auto-Update';
+        document.getElementById('autoUpdateText').textContent = 'Desativar Tempo Real';
         document.getElementById('autoUpdateStatus').style.display = 'block';
-        document.getElementById('intervalText').textContent = intervaloAutoUpdate;
-        mostrarNotificacao(`Auto-update ativado (${intervaloAutoUpdate}s)`, 'success');
+        mostrarNotificacao('Tempo real ativado', 'success');
     }
 }
 
-// Alterar intervalo de auto-update
-function alterarIntervalo() {
-    const novoIntervalo = prompt('Digite o novo intervalo em segundos (mínimo 10):', intervaloAutoUpdate);
-    
-    if (novoIntervalo === null || novoIntervalo === '') {
+// Conectar ao stream de eventos (SSE) do servidor
+function conectarEventos() {
+    if (!window.EventSource) {
+        iniciarAtualizacaoPeriodica();
         return;
     }
     
-    const intervalo = parseInt(novoIntervalo);
-    if (isNaN(intervalo) || intervalo < 10) {
-        mostrarNotificacao('Intervalo deve ser um número maior que 10 segundos', 'error');
-        return;
-    }
+    fonteEventos = new EventSource(`${API_BASE}/eventos`);
     
-    intervaloAutoUpdate = intervalo;
-    document.getElementById('intervalText').textContent = intervaloAutoUpdate;
+    // Stream recusado (503 sem threads ou limite atingido): o navegador não reconecta, consultar periodicamente
+    fonteEventos.onerror = () => {
+        if (fonteEventos && fonteEventos.readyState === EventSource.CLOSED) {
+            fonteEventos = null;
+            iniciarAtualizacaoPeriodica();
+        }
+    };
+    
+    fonteEventos.addEventListener('presenca', (evento) => {
+        const data = JSON.parse(evento.data);
+        const estavaNaLista = usuariosOnlineData.some(u => u.id === data.usuario.id);
+        usuariosOnlineData = usuariosOnlineData.filter(u => u.id !== data.usuario.id);
+        if (data.lurk_ativo) {
+            usuariosOnlineData.push(data.usuario);
+            totalOnlineServidor += estavaNaLista ? 0 : 1;
+        } else if (estavaNaLista) {
+            totalOnlineServidor -= 1;
+        }
+        atualizarListaOnline();
+    });
     
-    // Reiniciar auto-update se estiver ativo
-    if (autoUpdateAtivo) {
-        clearInterval(autoUpdateInterval);
-        autoUpdateInterval = setInterval(carregarUsuariosOnline, intervaloAutoUpdate * 1000);
-    }
+    fonteEventos.addEventListener('pontos', (evento) => {
+        const data = JSON.parse(evento.data);
+        const pontos = new Map(data.usuarios.map(u => [u.id, u.pontos]));
+        usuariosOnlineData.forEach(u => {
+            if (pontos.has(u.id)) {
+                u.pontos = pontos.get(u.id);
+            }
+        });
+        atualizarListaOnline();
+        agendarRecargaRanking();
+    });
     
-    mostrarNotificacao(`Intervalo alterado para ${intervaloAutoUpdate} segundos`, 'success');
+    fonteEventos.addEventListener('ranking', (evento) => {
+        const data = JSON.parse(evento.data);
+        if (data.acao === 'limpar') {
+            usuariosOnlineData.forEach(u => { u.pontos = 0; });
+        } else if (data.acao === 'excluir') {
+            const excluidos = new Set(data.ids);
+            const restantes = usuariosOnlineData.filter(u => !excluidos.has(u.id));
+            totalOnlineServidor -= usuariosOnlineData.length - restantes.length;
+            usuariosOnlineData = restantes;
+        }
+        atualizarListaOnline();
+        if (secaoVisivel('ranking')) {
+            carregarRanking();
+        }
+    });
+    
+    fonteEventos.addEventListener('agenda', () => {
+        if (secaoVisivel('agenda')) {
+            carregarAgenda();
+        }
+    });
+    
+    // Eventos perdidos durante a desconexão: recarregar a lista completa
+    fonteEventos.addEventListener('sincronizar', () => {
+        carregarUsuariosOnline();
+    });
+}
+
+function desconectarEventos() {
+    if (fonteEventos) {
+        fonteEventos.close();
+        fonteEventos = null;
+    }
+    clearInterval(atualizacaoPeriodica);
+    atualizacaoPeriodica = null;
+}
+
+// Alternativa ao stream: recarregar a lista online e o ranking visível periodicamente
+function iniciarAtualizacaoPeriodica() {
+    if (atualizacaoPeriodica) {
+        return;
+    }
+    atualizacaoPeriodica = setInterval(() => {
+        carregarUsuariosOnline();
+        if (secaoVisivel('ranking')) {
+            carregarRanking();
+        }
+    }, INTERVALO_ATUALIZACAO_PERIODICA);
+}
+
+// Uma recarga do ranking por intervalo, por mais eventos de pontos que cheguem nele
+function agendarRecargaRanking() {
+    if (recargaRankingPendente || !secaoVisivel('ranking')) {
+        return;
+    }
+    recargaRankingPendente = setTimeout(() => {
+        recargaRankingPendente = null;
+        if (secaoVisivel('ranking')) {
+            carregarRanking();
+        }
+    }, INTERVALO_RECARGA_RANKING);
+}
+
+function secaoVisivel(secao) {
+    return document.getElementById(secao + 'Section').style.display === 'block';
+}
+
+// Reaplicar filtro, ordenação e estatísticas após uma mudança recebida
+function atualizarListaOnline() {
+    filtrarUsuariosOnline();
+    ordenarUsuariosOnline();
+    atualizarEstatisticasOnline();
+    atualizarUltimaAtualizacao();
 }
 
 // Desconectar usuário
@@ -1210,12 +1372,12 @@ async function desconectarUsuario(nickCanal) {
     try {
         mostrarLoading(true);
         
-        const response = await fetch(`${API_BASE}/weblurk/desconectar-usuario`, {
+        const response = await fetch(`${API_BASE}/admin/desconectar-usuarios`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({ nick_canal: nickCanal })
+            body: JSON.stringify({ nicks: [nickCanal] })
         });
         
         const data = await response.json();
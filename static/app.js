@@ -4,22 +4,38 @@ const API_BASE = '/api';
 let lurkAtivo = false;
 let usuarioAtual = null;
 let agendaAtual = [];
+// validoAte: instante (relógio do navegador) da próxima mudança da agenda, quando o canal precisa ser consultado de novo
+let aoVivo = { carregado: false, item: null, validoAte: 0 };
 let lurkWindow = null;
+let urlJanela = null;
+let trocaCanalTimeout = null;
 let atualizacaoInterval = null;
 let reaberturaPendente = false;
+let fonteEventos = null;
+let consultaStatusInterval = null;
+
+// Sem mudança prevista para hoje, o canal é consultado de novo depois deste tempo (virada do dia)
+const VALIDADE_SEM_MUDANCA = 15 * 60 * 1000;
+
+// Sem stream de eventos (servidor sem threads ou limite de conexões), consultar o status a cada 30 segundos
+const INTERVALO_CONSULTA_STATUS = 30000;
 
 // Inicialização da aplicação
 document.addEventListener('DOMContentLoaded', function() {
     inicializarApp();
     verificarStatusLurk();
     carregarAgenda();
+    atualizarAoVivo();
     configurarEventListeners();
     
     // Atualizar agenda a cada 1 hora
     setInterval(carregarAgenda, 3600000); // 1 hora
     
-    // Verificar status a cada 30 segundos
-    setInterval(verificarStatusLurk, 30000);
+    // Mudanças do lurk e da agenda chegam pelo stream de eventos, sem consultas periódicas
+    conectarEventos();
+    
+    // Enviar heartbeat a cada 1 minuto enquanto o lurk estiver ativo
+    setInterval(enviarHeartbeat, 60000);
 });
 
 // Configurar event listeners
@@ -98,6 +114,9 @@ async function salvarNick() {
             
             // Habilitar botão de lurk
             document.getElementById('lurkBtn').disabled = false;
+            
+            // O stream filtra os eventos pelo usuário da sessão: reconectar com o nick salvo
+            conectarEventos();
         } else {
             mostrarNotificacao(data.message, 'error');
         }
@@ -124,6 +143,8 @@ async function toggleLurk() {
 // Iniciar Lurk
 async function iniciarLurk() {
     const tipoJanela = document.getElementById('windowType').value;
+    // Consultado junto com o início: a janela não pode abrir num canal que já saiu do ar
+    const aoVivoPronto = garantirAoVivo();
     
     try {
         const response = await fetch(`${API_BASE}/iniciar-lurk`, {
@@ -139,6 +160,7 @@ async function iniciarLurk() {
         if (data.success) {
             lurkAtivo = true;
             atualizarInterfaceLurk();
+            await aoVivoPronto;
             abrirJanelaLurk(tipoJanela);
             mostrarNotificacao(data.message, 'success');
             
@@ -176,6 +198,8 @@ async function finalizarLurk() {
                 clearInterval(atualizacaoInterval);
                 atualizacaoInterval = null;
             }
+            clearTimeout(trocaCanalTimeout);
+            trocaCanalTimeout = null;
         } else {
             mostrarNotificacao(data.message, 'error');
         }
@@ -210,6 +234,24 @@ function abrirJanelaLurk(tipo) {
         // Abrir nova aba
         lurkWindow = window.open(urlAtual, '_blank');
     }
+    // A URL da janela não pode ser lida depois que ela navega para outro domínio
+    urlJanela = urlAtual;
+}
+
+// Levar a janela aberta para o canal ao vivo, se ele mudou
+function navegarJanelaLurk(forcar = false) {
+    if (!lurkAtivo || !lurkWindow || lurkWindow.closed) {
+        return;
+    }
+    const urlAtual = obterUrlAtual();
+    if (forcar || urlAtual !== urlJanela) {
+        try {
+            lurkWindow.location.href = urlAtual;
+            urlJanela = urlAtual;
+        } catch (e) {
+            // Ignorar erros de cross-origin
+        }
+    }
 }
 
 // Fechar janela de lurk
@@ -218,13 +260,15 @@ function fecharJanelaLurk() {
         lurkWindow.close();
     }
     lurkWindow = null;
+    urlJanela = null;
 }
 
 // Alterar tipo de janela
 function alterarTipoJanela(novoTipo) {
     if (lurkAtivo) {
         fecharJanelaLurk();
-        setTimeout(() => {
+        setTimeout(async () => {
+            await garantirAoVivo();
             abrirJanelaLurk(novoTipo);
         }, 500);
     }
@@ -242,8 +286,59 @@ function obterUrlAtual() {
     return 'https://www.twitch.tv/';
 }
 
+// Consultar no servidor só o canal ao vivo agora, sem baixar a agenda do dia
+async function atualizarAoVivo() {
+    try {
+        const response = await fetch(`${API_BASE}/agenda-agora`);
+        const data = await response.json();
+        
+        if (data.success) {
+            // Diferença medida no relógio do servidor: o do navegador pode estar adiantado ou atrasado
+            let validade = data.proxima_mudanca
+                ? Date.parse(data.proxima_mudanca) - Date.parse(data.agora)
+                : VALIDADE_SEM_MUDANCA;
+            if (!Number.isFinite(validade)) {
+                validade = VALIDADE_SEM_MUDANCA;
+            }
+            aoVivo = { carregado: true, item: data.ao_vivo, validoAte: Date.now() + Math.max(validade, 0) };
+        }
+    } catch (error) {
+        console.error('Erro ao consultar canal ao vivo:', error);
+    }
+}
+
+// Consultar o canal ao vivo só se a agenda já mudou desde a última consulta
+async function garantirAoVivo() {
+    if (!aoVivo.carregado || Date.now() >= aoVivo.validoAte) {
+        await atualizarAoVivo();
+    }
+}
+
+// Atualizar o canal ao vivo, levar a janela para ele e agendar a próxima troca
+async function trocarCanalAoVivo() {
+    await atualizarAoVivo();
+    navegarJanelaLurk();
+    agendarTrocaCanal();
+}
+
+// Próxima consulta exatamente na próxima mudança da agenda, enquanto o lurk estiver ativo
+function agendarTrocaCanal() {
+    clearTimeout(trocaCanalTimeout);
+    trocaCanalTimeout = null;
+    if (!lurkAtivo) {
+        return;
+    }
+    // Um segundo de folga: no instante exato o servidor ainda pode responder o canal anterior
+    const espera = Math.max(aoVivo.validoAte - Date.now(), 0) + 1000;
+    trocaCanalTimeout = setTimeout(trocarCanalAoVivo, espera);
+}
+
 // Obter canal ativo no horário atual
 function obterCanalAtivo() {
+    if (aoVivo.carregado) {
+        return aoVivo.item;
+    }
+    
     const agora = new Date();
     const horaAtual = agora.getHours();
     
@@ -259,9 +354,10 @@ function iniciarMonitoramentoJanela() {
     atualizacaoInterval = setInterval(() => {
         if (lurkAtivo && lurkWindow && lurkWindow.closed && !reaberturaPendente) {
             reaberturaPendente = true;
-            setTimeout(() => {
+            setTimeout(async () => {
                 if (lurkAtivo) {
                     const tipoJanela = document.getElementById('windowType').value;
+                    await garantirAoVivo();
                     abrirJanelaLurk(tipoJanela);
                 }
                 reaberturaPendente = false;
@@ -269,29 +365,11 @@ function iniciarMonitoramentoJanela() {
         }
         
         // Atualizar URL a cada 13 minutos
-        if (lurkAtivo && lurkWindow && !lurkWindow.closed) {
-            const urlAtual = obterUrlAtual();
-            try {
-                lurkWindow.location.href = urlAtual;
-            } catch (e) {
-                // Ignorar erros de cross-origin
-            }
-        }
+        navegarJanelaLurk(true);
     }, 13 * 60 * 1000); // 13 minutos
     
-    // Verificar mudança de hora para atualizar canal
-    setInterval(() => {
-        if (lurkAtivo && lurkWindow && !lurkWindow.closed) {
-            const urlAtual = obterUrlAtual();
-            try {
-                if (lurkWindow.location.href !== urlAtual) {
-                    lurkWindow.location.href = urlAtual;
-                }
-            } catch (e) {
-                // Ignorar erros de cross-origin
-            }
-        }
-    }, 60000); // 1 minuto
+    // Trocar de canal quando a agenda mudar, no horário informado pelo servidor
+    agendarTrocaCanal();
 }
 
 // Atualizar interface do lurk
@@ -314,23 +392,86 @@ function atualizarInterfaceLurk() {
 async function verificarStatusLurk() {
     try {
         const response = await fetch(`${API_BASE}/status-lurk`);
-        const data = await response.json();
-        
-        if (data.lurk_ativo !== lurkAtivo) {
-            lurkAtivo = data.lurk_ativo;
-            atualizarInterfaceLurk();
-        }
-        
-        if (data.usuario) {
-            usuarioAtual = data.usuario;
-            document.getElementById('nickInput').value = data.usuario.nick_canal;
-            document.getElementById('windowType').value = data.usuario.tipo_janela || 'popup';
-        }
+        aplicarStatusLurk(await response.json());
     } catch (error) {
         console.error('Erro ao verificar status:', error);
     }
 }
 
+// Aplicar um status recebido da consulta ou de um evento de presença
+function aplicarStatusLurk(data) {
+    if (data.lurk_ativo !== lurkAtivo) {
+        lurkAtivo = data.lurk_ativo;
+        atualizarInterfaceLurk();
+    }
+    
+    if (data.usuario) {
+        usuarioAtual = data.usuario;
+        document.getElementById('nickInput').value = data.usuario.nick_canal;
+        document.getElementById('windowType').value = data.usuario.tipo_janela || 'popup';
+    }
+}
+
+// Conectar ao stream de eventos: o servidor envia só a presença deste usuário e as mudanças da agenda
+function conectarEventos() {
+    if (fonteEventos) {
+        fonteEventos.close();
+        fonteEventos = null;
+    }
+    if (!window.EventSource) {
+        iniciarConsultaStatus();
+        return;
+    }
+    
+    fonteEventos = new EventSource(`${API_BASE}/eventos`);
+    
+    fonteEventos.onopen = () => {
+        clearInterval(consultaStatusInterval);
+        consultaStatusInterval = null;
+    };
+    
+    // Stream recusado (503 sem threads ou limite atingido): o navegador não reconecta, consultar periodicamente
+    fonteEventos.onerror = () => {
+        if (fonteEventos && fonteEventos.readyState === EventSource.CLOSED) {
+            fonteEventos = null;
+            iniciarConsultaStatus();
+        }
+    };
+    
+    fonteEventos.addEventListener('presenca', (evento) => {
+        aplicarStatusLurk(JSON.parse(evento.data));
+    });
+    
+    // Usuário excluído ou eventos perdidos: consultar o status completo
+    fonteEventos.addEventListener('ranking', verificarStatusLurk);
+    fonteEventos.addEventListener('sincronizar', verificarStatusLurk);
+    
+    fonteEventos.addEventListener('agenda', () => {
+        carregarAgenda();
+        // Agenda nova: o canal e o horário da próxima troca podem ter mudado
+        trocarCanalAoVivo();
+    });
+}
+
+function iniciarConsultaStatus() {
+    if (!consultaStatusInterval) {
+        consultaStatusInterval = setInterval(verificarStatusLurk, INTERVALO_CONSULTA_STATUS);
+    }
+}
+
+// Enviar heartbeat de presença
+async function enviarHeartbeat() {
+    if (!lurkAtivo) {
+        return;
+    }
+    
+    try {
+        await fetch(`${API_BASE}/heartbeat`, { method: 'POST' });
+    } catch (error) {
+        console.error('Erro ao enviar heartbeat:', error);
+    }
+}
+
 // Carregar agenda do dia
 async function carregarAgenda() {
     const loadingSpinner = document.getElementById('loadingSpinner');